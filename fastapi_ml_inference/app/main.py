@@ -1,28 +1,514 @@
-from fastapi import FastAPI, HTTPException
-from models import TextInput, SearchQuery, SearchResponse
+from fastapi import FastAPI, HTTPException, Path, Query, Request
+from fastapi.responses import Response, StreamingResponse
+from models import (TextInput, TextBatchInput, IngestRecord, AddResponse, AddBatchResponse, SearchQuery, SearchResponse,
+                    SearchBatchQuery, SearchBatchResponse, VectorAddResponse)
 from services.embedding_service import EmbeddingService
-from services.vector_search import VectorSearch
-from utils.logger import logger
+from services.embedding_cache import EmbeddingCache, embedding_key
+from services.embedding_store import EmbeddingStore
+from services.model_pool import ModelPool
+from services.vector_search import MAX_DOC_ID, VectorSearch, assign_doc_ids
+from services.sharded_vector_search import ShardedVectorSearch
+from services.segmented_vector_search import SegmentedVectorSearch
+from services.micro_batcher import MicroBatcher
+from services.inference_executor import InferenceExecutor, InferenceQueueFullError
+from services.stream_ingest import iter_ndjson_lines, ingest_ndjson
+from services.bm25_index import BM25Index, reciprocal_rank_fusion
+from services.dedup import DedupIndex, resolve_duplicates
+from services.vector_codec import (ARROW_MEDIA_TYPE, RAW_MEDIA_TYPE, VECTOR_DTYPE, ArrowStreamWriter, UnsupportedFormatError,
+                                   hits_to_arrays, iter_raw_batches, read_arrow, record_dtype)
+from utils.logger import log_queue_handler, logger
+from utils.metrics import MetricsMiddleware, TimedRoute, record_stage, registry
 from utils.settings import get_settings
 from contextlib import asynccontextmanager
+from typing import Dict, Optional
+import asyncio
+import json
+import os
+import time
+import faiss
+import numpy as np
 
 # Get settings at the module level to configure logging before app initialization
 # This ensures logging is set up correctly based on debug mode from the start.
 settings = get_settings()
+# Models requests may select with "model"; the first is the default
+available_models = [settings.embedding_model] + [name for name in (part.strip() for part in settings.embedding_models.split(","))
+                                                 if name and name != settings.embedding_model]
+# FAISS's OpenMP pool is process-wide. Each shard thread runs its own FAISS
+# calls, so by default the cores are shared between the shards instead of
+# every call starting one OpenMP thread per core
+faiss.omp_set_num_threads(settings.faiss_omp_threads or max(1, (os.cpu_count() or 1) // settings.faiss_shards))
 # Initialize services
-embedding_service = EmbeddingService()
-vector_search = None  # Will be initialized after first embedding
+# The executor owns every model and index call so the event loop only does I/O
+inference_executor = InferenceExecutor(
+    max_workers=settings.inference_workers,
+    concurrency=settings.inference_concurrency,
+    max_queue_size=settings.inference_max_queue,
+    process_workers=settings.inference_process_workers,
+    model_name=settings.embedding_model,
+    encoder_options=dict(backend=settings.embedding_backend, onnx_dir=settings.embedding_onnx_dir,
+                         onnx_quantize=settings.embedding_onnx_quantize),
+)
+embedding_cache = None
+if settings.embedding_cache_max_bytes > 0:
+    # Shared by every model; its keys include the model name
+    embedding_cache = EmbeddingCache(settings.embedding_cache_max_bytes, settings.embedding_cache_ttl_seconds)
+# Each model's embedding store, once its namespace is open
+embedding_stores: Dict[str, EmbeddingStore] = {}
+
+def _load_embedding_service(model_name):
+    if settings.inference_process_workers > 0:
+        # The worker processes load the (only) model
+        return EmbeddingService(model_name, encoder=inference_executor.encode_in_process, cache=embedding_cache,
+                                store=embedding_stores.get(model_name))
+    return EmbeddingService(model_name, cache=embedding_cache, store=embedding_stores.get(model_name),
+                            backend=settings.embedding_backend, onnx_dir=settings.embedding_onnx_dir,
+                            onnx_quantize=settings.embedding_onnx_quantize)
+
+model_pool = ModelPool(_load_embedding_service, settings.embedding_pool_max_bytes)
+
+class Namespace:
+    """One embedding model's documents: its vector index, keyword index, dedup index and embedding store."""
+    __slots__ = ("model_name", "index_dir", "vector_search", "bm25_index", "dedup", "store")
+
+    def __init__(self, model_name, index_dir, vector_search, bm25_index, dedup, store):
+        self.model_name = model_name
+        self.index_dir = index_dir
+        self.vector_search = vector_search
+        # Keyword index over the same documents, for sparse and hybrid search
+        self.bm25_index = bm25_index
+        # Fingerprints of the same documents, so ingest can skip duplicates before encoding them
+        self.dedup = dedup
+        self.store = store
+
+# Opened at startup for the default model, on first use for the others
+namespaces: Dict[str, Namespace] = {}
+_namespace_locks: Dict[str, asyncio.Lock] = {}
+
+def _namespace_path(path, model_name):
+    # The default model keeps the configured paths, so existing snapshots and stores stay where they are
+    if not path or model_name == settings.embedding_model:
+        return path
+    return os.path.join(path, "models", model_name.replace("/", "__"))
+
+def _embed(model_name, texts, batch_size):
+    with model_pool.use(model_name) as service:
+        return service.generate_embeddings(texts, batch_size=batch_size)
+
+def _index_texts(namespace, embeddings, texts, doc_ids=None, metadata=None, fingerprints=None):
+    # fingerprints come from _check_duplicates when the texts were checked first
+    start = time.perf_counter()
+    doc_ids = namespace.vector_search.add_batch(embeddings, texts, doc_ids, metadata)
+    if namespace.store is not None:
+        # So the documents survive a restart even without a snapshot
+        namespace.store.append([embedding_key(namespace.model_name, text) for text in texts], embeddings, texts,
+                               doc_ids, metadata)
+    if namespace.bm25_index is not None:
+        namespace.bm25_index.add(doc_ids, texts)
+    if namespace.dedup is not None:
+        if fingerprints is None:
+            namespace.dedup.add_texts(doc_ids, texts, metadata)
+        else:
+            namespace.dedup.add(doc_ids, fingerprints)
+    record_stage("index_add", time.perf_counter() - start)
+    return doc_ids
+
+def _index_vectors(namespace, vectors, texts, doc_ids=None):
+    # Precomputed vectors skip the embedding store, which holds this model's outputs for texts
+    start = time.perf_counter()
+    doc_ids = namespace.vector_search.add_batch(vectors, texts, doc_ids)
+    if namespace.bm25_index is not None:
+        namespace.bm25_index.add(doc_ids, texts)
+    if namespace.dedup is not None:
+        # Not checked for duplicates (there is no encode to save), but later texts are checked against them
+        namespace.dedup.add_texts(doc_ids, texts)
+    record_stage("index_add", time.perf_counter() - start)
+    return doc_ids
+
+def _check_duplicates(namespace, texts, doc_ids=None, metadata=None):
+    """
+    (fingerprints, duplicates) of texts about to be indexed; see
+    DedupIndex.check. Texts with an explicit id are upserts and are always
+    indexed.
+    """
+    if namespace.dedup is None:
+        return None, [None] * len(texts)
+    start = time.perf_counter()
+    result = namespace.dedup.check(texts, metadata or [None] * len(texts),
+                                   [doc_id is not None for doc_id in doc_ids] if doc_ids else None)
+    record_stage("dedup", time.perf_counter() - start)
+    return result
+
+def _rebuild_from_store(namespace):
+    # Vectors come straight from the memory-mapped store, so no text is re-encoded;
+    # its document log restores the ids and metadata, upserts and deletes included
+    for embeddings, texts, doc_ids, metadata in namespace.store.documents():
+        namespace.vector_search.add_batch(embeddings, texts, doc_ids, metadata)
+        if namespace.bm25_index is not None:
+            namespace.bm25_index.add(doc_ids, texts)
+    # Ids of deleted documents are not handed out again
+    namespace.vector_search.reserve_doc_ids(namespace.store.next_doc_id)
+
+def _replay_store(namespace):
+    # A snapshot misses what was logged after the store's last checkpoint:
+    # upserts and deletes since then are applied on top of it
+    replayed = 0
+    for kind, change in namespace.store.changes(namespace.store.checkpointed):
+        if kind == "delete":
+            namespace.vector_search.delete(change)
+            replayed += len(change)
+        else:
+            replayed += len(namespace.vector_search.add_batch(*change))
+    namespace.vector_search.reserve_doc_ids(namespace.store.next_doc_id)
+    return replayed
+
+def _save_snapshot(namespace):
+    # Every store record up to here is already in the index, since the index
+    # is updated first; records logged while the snapshot is taken are replayed again
+    sequence = namespace.store.sequence if namespace.store is not None else None
+    namespace.vector_search.save(namespace.index_dir, settings.faiss_snapshot_compress_texts)
+    if sequence is not None:
+        namespace.store.checkpoint(sequence)
+
+def _rebuild_bm25(namespace):
+    # The BM25 index is not snapshotted; it is rebuilt from the loaded index's texts
+    for _, texts, doc_ids, _ in namespace.vector_search.iter_live():
+        namespace.bm25_index.add(doc_ids, texts)
+
+def _rebuild_dedup(namespace):
+    # Neither is the dedup index
+    for _, texts, doc_ids, metadata in namespace.vector_search.iter_live():
+        namespace.dedup.add_texts(doc_ids, texts, metadata)
+
+def _open_store(model_name, dimension):
+    if not settings.embedding_store_dir:
+        return None
+    store = EmbeddingStore(_namespace_path(settings.embedding_store_dir, model_name), dimension, model_name)
+    # Services loaded from now on look their store up here
+    embedding_stores[model_name] = store
+    return store
+
+def _open_namespace(model_name):
+    index_dir = _namespace_path(settings.faiss_index_dir, model_name)
+    rerank_path = settings.faiss_rerank_path or None
+    if rerank_path and model_name != settings.embedding_model:
+        rerank_path = f"{rerank_path}.{model_name.replace('/', '__')}"
+    search_settings = dict(
+        nprobe=settings.faiss_nprobe,
+        ef_search=settings.faiss_ef_search,
+        rerank_factor=settings.faiss_rerank_factor,
+        filter_exact_threshold=settings.faiss_filter_exact_threshold,
+    )
+    # All three classes share one interface; sharded and segmented snapshots keep their own layout
+    if settings.faiss_shards > 1:
+        index_class = ShardedVectorSearch
+    elif settings.faiss_segment_size > 0:
+        index_class = SegmentedVectorSearch
+    else:
+        index_class = VectorSearch
+    bm25_index = BM25Index(settings.bm25_k1, settings.bm25_b) if settings.bm25_enabled else None
+    dedup = None
+    if settings.dedup_exact or settings.dedup_near_threshold > 0:
+        dedup = DedupIndex(settings.dedup_exact, settings.dedup_near_threshold, settings.dedup_minhash_permutations,
+                           settings.dedup_minhash_bands)
+    loaded_snapshot = settings.faiss_snapshot and index_class.latest_snapshot(index_dir) is not None
+    if loaded_snapshot:
+        # No model needed: it loads on the first request that encodes text
+        vector_search = index_class.load(index_dir, mmap=settings.faiss_snapshot_mmap, rerank_path=rerank_path,
+                                         **search_settings)
+        store = _open_store(model_name, vector_search.dimension)
+    else:
+        # Initialize vector search with embedding dimension
+        with model_pool.use(model_name) as service:
+            dimension = service.embedding_dimension()
+            service.store = store = _open_store(model_name, dimension)
+        if index_class is ShardedVectorSearch:
+            search_settings.update(shards=settings.faiss_shards, placement=settings.faiss_shard_placement)
+        elif index_class is SegmentedVectorSearch:
+            search_settings.update(segment_size=settings.faiss_segment_size, max_segments=settings.faiss_max_segments)
+        vector_search = index_class(
+            dimension=dimension,
+            index_type=settings.faiss_index_type,
+            nlist=settings.faiss_nlist,
+            hnsw_m=settings.faiss_hnsw_m,
+            pq_m=settings.faiss_pq_m,
+            train_size=settings.faiss_train_size,
+            storage=settings.faiss_storage,
+            rerank_path=rerank_path,
+            **search_settings,
+        )
+    namespace = Namespace(model_name, index_dir, vector_search, bm25_index, dedup, store)
+    if store is not None and loaded_snapshot:
+        replayed = _replay_store(namespace)
+        logger.info(f"Replayed {replayed} changes of {model_name} from the embedding store onto the snapshot")
+    if loaded_snapshot and bm25_index is not None:
+        _rebuild_bm25(namespace)
+        logger.info(f"Rebuilt BM25 index of {model_name} with {len(bm25_index)} documents")
+    if store is not None and not loaded_snapshot:
+        _rebuild_from_store(namespace)
+        logger.info(f"Rebuilt index of {model_name} with {vector_search.ntotal} documents from the embedding store")
+    if dedup is not None and vector_search.ntotal:
+        _rebuild_dedup(namespace)
+        logger.info(f"Rebuilt dedup index of {model_name} with {len(dedup)} documents")
+    return namespace
+
+def _close_namespace(namespace):
+    if settings.faiss_snapshot and namespace.vector_search.has_unsaved_changes:
+        _save_snapshot(namespace)
+    if isinstance(namespace.vector_search, ShardedVectorSearch):
+        namespace.vector_search.close()
+    if namespace.store is not None:
+        namespace.store.close()
+
+def _check_model(model_name):
+    """The model a request selects, or a 422 if the service doesn't host it."""
+    model_name = model_name or settings.embedding_model
+    if model_name not in available_models:
+        raise HTTPException(status_code=422, detail=f"Unknown model {model_name!r}, expected one of {available_models}")
+    return model_name
+
+async def _namespace(model_name):
+    """The namespace of a model checked by _check_model, opened on its first use."""
+    namespace = namespaces.get(model_name)
+    if namespace is not None:
+        return namespace
+    lock = _namespace_locks.setdefault(model_name, asyncio.Lock())
+    async with lock:
+        if model_name not in namespaces:
+            namespaces[model_name] = await inference_executor.run(_open_namespace, model_name)
+            logger.info(f"Opened namespace of {model_name} with {namespaces[model_name].vector_search.ntotal} vectors")
+    return namespaces[model_name]
+
+def _delete_documents(namespace, doc_ids):
+    deleted = namespace.vector_search.delete(doc_ids)
+    if namespace.bm25_index is not None:
+        namespace.bm25_index.delete(doc_ids)
+    if namespace.dedup is not None:
+        namespace.dedup.remove(doc_ids)
+    if namespace.store is not None:
+        namespace.store.delete(doc_ids)
+    return deleted
+
+def _group_by_model(items):
+    # Model name -> positions of the items (tuples starting with the model name) that use it
+    groups = {}
+    for position, item in enumerate(items):
+        groups.setdefault(item[0], []).append(position)
+    return groups
+
+def _add_handler(items):
+    # items are (model, text, doc_id or None, metadata); one forward pass and
+    # one index add per model for every /add and upsert request in the window.
+    # Returns (doc_id, duplicate kind or None) per item; duplicates get the
+    # existing document's id and are not encoded
+    results = [None] * len(items)
+    for model_name, positions in _group_by_model(items).items():
+        namespace = namespaces[model_name]
+        texts = [items[position][1] for position in positions]
+        given_ids = [items[position][2] for position in positions]
+        metadata = [items[position][3] for position in positions]
+        fingerprints, duplicates = _check_duplicates(namespace, texts, given_ids, metadata)
+        fresh = [row for row, duplicate in enumerate(duplicates) if duplicate is None]
+        added = []
+        if fresh:
+            fresh_texts = [texts[row] for row in fresh]
+            embeddings = _embed(model_name, fresh_texts, len(fresh_texts))
+            added = _index_texts(namespace, embeddings, fresh_texts, [given_ids[row] for row in fresh],
+                                 [metadata[row] for row in fresh], fingerprints and [fingerprints[row] for row in fresh])
+        for position, doc_id, duplicate in zip(positions, resolve_duplicates(duplicates, added), duplicates):
+            results[position] = doc_id, duplicate.kind if duplicate is not None else None
+    return results
+
+def _count_duplicates(kinds):
+    return {"exact_duplicates": sum(kind == "exact" for kind in kinds),
+            "near_duplicates": sum(kind == "near" for kind in kinds)}
+
+def _search_handler(queries):
+    # queries are (model, text, k, nprobe, ef_search, rerank, filter); encode all of
+    # a model's at once, then search once per distinct parameter set with the
+    # largest k and trim per caller
+    embeddings = [None] * len(queries)
+    for model_name, positions in _group_by_model(queries).items():
+        for position, embedding in zip(positions, _embed(model_name, [queries[position][1] for position in positions],
+                                                         len(positions))):
+            embeddings[position] = embedding
+    groups = {}
+    for position, query in enumerate(queries):
+        groups.setdefault((query[0],) + query[3:], []).append(position)
+    results = [None] * len(queries)
+    start = time.perf_counter()
+    for (model_name, nprobe, ef_search, rerank, filter), positions in groups.items():
+        k = max(queries[position][2] for position in positions)
+        batch_results, stats = namespaces[model_name].vector_search.search_batch(
+            np.stack([embeddings[position] for position in positions]), k, nprobe=nprobe, ef_search=ef_search,
+            rerank=rerank, return_stats=True, filter=dict(filter))
+        for position, hits, query_stats in zip(positions, batch_results, stats):
+            results[position] = (hits[:queries[position][2]], query_stats["recall_loss"])
+    record_stage("index_search", time.perf_counter() - start)
+    return results
+
+def _sparse_search(model_name, text, k, filter):
+    namespace = namespaces[model_name]
+    doc_ids, scores = namespace.bm25_index.search(text, limit=None if filter else k)
+    hits = []
+    # Resolve texts (and the filter) through the vector index, in score order
+    # until k documents qualify; without a filter the first chunk has them all
+    chunk = max(4 * k, 64)
+    for start in range(0, len(doc_ids), chunk):
+        chunk_ids = doc_ids[start:start + chunk].tolist()
+        texts = namespace.vector_search.documents(chunk_ids, dict(filter) if filter else None)
+        hits += [{"id": doc_id, "text": text, "similarity": score}
+                 for doc_id, text, score in zip(chunk_ids, texts, scores[start:start + chunk].tolist()) if text is not None]
+        if len(hits) >= k:
+            break
+    return hits[:k]
+
+def _sparse_handler(queries):
+    # queries are (model, text, k, filter)
+    start = time.perf_counter()
+    results = [_sparse_search(*query) for query in queries]
+    record_stage("bm25_search", time.perf_counter() - start)
+    return results
+
+def _candidates(query):
+    # Fusion works on more hits than it returns, so documents ranked just
+    # below k on one side can still win with support from the other
+    return query.k * settings.hybrid_candidate_factor if query.mode == "hybrid" else query.k
+
+def _dense_query(query, model_name):
+    return (model_name, query.query, _candidates(query), query.nprobe, query.ef_search, query.rerank,
+            _freeze_filter(query.filter))
+
+def _sparse_query(query, model_name):
+    return (model_name, query.query, _candidates(query), _freeze_filter(query.filter))
+
+def _combine(query, dense, sparse_hits):
+    """(hits, recall_loss) for `query` from its dense (hits, recall_loss) and/or sparse hits."""
+    if query.mode == "dense":
+        return dense
+    if query.mode == "sparse":
+        return sparse_hits, None
+    hits, recall_loss = dense
+    return reciprocal_rank_fusion([hits, sparse_hits], query.k, settings.hybrid_rrf_k), recall_loss
+
+def _check_mode(queries):
+    if not settings.bm25_enabled and any(query.mode != "dense" for query in queries):
+        raise HTTPException(status_code=422, detail="Sparse and hybrid search need BM25_ENABLED")
+
+def _freeze_filter(filter):
+    # Hashable form, so queries with equal filters share one index search
+    return tuple(sorted((field, tuple(values) if isinstance(values, list) else (values,))
+                        for field, values in (filter or {}).items()))
+
+# Read at scrape time; the service keeps these numbers anyway
+registry.gauge("index_documents", "Live documents in the vector indexes of all models",
+               lambda: sum(namespace.vector_search.ntotal for namespace in list(namespaces.values())))
+registry.gauge("index_tombstone_ratio", "Share of stored vectors that are deleted or replaced, in the worst index",
+               lambda: max((namespace.vector_search.tombstone_ratio for namespace in list(namespaces.values())), default=None))
+registry.gauge("embedding_models_loaded", "Embedding models currently loaded", lambda: len(model_pool.loaded()))
+registry.gauge("embedding_model_bytes", "Estimated memory held by the loaded embedding models", lambda: model_pool.current_bytes)
+registry.gauge("embedding_model_loads_total", "Embedding model loads", lambda: model_pool.loads, kind="counter")
+registry.gauge("embedding_model_evictions_total", "Embedding models unloaded to stay within EMBEDDING_POOL_MAX_BYTES",
+               lambda: model_pool.evictions, kind="counter")
+registry.gauge("log_dropped_records_total", "Log records dropped because the log queue was full",
+               lambda: log_queue_handler.dropped, kind="counter")
+registry.gauge("dedup_exact_duplicates_total", "Texts skipped at ingest as exact duplicates of indexed documents",
+               lambda: sum(namespace.dedup.exact_duplicates for namespace in list(namespaces.values())
+                           if namespace.dedup is not None), kind="counter")
+registry.gauge("dedup_near_duplicates_total", "Texts skipped at ingest as near-duplicates of indexed documents",
+               lambda: sum(namespace.dedup.near_duplicates for namespace in list(namespaces.values())
+                           if namespace.dedup is not None), kind="counter")
+registry.gauge("inference_pending_jobs", "Jobs running or waiting on the inference executor",
+               lambda: inference_executor.pending)
+if embedding_cache is not None:
+    registry.gauge("embedding_cache_hits_total", "Embedding cache hits", lambda: embedding_cache.hits, kind="counter")
+    registry.gauge("embedding_cache_misses_total", "Embedding cache misses", lambda: embedding_cache.misses, kind="counter")
+    registry.gauge("embedding_cache_hit_ratio", "Embedding cache hits per lookup", lambda: embedding_cache.stats()["hit_rate"])
+    registry.gauge("embedding_cache_bytes", "Bytes held by the embedding cache", lambda: embedding_cache.current_bytes)
+
+def _check_add_item(item):
+    # Rejects the one caller before its item joins a batch, so it can't fail the others
+    _, text, doc_id, _ = item
+    if not isinstance(text, str) or not text:
+        raise ValueError("Text must be a non-empty string")
+    if doc_id is not None:
+        assign_doc_ids([doc_id], 0)
+
+add_batcher = MicroBatcher(_add_handler, settings.batch_window_ms, settings.max_batch_size,
+                           name="add batcher", executor=inference_executor, validate=_check_add_item)
+# Searches change nothing, so a failed batch can be retried query by query
+search_batcher = MicroBatcher(_search_handler, settings.batch_window_ms, settings.max_batch_size,
+                              name="search batcher", executor=inference_executor, retry_singly=True)
+
+async def _compact_periodically():
+    while True:
+        await asyncio.sleep(settings.compaction_check_interval_seconds)
+        for namespace in list(namespaces.values()):
+            if namespace.vector_search.tombstone_ratio >= settings.compaction_tombstone_ratio:
+                try:
+                    await inference_executor.run(namespace.vector_search.compact)
+                except Exception as e:
+                    logger.error(f"Compaction of {namespace.model_name} failed: {str(e)}")
+            if namespace.bm25_index is not None and namespace.bm25_index.dead_ratio >= settings.compaction_tombstone_ratio:
+                try:
+                    await inference_executor.run(namespace.bm25_index.compact)
+                except Exception as e:
+                    logger.error(f"BM25 compaction of {namespace.model_name} failed: {str(e)}")
+
+async def _merge_segments_periodically():
+    while True:
+        await asyncio.sleep(settings.faiss_merge_interval_seconds)
+        for namespace in list(namespaces.values()):
+            try:
+                await inference_executor.run(namespace.vector_search.merge)
+            except Exception as e:
+                logger.error(f"Segment merge of {namespace.model_name} failed: {str(e)}")
+
+async def _snapshot_periodically():
+    while True:
+        await asyncio.sleep(settings.faiss_snapshot_interval_seconds)
+        for namespace in list(namespaces.values()):
+            if namespace.vector_search.has_unsaved_changes:
+                try:
+                    await inference_executor.run(_save_snapshot, namespace)
+                except Exception as e:
+                    logger.error(f"Periodic snapshot of {namespace.model_name} failed: {str(e)}")
 
 @asynccontextmanager
 async def lifespan(app: FastAPI):
-    global vector_search
-    # Initialize vector search with embedding dimension
-    sample_embedding = embedding_service.generate_embedding("sample text")
-    vector_search = VectorSearch(dimension=sample_embedding.shape[0])
-    logger.info("FastAPI application started")
+    start = time.perf_counter()
+    if len(available_models) > 1 and settings.inference_process_workers > 0:
+        raise ValueError("EMBEDDING_MODELS needs INFERENCE_PROCESS_WORKERS=0; worker processes load a single model")
+    if settings.faiss_shards > 1 and settings.faiss_segment_size > 0:
+        raise ValueError("FAISS_SEGMENT_SIZE needs FAISS_SHARDS=1; sharded indexes are not segmented")
+    namespace = await _namespace(settings.embedding_model)
+    add_batcher.start()
+    search_batcher.start()
+    snapshot_task = None
+    if settings.faiss_snapshot and settings.faiss_snapshot_interval_seconds > 0:
+        snapshot_task = asyncio.create_task(_snapshot_periodically())
+    compaction_task = None
+    merge_task = None
+    if settings.faiss_segment_size > 0:
+        merge_task = asyncio.create_task(_merge_segments_periodically())
+    if settings.compaction_tombstone_ratio > 0:
+        compaction_task = asyncio.create_task(_compact_periodically())
+    logger.info(f"FastAPI application started in {time.perf_counter() - start:.2f}s with {namespace.vector_search.ntotal} vectors"
+                f" (models: {available_models})")
     
     yield
     # Cleanup here
+    if snapshot_task is not None:
+        snapshot_task.cancel()
+    if compaction_task is not None:
+        compaction_task.cancel()
+    if merge_task is not None:
+        merge_task.cancel()
+    await add_batcher.stop()
+    await search_batcher.stop()
+    for namespace in list(namespaces.values()):
+        await inference_executor.run(_close_namespace, namespace)
+    inference_executor.shutdown()
 
 app = FastAPI(
     title="FastAPI ML Inference Service with Vector Search",
@@ -30,31 +516,442 @@ app = FastAPI(
     version="1.0.0",
     lifespan=lifespan 
 )
+# Per-stage timings of each request go to /metrics and the Server-Timing header
+app.router.route_class = TimedRoute
+app.add_middleware(MetricsMiddleware)
 
 @app.get("/health")
 async def health_check():
     return {"status": "healthy"}
 
-@app.post("/add")
+@app.get("/metrics")
+async def metrics():
+    return Response(registry.render(), media_type="text/plain; version=0.0.4")
+
+@app.post("/add", response_model=AddResponse)
 async def add_text(input: TextInput):
+    model_name = _check_model(input.model)
     try:
-        embedding = embedding_service.generate_embedding(input.text)
-        vector_search.add(embedding, input.text)
-        return {"message": "Text added successfully"}
+        await _namespace(model_name)
+        doc_id, duplicate = await add_batcher.submit((model_name, input.text, None, input.metadata))
+        if duplicate is not None:
+            return AddResponse(message="Text already indexed", id=doc_id, duplicate=duplicate)
+        return AddResponse(message="Text added successfully", id=doc_id)
+    except InferenceQueueFullError as e:
+        raise HTTPException(status_code=503, detail=str(e))
     except Exception as e:
         logger.error(f"Error in /add endpoint: {str(e)}")
         raise HTTPException(status_code=500, detail=str(e))
 
+@app.post("/add_batch", response_model=AddBatchResponse)
+async def add_text_batch(input: TextBatchInput):
+    if any(not text for text in input.texts):
+        raise HTTPException(status_code=422, detail="Texts must not be empty")
+    if input.ids is not None and len(input.ids) != len(input.texts):
+        raise HTTPException(status_code=422, detail="ids must have one entry per text")
+    if input.metadata is not None and len(input.metadata) != len(input.texts):
+        raise HTTPException(status_code=422, detail="metadata must have one entry per text")
+    model_name = _check_model(input.model)
+    try:
+        namespace = await _namespace(model_name)
+        start = time.perf_counter()
+        fingerprints, duplicates = await inference_executor.run(_check_duplicates, namespace, input.texts, input.ids,
+                                                                input.metadata)
+        checked = encoded = indexed = time.perf_counter()
+        fresh = [row for row, duplicate in enumerate(duplicates) if duplicate is None]
+        added = []
+        if fresh:
+            texts = [input.texts[row] for row in fresh]
+            embeddings = await inference_executor.run(_embed, model_name, texts, input.batch_size)
+            encoded = time.perf_counter()
+            added = await inference_executor.run(
+                _index_texts, namespace, embeddings, texts, input.ids and [input.ids[row] for row in fresh],
+                input.metadata and [input.metadata[row] for row in fresh], fingerprints and [fingerprints[row] for row in fresh])
+            indexed = time.perf_counter()
+        count = len(input.texts)
+        return AddBatchResponse(
+            message="Texts added successfully",
+            count=count,
+            ids=resolve_duplicates(duplicates, added),
+            batch_size=input.batch_size,
+            encode_seconds=encoded - checked,
+            index_seconds=indexed - encoded,
+            texts_per_second=count / max(indexed - start, 1e-9),
+            **_count_duplicates([duplicate.kind for duplicate in duplicates if duplicate is not None]),
+        )
+    except InferenceQueueFullError as e:
+        raise HTTPException(status_code=503, detail=str(e))
+    except Exception as e:
+        logger.error(f"Error in /add_batch endpoint: {str(e)}")
+        raise HTTPException(status_code=500, detail=str(e))
+
 @app.post("/search", response_model=SearchResponse)
 async def search(query: SearchQuery):
+    _check_mode([query])
+    model_name = _check_model(query.model)
     try:
-        query_embedding = embedding_service.generate_embedding(query.query)
-        results = vector_search.search(query_embedding, query.k)
-        return SearchResponse(results=results)
+        namespace = await _namespace(model_name)
+        # Dense (batched with other requests) and BM25 lookups run side by side
+        dense = search_batcher.submit(_dense_query(query, model_name)) if query.mode != "sparse" else None
+        sparse = inference_executor.run(_sparse_handler, [_sparse_query(query, model_name)]) if query.mode != "dense" else None
+        outputs = await asyncio.gather(*[lookup for lookup in (dense, sparse) if lookup is not None])
+        results, recall_loss = _combine(query, outputs[0] if dense is not None else None,
+                                        outputs[-1][0] if sparse is not None else None)
+        return SearchResponse(results=results, bytes_per_vector=namespace.vector_search.bytes_per_vector(),
+                              recall_loss=recall_loss)
+    except InferenceQueueFullError as e:
+        raise HTTPException(status_code=503, detail=str(e))
     except Exception as e:
         logger.error(f"Error in /search endpoint: {str(e)}")
         raise HTTPException(status_code=500, detail=str(e))
 
+def _parse_ingest_line(line: bytes):
+    record = IngestRecord.model_validate_json(line)
+    model_name = record.model or settings.embedding_model
+    if model_name not in available_models:
+        raise ValueError(f"Unknown model {model_name!r}, expected one of {available_models}")
+    return model_name, record.text, record.id, record.metadata
+
+async def _run_when_ready(fn, *args):
+    # Wait for room instead of failing: a stream that outpaces the executor is
+    # slowed down here, and through the unread request body, the client too
+    while True:
+        try:
+            return await inference_executor.run(fn, *args)
+        except InferenceQueueFullError:
+            await asyncio.sleep(0.05)
+
+async def _index_ingest_batch(items):
+    for model_name in {item[0] for item in items}:
+        await _namespace(model_name)
+    results = await _run_when_ready(_add_handler, items)
+    # Summed into the progress records
+    return _count_duplicates([duplicate for _, duplicate in results])
+
+class _RequestStreamingResponse(StreamingResponse):
+    # The body iterator reads the request itself and notices a disconnect
+    # there; StreamingResponse's own disconnect listener would swallow the
+    # request body messages it needs
+    async def __call__(self, scope, receive, send):
+        await self.stream_response(send)
+
+@app.post("/ingest/stream")
+async def ingest_stream(request: Request):
+    async def progress():
+        try:
+            async for record in ingest_ndjson(iter_ndjson_lines(request.stream(), settings.ingest_max_line_bytes),
+                                              _parse_ingest_line, _index_ingest_batch, settings.ingest_batch_size):
+                yield json.dumps(record) + "\n"
+        except Exception as e:
+            logger.error(f"Error in /ingest/stream endpoint: {str(e)}")
+            yield json.dumps({"done": False, "error": str(e)}) + "\n"
+
+    return _RequestStreamingResponse(progress(), media_type="application/x-ndjson")
+
+@app.post("/search_batch", response_model=SearchBatchResponse)
+async def search_batch(batch: SearchBatchQuery):
+    if len(batch.queries) > settings.search_batch_max_queries:
+        raise HTTPException(status_code=413,
+                            detail=f"At most {settings.search_batch_max_queries} queries per request, got {len(batch.queries)}")
+    _check_mode(batch.queries)
+    model_names = [_check_model(query.model) for query in batch.queries]
+    try:
+        for model_name in set(model_names):
+            await _namespace(model_name)
+        results = []
+        # One encode call and one index search per chunk (per distinct search
+        # parameters); separate executor jobs let other requests run in between.
+        # A chunk's BM25 lookups run alongside its dense search.
+        for start in range(0, len(batch.queries), settings.search_batch_chunk_size):
+            chunk = batch.queries[start:start + settings.search_batch_chunk_size]
+            chunk_models = model_names[start:start + settings.search_batch_chunk_size]
+            dense_positions = [position for position, query in enumerate(chunk) if query.mode != "sparse"]
+            sparse_positions = [position for position, query in enumerate(chunk) if query.mode != "dense"]
+            lookups = []
+            if dense_positions:
+                lookups.append(inference_executor.run(_search_handler, [_dense_query(chunk[position], chunk_models[position])
+                                                                       for position in dense_positions]))
+            if sparse_positions:
+                lookups.append(inference_executor.run(_sparse_handler, [_sparse_query(chunk[position], chunk_models[position])
+                                                                       for position in sparse_positions]))
+            outputs = await asyncio.gather(*lookups)
+            dense = dict(zip(dense_positions, outputs[0])) if dense_positions else {}
+            sparse = dict(zip(sparse_positions, outputs[-1])) if sparse_positions else {}
+            results += [_combine(query, dense.get(position), sparse.get(position)) for position, query in enumerate(chunk)]
+        bytes_per_vector = {model_name: namespaces[model_name].vector_search.bytes_per_vector() for model_name in set(model_names)}
+        return SearchBatchResponse(results=[
+            SearchResponse(results=hits, bytes_per_vector=bytes_per_vector[model_name], recall_loss=recall_loss)
+            for (hits, recall_loss), model_name in zip(results, model_names)
+        ])
+    except InferenceQueueFullError as e:
+        raise HTTPException(status_code=503, detail=str(e))
+    except Exception as e:
+        logger.error(f"Error in /search_batch endpoint: {str(e)}")
+        raise HTTPException(status_code=500, detail=str(e))
+
+@app.put("/documents/{doc_id}", response_model=AddResponse)
+async def upsert_document(input: TextInput, doc_id: int = Path(ge=0, le=MAX_DOC_ID)):
+    model_name = _check_model(input.model)
+    try:
+        await _namespace(model_name)
+        await add_batcher.submit((model_name, input.text, doc_id, input.metadata))
+        return AddResponse(message="Document upserted successfully", id=doc_id)
+    except InferenceQueueFullError as e:
+        raise HTTPException(status_code=503, detail=str(e))
+    except Exception as e:
+        logger.error(f"Error in PUT /documents endpoint: {str(e)}")
+        raise HTTPException(status_code=500, detail=str(e))
+
+@app.delete("/documents/{doc_id}")
+async def delete_document(doc_id: int = Path(ge=0, le=MAX_DOC_ID), model: Optional[str] = None):
+    model_name = _check_model(model)
+    try:
+        deleted = await inference_executor.run(_delete_documents, await _namespace(model_name), [doc_id])
+    except InferenceQueueFullError as e:
+        raise HTTPException(status_code=503, detail=str(e))
+    except Exception as e:
+        logger.error(f"Error in DELETE /documents endpoint: {str(e)}")
+        raise HTTPException(status_code=500, detail=str(e))
+    if not deleted:
+        raise HTTPException(status_code=404, detail=f"Document {doc_id} not found")
+    return {"message": "Document deleted successfully", "id": doc_id}
+
+def _media_type(header, default=RAW_MEDIA_TYPE):
+    return (header or default).split(";")[0].strip().lower()
+
+def _wants_arrow(request: Request) -> bool:
+    # Raw unless the client asks for Arrow
+    return ARROW_MEDIA_TYPE in _media_type(request.headers.get("accept"), "")
+
+def _check_vectors(vectors):
+    if not np.isfinite(vectors).all():
+        raise ValueError("Vectors must not contain NaN or infinity")
+
+def _raw_vectors(body: bytes, dimension: int):
+    row_bytes = dimension * VECTOR_DTYPE.itemsize
+    if len(body) % row_bytes:
+        raise ValueError(f"Body of {len(body)} bytes is not a whole number of {dimension}-dimensional float32 vectors")
+    # A view of the request body, not a copy
+    return np.frombuffer(body, dtype=VECTOR_DTYPE).reshape(-1, dimension)
+
+async def _read_query_vectors(request: Request, dimension: int):
+    media_type = _media_type(request.headers.get("content-type"))
+    body = await request.body()
+    if media_type == RAW_MEDIA_TYPE:
+        vectors = _raw_vectors(body, dimension)
+    elif media_type == ARROW_MEDIA_TYPE:
+        batches = [vectors for vectors, _, _ in read_arrow(body, dimension)]
+        vectors = np.concatenate(batches) if batches else np.zeros((0, dimension), dtype=VECTOR_DTYPE)
+    else:
+        raise UnsupportedFormatError(f"Unsupported content type {media_type!r}, expected {RAW_MEDIA_TYPE} or {ARROW_MEDIA_TYPE}")
+    _check_vectors(vectors)
+    return vectors
+
+def _vector_search_handler(namespace, vectors, k, nprobe, ef_search, rerank, return_vectors):
+    vector_search = namespace.vector_search
+    start = time.perf_counter()
+    batch_results = vector_search.search_batch(vectors, k, nprobe=nprobe, ef_search=ef_search, rerank=rerank)
+    record_stage("index_search", time.perf_counter() - start)
+    ids, similarities = hits_to_arrays(batch_results, k)
+    texts = [[hit["text"] for hit in hits] for hits in batch_results]
+    # Padding ids (-1) come back as NaN rows
+    hit_vectors = vector_search.vectors(ids.reshape(-1).tolist()).reshape(len(ids), k, -1) if return_vectors else None
+    return ids, similarities, texts, hit_vectors
+
+@app.post("/vectors/add", response_model=VectorAddResponse)
+async def add_vectors(request: Request, model: Optional[str] = None):
+    """
+    Adds precomputed vectors. The body is either raw little-endian float32
+    vectors back to back (application/octet-stream), indexed in batches as it
+    streams in, or an Arrow IPC stream (application/vnd.apache.arrow.stream)
+    with a `vector` column of float32 lists and optional `text` and `id`
+    columns.
+    """
+    media_type = _media_type(request.headers.get("content-type"))
+    model_name = _check_model(model)
+    doc_ids = []
+    try:
+        namespace = await _namespace(model_name)
+        dimension = namespace.vector_search.dimension
+        if media_type == RAW_MEDIA_TYPE:
+            async for chunk in iter_raw_batches(request.stream(), dimension * VECTOR_DTYPE.itemsize, settings.ingest_batch_size):
+                vectors = np.frombuffer(chunk, dtype=VECTOR_DTYPE).reshape(-1, dimension)
+                _check_vectors(vectors)
+                doc_ids += await _run_when_ready(_index_vectors, namespace, vectors, [""] * len(vectors))
+        elif media_type == ARROW_MEDIA_TYPE:
+            for vectors, texts, ids in read_arrow(await request.body(), dimension):
+                _check_vectors(vectors)
+                doc_ids += await _run_when_ready(_index_vectors, namespace, vectors, texts or [""] * len(vectors), ids)
+        else:
+            raise UnsupportedFormatError(f"Unsupported content type {media_type!r}, expected {RAW_MEDIA_TYPE} or {ARROW_MEDIA_TYPE}")
+    except UnsupportedFormatError as e:
+        raise HTTPException(status_code=415, detail=str(e))
+    except ValueError as e:
+        # Batches before the bad one are already indexed
+        raise HTTPException(status_code=422, detail=f"{str(e)} ({len(doc_ids)} vectors were added before the error)")
+    except Exception as e:
+        logger.error(f"Error in /vectors/add endpoint: {str(e)}")
+        raise HTTPException(status_code=500, detail=str(e))
+    return VectorAddResponse(message="Vectors added successfully", count=len(doc_ids), ids=doc_ids)
+
+@app.post("/vectors/search")
+async def search_vectors(request: Request, k: int = Query(5, ge=1, le=100), nprobe: Optional[int] = Query(None, ge=1, le=65536),
+                         ef_search: Optional[int] = Query(None, ge=1, le=4096), rerank: Optional[bool] = None,
+                         return_vectors: bool = False, model: Optional[str] = None):
+    """
+    Searches with precomputed query vectors, sent raw or as Arrow like
+    /vectors/add. With `Accept: application/vnd.apache.arrow.stream` the
+    hits come back as Arrow (query, id, similarity, text and, with
+    `return_vectors`, vector columns); otherwise as raw little-endian arrays
+    back to back: int64 ids [queries, k], float32 similarities [queries, k]
+    and, with `return_vectors`, float32 vectors [queries, k, dimension].
+    Missing hits are id -1, similarity 0 and a NaN vector.
+    """
+    model_name = _check_model(model)
+    try:
+        namespace = await _namespace(model_name)
+        dimension = namespace.vector_search.dimension
+        vectors = await _read_query_vectors(request, dimension)
+        if len(vectors) > settings.search_batch_max_queries:
+            raise HTTPException(status_code=413,
+                                detail=f"At most {settings.search_batch_max_queries} queries per request, got {len(vectors)}")
+        chunks = [await inference_executor.run(_vector_search_handler, namespace, vectors[start:start + settings.search_batch_chunk_size],
+                                               k, nprobe, ef_search, rerank, return_vectors)
+                  for start in range(0, len(vectors), settings.search_batch_chunk_size)]
+    except HTTPException:
+        raise
+    except UnsupportedFormatError as e:
+        raise HTTPException(status_code=415, detail=str(e))
+    except ValueError as e:
+        raise HTTPException(status_code=422, detail=str(e))
+    except InferenceQueueFullError as e:
+        raise HTTPException(status_code=503, detail=str(e))
+    except Exception as e:
+        logger.error(f"Error in /vectors/search endpoint: {str(e)}")
+        raise HTTPException(status_code=500, detail=str(e))
+    headers = {"X-Queries": str(len(vectors)), "X-K": str(k), "X-Dimension": str(dimension)}
+    if _wants_arrow(request):
+        columns = [("query", "int32"), ("id", "int64"), ("similarity", "float32"), ("text", "string")]
+        writer = ArrowStreamWriter(columns + ([("vector", "vector")] if return_vectors else []), dimension)
+        body = []
+        offset = 0
+        for ids, similarities, texts, hit_vectors in chunks:
+            # One row per hit; padding is dropped
+            found = ids >= 0
+            body.append(writer.write({
+                "query": np.nonzero(found)[0].astype(np.int32) + offset,
+                "id": ids[found],
+                "similarity": similarities[found],
+                "text": [text for hits in texts for text in hits],
+                "vector": hit_vectors[found] if hit_vectors is not None else None,
+            }))
+            offset += len(ids)
+        body.append(writer.close())
+        return Response(b"".join(body), media_type=ARROW_MEDIA_TYPE, headers=headers)
+    parts = [np.concatenate([chunk[0] for chunk in chunks]) if chunks else np.zeros((0, k), dtype=np.int64),
+             np.concatenate([chunk[1] for chunk in chunks]) if chunks else np.zeros((0, k), dtype=VECTOR_DTYPE)]
+    if return_vectors:
+        parts.append(np.concatenate([chunk[3] for chunk in chunks]) if chunks
+                     else np.zeros((0, k, dimension), dtype=VECTOR_DTYPE))
+    return Response(b"".join(part.tobytes() for part in parts), media_type=RAW_MEDIA_TYPE, headers=headers)
+
+@app.post("/vectors/get")
+async def get_vectors(request: Request, model: Optional[str] = None):
+    """
+    Stored vectors of the documents whose ids make up the body, as raw
+    little-endian int64 (or an Arrow stream with an `id` column). Returns raw
+    float32 vectors [ids, dimension], NaN for unknown ids, or with an Arrow
+    Accept header, Arrow id and vector columns of the documents found.
+    """
+    media_type = _media_type(request.headers.get("content-type"))
+    model_name = _check_model(model)
+    try:
+        namespace = await _namespace(model_name)
+        dimension = namespace.vector_search.dimension
+        body = await request.body()
+        if media_type == RAW_MEDIA_TYPE:
+            if len(body) % 8:
+                raise ValueError(f"Body of {len(body)} bytes is not a whole number of int64 ids")
+            doc_ids = np.frombuffer(body, dtype="<i8").tolist()
+        elif media_type == ARROW_MEDIA_TYPE:
+            doc_ids = [doc_id for _, _, ids in read_arrow(body, dimension, vectors=False) for doc_id in ids or []]
+        else:
+            raise UnsupportedFormatError(f"Unsupported content type {media_type!r}, expected {RAW_MEDIA_TYPE} or {ARROW_MEDIA_TYPE}")
+        vectors = await inference_executor.run(namespace.vector_search.vectors, doc_ids)
+    except UnsupportedFormatError as e:
+        raise HTTPException(status_code=415, detail=str(e))
+    except ValueError as e:
+        raise HTTPException(status_code=422, detail=str(e))
+    except InferenceQueueFullError as e:
+        raise HTTPException(status_code=503, detail=str(e))
+    except Exception as e:
+        logger.error(f"Error in /vectors/get endpoint: {str(e)}")
+        raise HTTPException(status_code=500, detail=str(e))
+    found = ~np.isnan(vectors[:, 0]) if len(vectors) else np.zeros(0, dtype=bool)
+    headers = {"X-Dimension": str(dimension), "X-Missing": str(int((~found).sum()))}
+    if _wants_arrow(request):
+        writer = ArrowStreamWriter([("id", "int64"), ("vector", "vector")], dimension)
+        body = writer.write({"id": np.asarray(doc_ids, dtype=np.int64)[found], "vector": vectors[found]}) + writer.close()
+        return Response(body, media_type=ARROW_MEDIA_TYPE, headers=headers)
+    return Response(vectors.tobytes(), media_type=RAW_MEDIA_TYPE, headers=headers)
+
+@app.get("/vectors/export")
+async def export_vectors(request: Request, with_text: bool = True, model: Optional[str] = None):
+    """
+    Streams every live document's vector. Raw records are an int64 id
+    followed by the float32 vector, little-endian and packed; Arrow (by
+    Accept header) has id, vector and, unless `with_text` is false, text
+    columns, one record batch per index chunk.
+    """
+    model_name = _check_model(model)
+    try:
+        namespace = await _namespace(model_name)
+    except InferenceQueueFullError as e:
+        raise HTTPException(status_code=503, detail=str(e))
+    except Exception as e:
+        logger.error(f"Error in /vectors/export endpoint: {str(e)}")
+        raise HTTPException(status_code=500, detail=str(e))
+    dimension = namespace.vector_search.dimension
+    arrow = _wants_arrow(request)
+    try:
+        writer = ArrowStreamWriter([("id", "int64"), ("vector", "vector")] + ([("text", "string")] if with_text else []),
+                                   dimension) if arrow else None
+    except UnsupportedFormatError as e:
+        raise HTTPException(status_code=406, detail=str(e))
+    dtype = record_dtype(dimension)
+
+    async def chunks():
+        # Index chunks are read on the executor; compaction waits until the export ends
+        batches = namespace.vector_search.iter_live()
+        try:
+            while True:
+                batch = await _run_when_ready(next, batches, None)
+                if batch is None:
+                    break
+                vectors, texts, doc_ids, _ = batch
+                if writer is not None:
+                    yield writer.write({"id": doc_ids, "vector": vectors, "text": texts})
+                else:
+                    records = np.empty(len(doc_ids), dtype=dtype)
+                    records["id"] = doc_ids
+                    records["vector"] = vectors
+                    yield memoryview(records).cast("B")
+            if writer is not None:
+                yield writer.close()
+        except Exception as e:
+            # Headers are sent; a truncated body is all that can signal the failure
+            logger.error(f"Error in /vectors/export endpoint: {str(e)}")
+            raise
+        finally:
+            try:
+                batches.close()
+            except ValueError:
+                # Still advancing on an executor thread after a disconnect; it closes when collected
+                pass
+
+    return StreamingResponse(chunks(), media_type=ARROW_MEDIA_TYPE if arrow else RAW_MEDIA_TYPE,
+                             headers={"X-Dimension": str(dimension), "X-Record-Bytes": str(dtype.itemsize)})
+
 # --- Running the Application ---
 if __name__ == "__main__":
     import uvicorn
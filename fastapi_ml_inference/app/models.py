@@ -1,16 +1,80 @@
 from pydantic import BaseModel, Field
-from typing import List
+from typing import Annotated, Dict, List, Literal, Optional, Union
+
+# Metadata values are flat scalars; filters match them exactly
+MetadataValue = Union[bool, int, float, str]
+# Document ids are stored as int64, and -1 marks a missing hit
+DocId = Annotated[int, Field(ge=0, le=2**63 - 1)]
 
 class TextInput(BaseModel):
     text: str = Field(..., min_length=1, description="Text to generate embedding for")
+    metadata: Optional[Dict[str, MetadataValue]] = Field(None, description="Fields to filter searches on, e.g. tenant or language")
+    model: Optional[str] = Field(None, description="Embedding model, and with it the index, to use; defaults to EMBEDDING_MODEL")
+
+class TextBatchInput(BaseModel):
+    texts: List[str] = Field(..., min_length=1, max_length=10000, description="Texts to embed and add in one batch")
+    batch_size: int = Field(64, ge=1, le=1024, description="Number of texts per model forward pass")
+    ids: Optional[List[DocId]] = Field(None, description="Document ids, one per text; existing documents are replaced")
+    metadata: Optional[List[Optional[Dict[str, MetadataValue]]]] = Field(None, description="Metadata, one entry per text")
+    model: Optional[str] = Field(None, description="Embedding model, and with it the index, to use; defaults to EMBEDDING_MODEL")
+
+class IngestRecord(BaseModel):
+    """One line of an /ingest/stream NDJSON body."""
+    text: str = Field(..., min_length=1)
+    id: Optional[DocId] = None
+    metadata: Optional[Dict[str, MetadataValue]] = None
+    model: Optional[str] = None
+
+class AddResponse(BaseModel):
+    message: str
+    id: int
+    # "exact" or "near" when the text was already indexed; id is then the existing document's
+    duplicate: Optional[Literal["exact", "near"]] = None
+
+class AddBatchResponse(BaseModel):
+    message: str
+    count: int
+    # One per text; duplicates get the id of the document they duplicate
+    ids: List[int]
+    batch_size: int
+    encode_seconds: float
+    index_seconds: float
+    texts_per_second: float
+    # Texts that were not encoded or indexed because they duplicate another document
+    exact_duplicates: int = 0
+    near_duplicates: int = 0
+
+class VectorAddResponse(BaseModel):
+    message: str
+    count: int
+    ids: List[int]
 
 class SearchQuery(BaseModel):
     query: str = Field(..., min_length=1, description="Query text for vector search")
     k: int = Field(5, ge=1, le=100, description="Number of similar results to return")
+    nprobe: Optional[int] = Field(None, ge=1, le=65536, description="IVF lists to probe; defaults to FAISS_NPROBE")
+    ef_search: Optional[int] = Field(None, ge=1, le=4096, description="HNSW search beam width; defaults to FAISS_EF_SEARCH")
+    rerank: Optional[bool] = Field(None, description="Re-rank with full-precision vectors; defaults to on when FAISS_RERANK_PATH is set")
+    filter: Optional[Dict[str, Union[MetadataValue, List[MetadataValue]]]] = Field(
+        None, description="Only return documents whose metadata matches every field; a list accepts any of its values")
+    mode: Literal["dense", "sparse", "hybrid"] = Field(
+        "dense", description="Vector search, BM25 keyword search, or both fused by reciprocal rank")
+    model: Optional[str] = Field(None, description="Embedding model, and with it the index, to use; defaults to EMBEDDING_MODEL")
+
+class SearchBatchQuery(BaseModel):
+    queries: List[SearchQuery] = Field(..., min_length=1, max_length=10000,
+                                       description="Queries to run together; results come back in the same order")
 
 class SearchResult(BaseModel):
+    id: int
     text: str
+    # Vector similarity, BM25 score or reciprocal rank fusion score, depending on the mode
     similarity: float
 
 class SearchResponse(BaseModel):
-    results: List[SearchResult]
\ No newline at end of file
+    results: List[SearchResult]
+    bytes_per_vector: Optional[float] = None
+    recall_loss: Optional[float] = None
+
+class SearchBatchResponse(BaseModel):
+    results: List[SearchResponse]
\ No newline at end of file
@@ -0,0 +1,166 @@
+import re
+import threading
+from array import array
+from collections import Counter
+from typing import Dict, List, Optional, Sequence, Tuple
+import numpy as np
+from utils.logger import logger
+
+_TOKEN = re.compile(r"\w+")
+
+def tokenize(text: str) -> List[str]:
+    # Word characters only, so "SKU-4471B" matches as "sku" and "4471b"
+    return _TOKEN.findall(text.lower())
+
+def reciprocal_rank_fusion(rankings: Sequence[List[dict]], k: int, rrf_k: int = 60) -> List[dict]:
+    """
+    Fuses ranked hit lists ({"id", "text", ...}) by summing 1 / (rrf_k + rank)
+    over the lists each document appears in; the fused score replaces
+    "similarity". Only ranks matter, so dense and BM25 scores need no
+    calibration against each other.
+    """
+    fused: Dict[int, dict] = {}
+    for hits in rankings:
+        for rank, hit in enumerate(hits, start=1):
+            entry = fused.get(hit["id"])
+            if entry is None:
+                entry = fused[hit["id"]] = {"id": hit["id"], "text": hit["text"], "similarity": 0.0}
+            entry["similarity"] += 1.0 / (rrf_k + rank)
+    return sorted(fused.values(), key=lambda hit: -hit["similarity"])[:k]
+
+class BM25Index:
+    """
+    Okapi BM25 inverted index over document texts, built incrementally.
+
+    Like the vector index's slots, every added document version gets a row;
+    postings hold (row, term frequency) pairs in growing arrays. Replacing or
+    deleting a document only marks its row dead (length 0), and `compact()`
+    drops dead rows from the postings once enough have piled up. Searches
+    skip dead rows, so document frequencies only count live documents;
+    compaction frees memory but does not change scores.
+    """
+
+    def __init__(self, k1: float = 1.2, b: float = 0.75):
+        self.k1 = k1
+        self.b = b
+        # term -> (rows, term frequencies)
+        self._postings: Dict[str, Tuple[array, array]] = {}
+        self._row_doc = array("q")
+        self._row_length = array("I")
+        self._row_of_doc: Dict[int, int] = {}
+        self._total_length = 0
+        self.dead_rows = 0
+        # Adds and searches run on different executor threads; searches copy
+        # the postings they need under the lock and score without it
+        self._lock = threading.Lock()
+
+    def __len__(self) -> int:
+        return len(self._row_of_doc)
+
+    @property
+    def dead_ratio(self) -> float:
+        return self.dead_rows / len(self._row_doc) if len(self._row_doc) else 0.0
+
+    def _kill(self, row: int):
+        self._total_length -= self._row_length[row]
+        self._row_length[row] = 0
+        self.dead_rows += 1
+
+    def add(self, doc_ids: Sequence[int], texts: Sequence[str]):
+        """Indexes `texts` under `doc_ids`, replacing earlier versions of the same ids."""
+        counts = [Counter(tokenize(text)) for text in texts]
+        with self._lock:
+            for doc_id, terms in zip(doc_ids, counts):
+                previous = self._row_of_doc.get(doc_id)
+                if previous is not None:
+                    self._kill(previous)
+                row = len(self._row_doc)
+                self._row_doc.append(doc_id)
+                length = sum(terms.values())
+                # Length 0 marks dead rows, so an empty text still counts as one token
+                self._row_length.append(max(length, 1))
+                self._total_length += max(length, 1)
+                self._row_of_doc[doc_id] = row
+                for term, frequency in terms.items():
+                    posting = self._postings.get(term)
+                    if posting is None:
+                        posting = self._postings[term] = (array("q"), array("I"))
+                    posting[0].append(row)
+                    posting[1].append(frequency)
+
+    def delete(self, doc_ids: Sequence[int]) -> int:
+        with self._lock:
+            deleted = 0
+            for doc_id in doc_ids:
+                row = self._row_of_doc.pop(doc_id, None)
+                if row is not None:
+                    self._kill(row)
+                    deleted += 1
+            return deleted
+
+    def search(self, query: str, limit: Optional[int] = None) -> Tuple[np.ndarray, np.ndarray]:
+        """
+        Returns (doc_ids, scores) of the live documents sharing a term with
+        `query`, best first; the top `limit` only, if given.
+        """
+        terms = set(tokenize(query))
+        with self._lock:
+            documents = len(self._row_of_doc)
+            if not documents:
+                return np.zeros(0, dtype=np.int64), np.zeros(0, dtype=np.float32)
+            average_length = self._total_length / documents
+            row_lengths = np.frombuffer(self._row_length, dtype=np.uint32)
+            matched = []
+            for term in terms:
+                posting = self._postings.get(term)
+                if posting is not None:
+                    rows = np.frombuffer(posting[0], dtype=np.int64).copy()
+                    matched.append((rows, np.frombuffer(posting[1], dtype=np.uint32).astype(np.float32),
+                                    row_lengths[rows].astype(np.float32)))
+            row_doc = np.frombuffer(self._row_doc, dtype=np.int64).copy() if matched else None
+            # A live view would make the arrays unresizable for concurrent adds
+            del row_lengths
+        if not matched:
+            return np.zeros(0, dtype=np.int64), np.zeros(0, dtype=np.float32)
+        all_rows = []
+        contributions = []
+        for rows, frequencies, lengths in matched:
+            live = lengths > 0
+            rows, frequencies, lengths = rows[live], frequencies[live], lengths[live]
+            idf = np.log(1.0 + (documents - len(rows) + 0.5) / (len(rows) + 0.5))
+            all_rows.append(rows)
+            contributions.append(idf * frequencies * (self.k1 + 1)
+                                 / (frequencies + self.k1 * (1 - self.b + self.b * lengths / average_length)))
+        rows, inverse = np.unique(np.concatenate(all_rows), return_inverse=True)
+        scores = np.bincount(inverse, weights=np.concatenate(contributions)).astype(np.float32)
+        if limit is not None and limit < len(scores):
+            top = np.argpartition(-scores, limit)[:limit]
+            rows, scores = rows[top], scores[top]
+        order = np.argsort(-scores, kind="stable")
+        return row_doc[rows[order]], scores[order]
+
+    def compact(self) -> int:
+        """Drops dead rows from the postings and returns how many were dropped."""
+        with self._lock:
+            dropped = self.dead_rows
+            if not dropped:
+                return 0
+            lengths = np.frombuffer(self._row_length, dtype=np.uint32)
+            live = lengths > 0
+            # Old row -> new row; dead rows map nowhere
+            new_rows = np.cumsum(live) - 1
+            for term in list(self._postings):
+                rows, frequencies = self._postings[term]
+                rows = np.frombuffer(rows, dtype=np.int64)
+                keep = live[rows]
+                if not keep.any():
+                    del self._postings[term]
+                    continue
+                self._postings[term] = (array("q", new_rows[rows[keep]].tobytes()),
+                                        array("I", np.frombuffer(frequencies, dtype=np.uint32)[keep].tobytes()))
+            self._row_doc = array("q", np.frombuffer(self._row_doc, dtype=np.int64)[live].tobytes())
+            self._row_length = array("I", lengths[live].tobytes())
+            self._row_of_doc = {doc_id: row for row, doc_id in enumerate(self._row_doc)}
+            self.dead_rows = 0
+        logger.info(f"Compacted BM25 index, dropped {dropped} dead rows")
+        return dropped
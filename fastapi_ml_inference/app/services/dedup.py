@@ -0,0 +1,194 @@
+import hashlib
+import json
+import re
+import threading
+import zlib
+from typing import Dict, List, NamedTuple, Optional, Sequence, Set, Tuple
+import numpy as np
+
+_WORD = re.compile(r"\w+")
+# Near-duplicates are judged on overlapping runs of this many words
+SHINGLE_SIZE = 3
+# Largest prime below 2**32: a * x + b stays below 2**64 for 32-bit a, b and x
+_PRIME = np.uint64(4294967291)
+
+class Fingerprint(NamedTuple):
+    # Hash of the exact text and metadata
+    key: int
+    # MinHash of the word shingles and its LSH band hashes; None and () without near-duplicate detection
+    signature: Optional[np.ndarray]
+    bands: Tuple[int, ...]
+
+class Duplicate(NamedTuple):
+    kind: str
+    # The indexed document the text duplicates, or else the earlier text of the same batch it does
+    doc_id: Optional[int]
+    position: Optional[int]
+
+def _shingles(text: str) -> np.ndarray:
+    words = _WORD.findall(text.lower())
+    runs = {" ".join(words[start:start + SHINGLE_SIZE]) for start in range(max(len(words) - SHINGLE_SIZE + 1, 1))}
+    return np.fromiter((zlib.crc32(run.encode()) for run in runs), dtype=np.uint64, count=len(runs))
+
+class DedupIndex:
+    """
+    Content hashes of a namespace's documents, and with `near_threshold`
+    MinHash-LSH signatures of their word shingles, so ingest can answer a
+    text that is already indexed with the existing document's id instead of
+    encoding and indexing it again.
+
+    Metadata is part of the identity: the same text under another tenant is
+    not a duplicate. A candidate found through the LSH bands counts as a
+    near-duplicate when its estimated Jaccard similarity reaches
+    `near_threshold`. Nothing is persisted; the index is rebuilt from the
+    vector index's live documents when a namespace opens.
+    """
+
+    def __init__(self, exact: bool = True, near_threshold: float = 0.0, permutations: int = 64, bands: int = 16):
+        if near_threshold > 0 and permutations % bands:
+            raise ValueError(f"MinHash permutations ({permutations}) must be a multiple of the bands ({bands})")
+        self.exact = exact
+        self.near_threshold = near_threshold
+        self.permutations = permutations
+        self.band_count = bands
+        self._rows = permutations // bands
+        # Signatures only have to agree within this process; a fixed seed keeps them reproducible
+        rng = np.random.default_rng(0)
+        self._a = rng.integers(1, int(_PRIME), permutations, dtype=np.uint64)
+        self._b = rng.integers(0, int(_PRIME), permutations, dtype=np.uint64)
+        self._docs: Dict[int, Fingerprint] = {}
+        # Several documents can share a key (upserts to explicit ids are never deduplicated)
+        self._docs_of_key: Dict[int, Set[int]] = {}
+        # LSH band hash -> documents with that band
+        self._buckets: Dict[int, List[int]] = {}
+        self.exact_duplicates = 0
+        self.near_duplicates = 0
+        # Ingest batches run on several executor threads; fingerprints are computed outside the lock
+        self._lock = threading.Lock()
+
+    def __len__(self) -> int:
+        return len(self._docs)
+
+    def fingerprint(self, text: str, metadata: Optional[dict] = None) -> Optional[Fingerprint]:
+        """None for an empty text, which is never deduplicated."""
+        if not text:
+            return None
+        scope = json.dumps(metadata or {}, sort_keys=True)
+        key = int.from_bytes(hashlib.blake2b(f"{scope}\0{text}".encode(), digest_size=8).digest(), "little")
+        if self.near_threshold <= 0:
+            return Fingerprint(key, None, ())
+        shingles = _shingles(text)
+        signature = ((shingles[:, None] * self._a + self._b) % _PRIME).min(axis=0).astype(np.uint32)
+        # Only texts with the same metadata share buckets
+        bands = tuple(hash((scope, band, signature[band * self._rows:(band + 1) * self._rows].tobytes()))
+                      for band in range(self.band_count))
+        return Fingerprint(key, signature, bands)
+
+    def _similarity(self, a: np.ndarray, b: np.ndarray) -> float:
+        return np.count_nonzero(a == b) / self.permutations
+
+    def _find(self, fingerprint: Fingerprint, fingerprints: List[Optional[Fingerprint]],
+              batch_keys: Dict[int, int], batch_buckets: Dict[int, List[int]]) -> Optional[Duplicate]:
+        if self.exact:
+            doc_ids = self._docs_of_key.get(fingerprint.key)
+            if doc_ids:
+                return Duplicate("exact", min(doc_ids), None)
+            position = batch_keys.get(fingerprint.key)
+            if position is not None:
+                return Duplicate("exact", None, position)
+        best, best_similarity = None, self.near_threshold
+        seen_docs, seen_positions = set(), set()
+        for band in fingerprint.bands:
+            for doc_id in self._buckets.get(band, ()):
+                if doc_id not in seen_docs:
+                    seen_docs.add(doc_id)
+                    similarity = self._similarity(fingerprint.signature, self._docs[doc_id].signature)
+                    if similarity >= best_similarity:
+                        best, best_similarity = Duplicate("near", doc_id, None), similarity
+            for position in batch_buckets.get(band, ()):
+                if position not in seen_positions:
+                    seen_positions.add(position)
+                    similarity = self._similarity(fingerprint.signature, fingerprints[position].signature)
+                    if similarity >= best_similarity:
+                        best, best_similarity = Duplicate("near", None, position), similarity
+        return best
+
+    def check(self, texts: Sequence[str], metadata: Sequence[Optional[dict]], skip: Optional[Sequence[bool]] = None
+              ) -> Tuple[List[Optional[Fingerprint]], List[Optional[Duplicate]]]:
+        """
+        (fingerprints, duplicates) of a batch about to be indexed; a
+        duplicate may point at an earlier text of the same batch. Texts
+        marked in `skip` (upserts to an explicit id) are never duplicates
+        but later texts may duplicate them. Pass the fingerprints of the
+        texts that do get indexed to `add`. Two batches checked at the same
+        time can both index a text neither has seen yet.
+        """
+        fingerprints = [self.fingerprint(text, entry) for text, entry in zip(texts, metadata)]
+        duplicates: List[Optional[Duplicate]] = []
+        batch_keys: Dict[int, int] = {}
+        batch_buckets: Dict[int, List[int]] = {}
+        with self._lock:
+            for position, fingerprint in enumerate(fingerprints):
+                duplicate = None
+                if fingerprint is not None and not (skip and skip[position]):
+                    duplicate = self._find(fingerprint, fingerprints, batch_keys, batch_buckets)
+                if duplicate is None and fingerprint is not None:
+                    batch_keys.setdefault(fingerprint.key, position)
+                    for band in fingerprint.bands:
+                        batch_buckets.setdefault(band, []).append(position)
+                elif duplicate is not None:
+                    if duplicate.kind == "exact":
+                        self.exact_duplicates += 1
+                    else:
+                        self.near_duplicates += 1
+                duplicates.append(duplicate)
+        return fingerprints, duplicates
+
+    def _forget(self, doc_id: int):
+        fingerprint = self._docs.pop(doc_id, None)
+        if fingerprint is None:
+            return
+        doc_ids = self._docs_of_key[fingerprint.key]
+        doc_ids.discard(doc_id)
+        if not doc_ids:
+            del self._docs_of_key[fingerprint.key]
+        for band in fingerprint.bands:
+            bucket = self._buckets[band]
+            bucket.remove(doc_id)
+            if not bucket:
+                del self._buckets[band]
+
+    def add(self, doc_ids: Sequence[int], fingerprints: Sequence[Optional[Fingerprint]]):
+        """Records indexed documents, replacing earlier versions of the same ids; None only forgets the id."""
+        with self._lock:
+            for doc_id, fingerprint in zip(doc_ids, fingerprints):
+                self._forget(doc_id)
+                if fingerprint is None:
+                    continue
+                self._docs[doc_id] = fingerprint
+                self._docs_of_key.setdefault(fingerprint.key, set()).add(doc_id)
+                for band in fingerprint.bands:
+                    self._buckets.setdefault(band, []).append(doc_id)
+
+    def add_texts(self, doc_ids: Sequence[int], texts: Sequence[str], metadata: Optional[Sequence[Optional[dict]]] = None):
+        """Fingerprints and records indexed documents, e.g. when rebuilding from the vector index."""
+        metadata = metadata or [None] * len(texts)
+        self.add(doc_ids, [self.fingerprint(text, entry) for text, entry in zip(texts, metadata)])
+
+    def remove(self, doc_ids: Sequence[int]):
+        with self._lock:
+            for doc_id in doc_ids:
+                self._forget(doc_id)
+
+def resolve_duplicates(duplicates: Sequence[Optional[Duplicate]], added: Sequence[int]) -> List[int]:
+    """Document id of every text of a checked batch, given the ids of the texts that were indexed, in order."""
+    added = iter(added)
+    doc_ids: List[int] = []
+    for duplicate in duplicates:
+        if duplicate is None:
+            doc_ids.append(next(added))
+        elif duplicate.doc_id is not None:
+            doc_ids.append(duplicate.doc_id)
+        else:
+            doc_ids.append(doc_ids[duplicate.position])
+    return doc_ids
@@ -0,0 +1,96 @@
+import hashlib
+import threading
+import time
+from collections import OrderedDict
+from typing import Optional, Tuple
+import numpy as np
+from utils.logger import logger
+
+# Rough per-entry cost of the key, the OrderedDict slot and the ndarray header
+_ENTRY_OVERHEAD_BYTES = 200
+
+def embedding_key(model_name: str, text: str) -> bytes:
+    """Cache key for `text` embedded by `model_name`."""
+    return hashlib.blake2b(f"{model_name}\0{text}".encode("utf-8"), digest_size=16).digest()
+
+class EmbeddingCache:
+    """
+    Thread-safe LRU cache of embeddings bounded by a byte budget.
+
+    Entries older than `ttl_seconds` (when set) are treated as misses and
+    dropped on access. Counters for hits, misses, evictions and expirations
+    are exposed through `stats()`.
+    """
+
+    def __init__(self, max_bytes: int, ttl_seconds: Optional[float] = None):
+        self.max_bytes = max_bytes
+        self.ttl_seconds = ttl_seconds or None
+        self._entries: "OrderedDict[bytes, Tuple[np.ndarray, float]]" = OrderedDict()
+        self._lock = threading.Lock()
+        self.current_bytes = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.expirations = 0
+        logger.info(f"Embedding cache enabled with {max_bytes} bytes, ttl={self.ttl_seconds}")
+
+    @staticmethod
+    def _entry_size(embedding: np.ndarray) -> int:
+        return embedding.nbytes + _ENTRY_OVERHEAD_BYTES
+
+    def get(self, key: bytes) -> Optional[np.ndarray]:
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                self.misses += 1
+                return None
+            embedding, stored_at = entry
+            if self.ttl_seconds is not None and time.monotonic() - stored_at > self.ttl_seconds:
+                del self._entries[key]
+                self.current_bytes -= self._entry_size(embedding)
+                self.expirations += 1
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return embedding
+
+    def put(self, key: bytes, embedding: np.ndarray):
+        size = self._entry_size(embedding)
+        if size > self.max_bytes:
+            return
+        # Cached arrays are shared between callers, so they must not be mutated
+        embedding = np.array(embedding, dtype=np.float32, copy=True)
+        embedding.setflags(write=False)
+        with self._lock:
+            previous = self._entries.pop(key, None)
+            if previous is not None:
+                self.current_bytes -= self._entry_size(previous[0])
+            self._entries[key] = (embedding, time.monotonic())
+            self.current_bytes += size
+            while self.current_bytes > self.max_bytes:
+                _, (evicted, _) = self._entries.popitem(last=False)
+                self.current_bytes -= self._entry_size(evicted)
+                self.evictions += 1
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self.current_bytes = 0
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    def stats(self) -> dict:
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                "entries": len(self._entries),
+                "bytes": self.current_bytes,
+                "max_bytes": self.max_bytes,
+                "hits": self.hits,
+                "misses": self.misses,
+                "evictions": self.evictions,
+                "expirations": self.expirations,
+                "hit_rate": self.hits / lookups if lookups else 0.0,
+            }
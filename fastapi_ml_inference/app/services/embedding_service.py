@@ -1,17 +1,196 @@
 from sentence_transformers import SentenceTransformer
+import itertools
 import numpy as np
-from utils.logger import logger
+import os
+import threading
+import time
+from typing import Callable, List, Optional, Tuple
+from services.embedding_cache import EmbeddingCache, embedding_key
+from services.embedding_store import EmbeddingStore
+from utils.logger import logger, sampled
+from utils.metrics import padding_efficiency, record_stage
+
+def token_lengths(model: SentenceTransformer, texts: List[str]) -> np.ndarray:
+    """
+    Tokens per text as the model will see them (special tokens included,
+    truncated). A full tokenization pass, so kept off the encode path.
+    """
+    encoded = model.tokenizer(texts, truncation=True, max_length=model.max_seq_length)
+    return np.fromiter((len(ids) for ids in encoded["input_ids"]), dtype=np.int64, count=len(texts))
+
+def feature_lengths(features: dict) -> np.ndarray:
+    """Real tokens per text of a tokenized batch, read off its attention mask."""
+    return features["attention_mask"].sum(dim=1).numpy()
+
+def length_buckets(lengths: np.ndarray, batch_size: int) -> List[np.ndarray]:
+    """
+    Splits positions into batches of at most `batch_size` texts with similar
+    lengths, so each batch is padded only to about its own longest text.
+    """
+    order = np.argsort(-lengths, kind="stable")
+    return [order[start:start + batch_size] for start in range(0, len(order), batch_size)]
+
+def batch_padding_efficiency(lengths: np.ndarray) -> float:
+    """Share of the computed tokens that are real rather than padding."""
+    return float(lengths.sum() / (len(lengths) * lengths.max())) if len(lengths) else 1.0
+
+class TimedEncoder:
+    """
+    Encodes with a SentenceTransformer, which already batches texts sorted
+    by length, and reports how long tokenization and the rest of encode()
+    (mostly the forward pass) took, plus each batch's padding efficiency.
+    The model's tokenizer call is wrapped, so the split costs two clock
+    reads per batch and the efficiency comes from the batch's own attention
+    mask rather than a second tokenization pass.
+    """
+
+    def __init__(self, model: SentenceTransformer):
+        self.model = model
+        # encode() tokenizes through preprocess() in newer sentence-transformers, tokenize() in older ones
+        method = "preprocess" if hasattr(model, "preprocess") else "tokenize"
+        tokenize = getattr(model, method)
+        # Per thread, since several executor threads may encode with the model at once
+        self._local = threading.local()
+
+        def timed_tokenize(*args, **kwargs):
+            start = time.perf_counter()
+            try:
+                features = tokenize(*args, **kwargs)
+            finally:
+                self._local.seconds = getattr(self._local, "seconds", 0.0) + time.perf_counter() - start
+            if hasattr(self._local, "efficiencies") and "attention_mask" in features:
+                self._local.efficiencies.append(batch_padding_efficiency(feature_lengths(features)))
+            return features
+
+        setattr(model, method, timed_tokenize)
+
+    def encode(self, texts: List[str], batch_size: int) -> Tuple[np.ndarray, float, float, List[float]]:
+        """
+        Returns the embeddings in input order, the seconds spent tokenizing,
+        the seconds spent in the rest of encode() and the padding efficiency
+        of each batch.
+        """
+        if not texts:
+            return np.empty((0, 0), dtype=np.float32), 0.0, 0.0, []
+        start = time.perf_counter()
+        self._local.seconds = 0.0
+        self._local.efficiencies = efficiencies = []
+        try:
+            embeddings = self.model.encode(texts, batch_size=batch_size, convert_to_numpy=True)
+        finally:
+            del self._local.efficiencies
+        total = time.perf_counter() - start
+        return embeddings, self._local.seconds, total - self._local.seconds, efficiencies
+
+def record_encode_stats(tokenize_seconds: float, forward_seconds: float, efficiencies: List[float]):
+    record_stage("tokenize", tokenize_seconds)
+    record_stage("forward", forward_seconds)
+    for efficiency in efficiencies:
+        padding_efficiency.observe(efficiency)
+
+def load_encoder(model_name: str, backend: str = "torch", onnx_dir: str = "onnx_models", onnx_quantize: bool = False):
+    """TimedEncoder for the "torch" backend, OnnxEncoder (exported on first use) for "onnx"."""
+    logger.info(f"Loading SentenceTransformer model: {model_name} ({backend} backend)")
+    model = SentenceTransformer(model_name)
+    if backend == "onnx":
+        # onnxruntime is only needed for this backend
+        from services.onnx_encoder import OnnxEncoder
+        return OnnxEncoder(model, model_name, onnx_dir, quantize=onnx_quantize)
+    if backend != "torch":
+        raise ValueError(f"Unknown embedding backend {backend!r}, expected 'torch' or 'onnx'")
+    return TimedEncoder(model)
 
 class EmbeddingService:
-    def __init__(self, model_name: str = "all-MiniLM-L6-v2"):
-        logger.info(f"Loading SentenceTransformer model: {model_name}")
-        self.model = SentenceTransformer(model_name)
+    # No default name: the model pool, cache and stores key on it, so callers pass settings.embedding_model's spelling
+    def __init__(self, model_name: str, encoder: Optional[Callable[[List[str], int], np.ndarray]] = None,
+                 cache: Optional[EmbeddingCache] = None, store: Optional[EmbeddingStore] = None,
+                 backend: str = "torch", onnx_dir: str = "onnx_models", onnx_quantize: bool = False):
+        self.model_name = model_name
+        self.cache = cache
+        self.store = store
+        if encoder is None:
+            self._timed_encoder = load_encoder(model_name, backend, onnx_dir, onnx_quantize)
+            self.model = self._timed_encoder.model
+            encoder = self._encode_local
+        else:
+            # The model lives elsewhere (e.g. in inference worker processes)
+            self.model = None
+        self.encoder = encoder
+
+    def _encode_local(self, texts: List[str], batch_size: int) -> np.ndarray:
+        embeddings, tokenize_seconds, forward_seconds, efficiencies = self._timed_encoder.encode(texts, batch_size)
+        record_encode_stats(tokenize_seconds, forward_seconds, efficiencies)
+        return embeddings
+
+    def embedding_dimension(self) -> int:
+        if self.model is not None:
+            dimension = self.model.get_sentence_embedding_dimension()
+            if dimension:
+                return dimension
+        # Remote encoders only reveal the dimension through an embedding
+        return int(self.generate_embedding("sample text").shape[0])
+
+    def memory_bytes(self) -> int:
+        """Approximate memory held by the model: its weights and buffers, plus the ONNX model it runs, if any."""
+        if self.model is None:
+            return 0
+        tensors = itertools.chain(self.model.parameters(), self.model.buffers())
+        size = sum(tensor.numel() * tensor.element_size() for tensor in tensors)
+        onnx_path = getattr(self._timed_encoder, "path", None)
+        return size + (os.path.getsize(onnx_path) if onnx_path else 0)
+
+    def cache_stats(self) -> Optional[dict]:
+        return self.cache.stats() if self.cache is not None else None
+
+    def _encode_cached(self, texts: List[str], batch_size: int) -> np.ndarray:
+        if self.cache is None and self.store is None:
+            return self.encoder(texts, batch_size)
+        lookup_start = time.perf_counter()
+        keys = [embedding_key(self.model_name, text) for text in texts]
+        embeddings = [self.cache.get(key) if self.cache is not None else None for key in keys]
+        # Group positions by key so each distinct missing text is looked up and encoded once
+        missing = {}
+        for position, (key, embedding) in enumerate(zip(keys, embeddings)):
+            if embedding is None:
+                missing.setdefault(key, []).append(position)
+
+        def fill(key, embedding):
+            if self.cache is not None:
+                self.cache.put(key, embedding)
+            for position in missing.pop(key):
+                embeddings[position] = embedding
+
+        if missing and self.store is not None:
+            found = [(key, row) for key, row in zip(list(missing), self.store.lookup(list(missing))) if row is not None]
+            if found:
+                for (key, _), embedding in zip(found, self.store.get([row for _, row in found])):
+                    fill(key, embedding)
+        record_stage("cache", time.perf_counter() - lookup_start)
+        if missing:
+            missing_keys = list(missing)
+            encoded = self.encoder([texts[missing[key][0]] for key in missing_keys], batch_size)
+            for key, embedding in zip(missing_keys, encoded):
+                fill(key, embedding)
+        return np.stack(embeddings).astype(np.float32, copy=False)
 
     def generate_embedding(self, text: str) -> np.ndarray:
         try:
-            embedding = self.model.encode(text, convert_to_numpy=True)
-            logger.info(f"Generated embedding for text: {text[:50]}...")
+            embedding = self._encode_cached([text], 1)[0]
+            if sampled("embedding.generate"):
+                logger.info("Generated embedding for text: %.50s...", text)
             return embedding
         except Exception as e:
             logger.error(f"Error generating embedding: {str(e)}")
-            raise
\ No newline at end of file
+            raise
+
+    def generate_embeddings(self, texts: List[str], batch_size: int = 64) -> np.ndarray:
+        try:
+            # One encode call for the whole list lets the model run full batches
+            # instead of batch size 1 per text.
+            embeddings = self._encode_cached(texts, batch_size)
+            if sampled("embedding.generate"):
+                logger.info("Generated %d embeddings in batches of %d", len(texts), batch_size)
+            return embeddings
+        except Exception as e:
+            logger.error(f"Error generating embeddings: {str(e)}")
+            raise
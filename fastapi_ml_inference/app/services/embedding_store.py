@@ -0,0 +1,327 @@
+import json
+import os
+import threading
+from typing import Dict, Iterator, List, Optional, Sequence, Tuple
+import numpy as np
+from utils.logger import logger
+
+KEY_BYTES = 16  # embedding_key digest size
+
+class MmapVectorFile:
+    """
+    Append-only float32 matrix stored as raw little-endian rows in one file.
+
+    Appends go through a regular file handle; reads go through an np.memmap
+    that is re-mapped lazily once the file has grown past the mapped region,
+    so the vectors are paged in by the OS rather than held in process memory.
+    """
+
+    def __init__(self, path: str, dimension: int):
+        self.path = path
+        self.dimension = dimension
+        self.row_bytes = dimension * 4
+        size = os.path.getsize(path) if os.path.exists(path) else 0
+        self._rows = size // self.row_bytes
+        if size != self._rows * self.row_bytes:
+            # A partial trailing row is left over from an interrupted append
+            with open(path, "r+b") as f:
+                f.truncate(self._rows * self.row_bytes)
+        self._file = open(path, "ab")
+        self._map: Optional[np.memmap] = None
+
+    def __len__(self) -> int:
+        return self._rows
+
+    def append(self, vectors: np.ndarray) -> int:
+        """Appends `vectors` and returns the row number of the first one."""
+        vectors = np.ascontiguousarray(vectors, dtype="<f4").reshape(-1, self.dimension)
+        start = self._rows
+        self._file.write(vectors.tobytes())
+        self._file.flush()
+        self._rows += len(vectors)
+        return start
+
+    def truncate(self, rows: int):
+        self._file.flush()
+        self._file.truncate(rows * self.row_bytes)
+        self._rows = rows
+        self._map = None
+
+    def view(self) -> np.ndarray:
+        """Read-only memory-mapped view of every row."""
+        if self._rows == 0:
+            return np.empty((0, self.dimension), dtype=np.float32)
+        if self._map is None or len(self._map) != self._rows:
+            self._map = np.memmap(self.path, dtype="<f4", mode="r", shape=(self._rows, self.dimension))
+        return self._map
+
+    def read(self, rows: Sequence[int]) -> np.ndarray:
+        return np.asarray(self.view()[np.asarray(rows, dtype=np.int64)], dtype=np.float32)
+
+    def close(self):
+        self._map = None
+        self._file.close()
+
+class EmbeddingStore:
+    """
+    Disk-backed, content-addressed store of document embeddings.
+
+    Each distinct (model, text) pair is written once: its vector goes to an
+    append-only memory-mapped `vectors.f32`, its text to `texts.jsonl` and its
+    embedding_key to `keys.bin`. The key file is written last and acts as the
+    commit record, so rows left behind by an interrupted append are discarded
+    on open. The key -> row index is rebuilt in memory from `keys.bin`.
+
+    Rows are only a cache of embeddings; which documents use them is kept in
+    `documents.jsonl`, an append-only log of {"id", "row", "metadata"} adds
+    (a later add of the same id replaces it) and {"delete": [ids]} records,
+    each numbered with an increasing "seq". `documents()` replays it, so an
+    index rebuilt from the store gets the same ids, metadata, upserts and
+    deletes as before the restart. An index loaded from a snapshot only
+    replays the `changes()` after the store's `checkpoint()`. The log is
+    rewritten without superseded records on open; deletes after the
+    checkpoint are kept for that replay.
+    """
+
+    def __init__(self, directory: str, dimension: int, model_name: str):
+        self.directory = directory
+        self.dimension = dimension
+        self.model_name = model_name
+        os.makedirs(directory, exist_ok=True)
+        self._check_meta()
+        self._lock = threading.Lock()
+        self._vectors = MmapVectorFile(os.path.join(directory, "vectors.f32"), dimension)
+        self._keys_path = os.path.join(directory, "keys.bin")
+        self._texts_path = os.path.join(directory, "texts.jsonl")
+        self._rows = {}
+        committed = 0
+        if os.path.exists(self._keys_path):
+            with open(self._keys_path, "rb") as f:
+                data = f.read()
+            committed = len(data) // KEY_BYTES
+            for row in range(committed):
+                self._rows[data[row * KEY_BYTES:(row + 1) * KEY_BYTES]] = row
+        self._recover(committed)
+        self._keys_file = open(self._keys_path, "ab")
+        self._texts_file = open(self._texts_path, "ab")
+        self._log_path = os.path.join(directory, "documents.jsonl")
+        self._checkpoint_path = os.path.join(directory, "checkpoint")
+        self.checkpointed = self._read_checkpoint()
+        live, deletes, self.next_doc_id, self.sequence, records = self._read_log()
+        # Deletes the snapshot already has are superseded too
+        deletes = {doc_id: seq for doc_id, seq in deletes.items() if seq > self.checkpointed}
+        if records != 1 + len(live) + len(set(deletes.values())):
+            self._write_log(live, deletes)
+        self._log_file = open(self._log_path, "ab")
+        logger.info(f"Opened embedding store at {directory} with {len(self)} embeddings")
+
+    def _check_meta(self):
+        meta_path = os.path.join(self.directory, "meta.json")
+        meta = {"model_name": self.model_name, "dimension": self.dimension}
+        if os.path.exists(meta_path):
+            with open(meta_path, "r", encoding="utf-8") as f:
+                stored = json.load(f)
+            if stored != meta:
+                raise ValueError(f"Embedding store at {self.directory} was written for {stored}, not {meta}")
+        else:
+            with open(meta_path, "w", encoding="utf-8") as f:
+                json.dump(meta, f)
+
+    def _recover(self, committed: int):
+        # Drop anything appended after the last committed key
+        if os.path.exists(self._keys_path) and os.path.getsize(self._keys_path) != committed * KEY_BYTES:
+            with open(self._keys_path, "r+b") as f:
+                f.truncate(committed * KEY_BYTES)
+        if len(self._vectors) > committed:
+            self._vectors.truncate(committed)
+        if os.path.exists(self._texts_path):
+            with open(self._texts_path, "r+b") as f:
+                for _ in range(committed):
+                    f.readline()
+                f.truncate()
+
+    def _read_checkpoint(self) -> int:
+        try:
+            with open(self._checkpoint_path, "r", encoding="utf-8") as f:
+                return int(f.read().strip())
+        except FileNotFoundError:
+            return 0
+
+    def _read_log(self) -> Tuple[Dict[int, Tuple[int, int, Optional[dict]]], Dict[int, int], int, int, int]:
+        """
+        (live documents as id -> (seq, row, metadata) in the order they were
+        added, deleted ids -> seq of their delete, next free id, last seq,
+        records read)
+        """
+        if not os.path.exists(self._log_path):
+            # Stores written before the log: every row is one document, numbered in row order
+            return {row: (0, row, None) for row in range(len(self._rows))}, {}, len(self._rows), 0, -1
+        live: Dict[int, Tuple[int, int, Optional[dict]]] = {}
+        deletes: Dict[int, int] = {}
+        next_doc_id = 0
+        sequence = 0
+        records = 0
+        with open(self._log_path, "rb") as f:
+            for line in f:
+                try:
+                    # An interrupted append leaves a partial last line, which the rewrite drops
+                    record = json.loads(line) if line.endswith(b"\n") else None
+                except ValueError:
+                    record = None
+                if record is None:
+                    records = -1
+                    break
+                records += 1
+                # Logs written before sequence numbers count their records
+                seq = record.get("seq", sequence + 1)
+                sequence = max(sequence, seq)
+                if "next_id" in record:
+                    # Header of a rewritten log: ids and seqs of the records it dropped are not reused
+                    next_doc_id = max(next_doc_id, record["next_id"])
+                elif "delete" in record:
+                    for doc_id in record["delete"]:
+                        live.pop(doc_id, None)
+                        deletes[doc_id] = seq
+                        next_doc_id = max(next_doc_id, doc_id + 1)
+                else:
+                    live.pop(record["id"], None)
+                    deletes.pop(record["id"], None)
+                    if record["row"] < len(self._rows):
+                        live[record["id"]] = (seq, record["row"], record.get("metadata"))
+                    next_doc_id = max(next_doc_id, record["id"] + 1)
+        return live, deletes, next_doc_id, sequence, records
+
+    def _write_log(self, live: Dict[int, Tuple[int, int, Optional[dict]]], deletes: Dict[int, int]):
+        deleted_at: Dict[int, List[int]] = {}
+        for doc_id, seq in deletes.items():
+            deleted_at.setdefault(seq, []).append(doc_id)
+        records = [(seq, {"seq": seq, "id": doc_id, "row": row, "metadata": metadata})
+                   for doc_id, (seq, row, metadata) in live.items()]
+        records += [(seq, {"seq": seq, "delete": doc_ids}) for seq, doc_ids in deleted_at.items()]
+        records.sort(key=lambda record: record[0])
+        temporary = self._log_path + ".tmp"
+        with open(temporary, "wb") as f:
+            f.write(json.dumps({"next_id": self.next_doc_id, "seq": self.sequence}).encode("utf-8") + b"\n")
+            for _, record in records:
+                f.write(json.dumps(record).encode("utf-8") + b"\n")
+        os.replace(temporary, self._log_path)
+
+    def checkpoint(self, sequence: int):
+        """
+        Records that an index snapshot holds every change up to seq
+        `sequence`, so a restart from it only replays the later ones.
+        """
+        with open(self._checkpoint_path + ".tmp", "w", encoding="utf-8") as f:
+            f.write(str(sequence))
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(self._checkpoint_path + ".tmp", self._checkpoint_path)
+        self.checkpointed = sequence
+
+    def __len__(self) -> int:
+        return len(self._rows)
+
+    def lookup(self, keys: Sequence[bytes]) -> List[Optional[int]]:
+        return [self._rows.get(key) for key in keys]
+
+    def get(self, rows: Sequence[int]) -> np.ndarray:
+        return self._vectors.read(rows)
+
+    def append(self, keys: Sequence[bytes], embeddings: np.ndarray, texts: Sequence[str],
+               doc_ids: Optional[Sequence[int]] = None, metadata: Optional[Sequence[Optional[dict]]] = None) -> int:
+        """
+        Persists the entries whose keys are not stored yet and returns how
+        many were new. With `doc_ids`, also logs them as the documents
+        holding these texts, replacing earlier documents with the same ids.
+        """
+        with self._lock:
+            new = [i for i, key in enumerate(keys) if key not in self._rows]
+            # Also collapse repeats within this call
+            seen = set()
+            new = [i for i in new if not (keys[i] in seen or seen.add(keys[i]))]
+            if new:
+                start = self._vectors.append(np.asarray(embeddings)[new])
+                self._texts_file.write(b"".join(json.dumps(texts[i]).encode("utf-8") + b"\n" for i in new))
+                self._texts_file.flush()
+                self._keys_file.write(b"".join(keys[i] for i in new))
+                self._keys_file.flush()
+                for offset, i in enumerate(new):
+                    self._rows[keys[i]] = start + offset
+            if doc_ids is not None:
+                # After the rows are committed, so a logged document always has its row
+                metadata = metadata or [None] * len(keys)
+                first = self.sequence + 1
+                self.sequence += len(keys)
+                self._log_file.write(b"".join(
+                    json.dumps({"seq": seq, "id": int(doc_id), "row": self._rows[key],
+                                "metadata": entry or None}).encode("utf-8") + b"\n"
+                    for seq, doc_id, key, entry in zip(range(first, self.sequence + 1), doc_ids, keys, metadata)))
+                self._log_file.flush()
+                self.next_doc_id = max([self.next_doc_id] + [int(doc_id) + 1 for doc_id in doc_ids])
+            return len(new)
+
+    def delete(self, doc_ids: Sequence[int]):
+        """Logs the documents as deleted."""
+        with self._lock:
+            self.sequence += 1
+            self._log_file.write(json.dumps({"seq": self.sequence, "delete": [int(doc_id) for doc_id in doc_ids]}
+                                            ).encode("utf-8") + b"\n")
+            self._log_file.flush()
+            self.next_doc_id = max([self.next_doc_id] + [int(doc_id) + 1 for doc_id in doc_ids])
+
+    def _texts(self, rows: Sequence[int]) -> Dict[int, str]:
+        # Only the wanted lines are parsed
+        wanted = set(rows)
+        texts = {}
+        with open(self._texts_path, "rb") as f:
+            for row, line in enumerate(f):
+                if len(texts) == len(wanted):
+                    break
+                if row in wanted:
+                    texts[row] = json.loads(line)
+        return texts
+
+    def _chunks(self, documents: list, batch_size: int
+                ) -> Iterator[Tuple[np.ndarray, List[str], List[int], List[Optional[dict]]]]:
+        # documents are (doc_id, (seq, row, metadata))
+        texts = self._texts([row for _, (_, row, _) in documents])
+        for start in range(0, len(documents), batch_size):
+            chunk = documents[start:start + batch_size]
+            rows = [row for _, (_, row, _) in chunk]
+            yield (self._vectors.read(rows), [texts[row] for row in rows], [doc_id for doc_id, _ in chunk],
+                   [metadata for _, (_, _, metadata) in chunk])
+
+    def documents(self, batch_size: int = 65536) -> Iterator[Tuple[np.ndarray, List[str], List[int], List[Optional[dict]]]]:
+        """Yields (vectors, texts, doc_ids, metadata) chunks of the live documents in the log, for rebuilding an index."""
+        live, _, _, _, _ = self._read_log()
+        yield from self._chunks(list(live.items()), batch_size)
+
+    def changes(self, since: int, batch_size: int = 65536) -> Iterator[Tuple[str, tuple]]:
+        """
+        The log records after seq `since`, in order, for bringing an index
+        loaded from a snapshot up to date: ("add", (vectors, texts, doc_ids,
+        metadata)) chunks of documents to upsert and ("delete", doc_ids).
+        Records superseded since are left out; replaying the rest twice does
+        no harm.
+        """
+        live, deletes, _, _, _ = self._read_log()
+        records = [(seq, doc_id, (seq, row, metadata)) for doc_id, (seq, row, metadata) in live.items() if seq > since]
+        records += [(seq, doc_id, None) for doc_id, seq in deletes.items() if seq > since]
+        records.sort(key=lambda record: record[0])
+        run: list = []
+        for position, (_, doc_id, document) in enumerate(records):
+            run.append((doc_id, document))
+            if position + 1 == len(records) or (records[position + 1][2] is None) != (document is None):
+                if document is None:
+                    yield "delete", [doc_id for doc_id, _ in run]
+                else:
+                    for chunk in self._chunks(run, batch_size):
+                        yield "add", chunk
+                run = []
+
+    def close(self):
+        with self._lock:
+            self._keys_file.close()
+            self._texts_file.close()
+            self._log_file.close()
+            self._vectors.close()
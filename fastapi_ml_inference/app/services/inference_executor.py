@@ -0,0 +1,99 @@
+import asyncio
+import contextvars
+import functools
+import multiprocessing
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from typing import Callable, List, Optional, Tuple
+import numpy as np
+from services.embedding_service import load_encoder, record_encode_stats
+from utils.logger import logger
+from utils.metrics import record_stage, rejected_jobs
+
+class InferenceQueueFullError(Exception):
+    """Raised when the inference queue is at capacity and a job is rejected."""
+
+# Per-process model used by the optional process pool
+_worker_model = None
+
+def _init_worker(model_name: str, encoder_options: dict):
+    global _worker_model
+    _worker_model = load_encoder(model_name, **encoder_options)
+
+def _encode_in_worker(texts: List[str], batch_size: int) -> Tuple[np.ndarray, float, float, List[float]]:
+    return _worker_model.encode(texts, batch_size)
+
+def _run_timed(submitted: float, call: Callable):
+    record_stage("queue", time.perf_counter() - submitted)
+    return call()
+
+class InferenceExecutor:
+    """
+    Runs CPU-bound model and index work off the event loop.
+
+    Jobs go to a thread pool sized to the available cores (FAISS and PyTorch
+    release the GIL while they compute). At most `concurrency` jobs run at once,
+    at most `max_queue_size` more may wait, and anything beyond that is rejected
+    with InferenceQueueFullError so the API can shed load instead of piling up
+    requests. When `process_workers` is set, encoding additionally runs in a
+    process pool where each worker holds its own copy of the model, loaded
+    with `encoder_options` (see embedding_service.load_encoder).
+    """
+
+    def __init__(self, max_workers: int = 0, concurrency: int = 0, max_queue_size: int = 1024,
+                 process_workers: int = 0, model_name: Optional[str] = None, encoder_options: Optional[dict] = None):
+        self.max_workers = max_workers or os.cpu_count() or 1
+        self.concurrency = concurrency or self.max_workers
+        self.max_queue_size = max_queue_size
+        self._threads = ThreadPoolExecutor(max_workers=self.max_workers, thread_name_prefix="inference")
+        self._slots = asyncio.Semaphore(self.concurrency)
+        self._pending = 0
+        self._processes = None
+        if process_workers > 0:
+            if not model_name:
+                raise ValueError("model_name is required when process_workers is set")
+            # spawn rather than fork: forking a process that already runs torch threads can deadlock
+            self._processes = ProcessPoolExecutor(
+                max_workers=process_workers,
+                mp_context=multiprocessing.get_context("spawn"),
+                initializer=_init_worker,
+                initargs=(model_name, encoder_options or {}),
+            )
+        logger.info(f"Inference executor started with {self.max_workers} threads, concurrency {self.concurrency}, "
+                    f"queue size {self.max_queue_size}, {process_workers} encode processes")
+
+    @property
+    def pending(self) -> int:
+        return self._pending
+
+    async def run(self, fn: Callable, *args, **kwargs):
+        if self._pending >= self.concurrency + self.max_queue_size:
+            rejected_jobs.inc()
+            raise InferenceQueueFullError(f"Inference queue is full ({self.max_queue_size} jobs waiting)")
+        self._pending += 1
+        submitted = time.perf_counter()
+        try:
+            async with self._slots:
+                loop = asyncio.get_running_loop()
+                # The job runs in the caller's context so its stage timings reach the request
+                context = contextvars.copy_context()
+                return await loop.run_in_executor(self._threads, context.run, _run_timed, submitted,
+                                                  functools.partial(fn, *args, **kwargs))
+        finally:
+            self._pending -= 1
+
+    def encode_in_process(self, texts: List[str], batch_size: int = 64) -> np.ndarray:
+        """Blocking encode on the process pool; call it from an executor thread."""
+        if self._processes is None:
+            raise RuntimeError("Process pool is not enabled")
+        embeddings, tokenize_seconds, forward_seconds, efficiencies = self._processes.submit(
+            _encode_in_worker, texts, batch_size).result()
+        # Stats measured in the worker are recorded here, where /metrics can see them
+        record_encode_stats(tokenize_seconds, forward_seconds, efficiencies)
+        return embeddings
+
+    def shutdown(self):
+        self._threads.shutdown(wait=True)
+        if self._processes is not None:
+            self._processes.shutdown(wait=True)
@@ -0,0 +1,161 @@
+import json
+import os
+from array import array
+from typing import Dict, List, Mapping, Optional, Sequence, Tuple, Union
+import numpy as np
+
+MetadataValue = Union[bool, int, float, str]
+
+class _Posting:
+    """
+    Slots holding one metadata value. Like a roaring container, it is a
+    sorted slot array while sparse and turns into a bitmap (one bit per slot)
+    once the array would take more memory than the bitmap.
+    """
+
+    def __init__(self):
+        self.slots = array("q")
+        self.bits: Optional[np.ndarray] = None
+
+    def add(self, slots: np.ndarray):
+        if self.bits is None:
+            self.slots.frombytes(slots.astype(np.int64).tobytes())
+            if len(self.slots) * 64 < self.slots[-1] + 1:
+                return
+            slots = np.frombuffer(self.slots, dtype=np.int64)
+            self.slots = array("q")
+            self.bits = np.zeros(0, dtype=np.uint8)
+        needed = int(slots.max() >> 3) + 1
+        if needed > len(self.bits):
+            grown = np.zeros(max(needed, 2 * len(self.bits)), dtype=np.uint8)
+            grown[:len(self.bits)] = self.bits
+            self.bits = grown
+        np.bitwise_or.at(self.bits, slots >> 3, (1 << (slots & 7)).astype(np.uint8))
+
+    def bitmap(self, nbytes: int) -> np.ndarray:
+        if self.bits is not None:
+            bitmap = np.zeros(nbytes, dtype=np.uint8)
+            size = min(nbytes, len(self.bits))
+            bitmap[:size] = self.bits[:size]
+            return bitmap
+        bitmap = np.zeros(nbytes, dtype=np.uint8)
+        slots = np.frombuffer(self.slots, dtype=np.int64)
+        np.bitwise_or.at(bitmap, slots >> 3, (1 << (slots & 7)).astype(np.uint8))
+        return bitmap
+
+    def to_slots(self) -> np.ndarray:
+        if self.bits is None:
+            return np.frombuffer(self.slots, dtype=np.int64).copy()
+        return np.flatnonzero(np.unpackbits(self.bits, bitorder="little")).astype(np.int64)
+
+    def retain(self, alive: np.ndarray):
+        """Drops slots whose bit is clear in `alive`."""
+        if self.bits is not None:
+            size = min(len(self.bits), len(alive))
+            self.bits[:size] &= alive[:size]
+            self.bits[size:] = 0
+            return
+        slots = np.frombuffer(self.slots, dtype=np.int64)
+        in_range = slots < len(alive) * 8
+        keep = np.zeros(len(slots), dtype=bool)
+        keep[in_range] = ((alive[slots[in_range] >> 3] >> (slots[in_range] & 7).astype(np.uint8)) & 1).astype(bool)
+        self.slots = array("q", slots[keep].tobytes())
+
+    def __len__(self) -> int:
+        return len(self.slots) if self.bits is None else int(np.unpackbits(self.bits).sum())
+
+class MetadataIndex:
+    """
+    Inverted index from (field, value) metadata pairs to the slots holding
+    them. `match()` turns a filter into a slot bitmap in the layout of
+    faiss.IDSelectorBitmap, so it can be pushed into the index search.
+    """
+
+    def __init__(self):
+        self._postings: Dict[tuple, _Posting] = {}
+
+    @staticmethod
+    def _key(field: str, value: MetadataValue) -> tuple:
+        # JSON keeps True, 1 and "1" apart, which dict keys would not
+        return field, json.dumps(value)
+
+    def __len__(self) -> int:
+        return len(self._postings)
+
+    def add(self, slots: np.ndarray, metadata: Sequence[Optional[Mapping[str, MetadataValue]]]):
+        grouped: Dict[tuple, List[int]] = {}
+        for slot, entry in zip(slots.tolist(), metadata):
+            for field, value in (entry or {}).items():
+                grouped.setdefault(self._key(field, value), []).append(slot)
+        for key, key_slots in grouped.items():
+            self._postings.setdefault(key, _Posting()).add(np.asarray(key_slots, dtype=np.int64))
+
+    def match(self, filter: Mapping[str, Union[MetadataValue, Sequence[MetadataValue]]], nbytes: int) -> np.ndarray:
+        """
+        Bitmap of the slots matching every field of `filter`. A field given a
+        list of values matches any of them.
+        """
+        result = None
+        for field, values in filter.items():
+            if not isinstance(values, (list, tuple)):
+                values = [values]
+            field_bitmap = np.zeros(nbytes, dtype=np.uint8)
+            for value in values:
+                posting = self._postings.get(self._key(field, value))
+                if posting is not None:
+                    field_bitmap |= posting.bitmap(nbytes)
+            result = field_bitmap if result is None else result & field_bitmap
+        return result if result is not None else np.full(nbytes, 0xFF, dtype=np.uint8)
+
+    def entries(self, slots: np.ndarray) -> List[Dict[str, MetadataValue]]:
+        """Metadata of each of the ascending `slots`, rebuilt from the postings."""
+        result = [{} for _ in range(len(slots))]
+        for (field, value), posting in self._postings.items():
+            posting_slots = posting.to_slots()
+            rows = np.searchsorted(slots, posting_slots)
+            found = rows < len(slots)
+            found[found] = slots[rows[found]] == posting_slots[found]
+            if found.any():
+                value = json.loads(value)
+                for row in rows[found].tolist():
+                    result[row][field] = value
+        return result
+
+    def retain(self, alive: np.ndarray):
+        """Forgets slots that are no longer alive, e.g. after compaction."""
+        for key in list(self._postings):
+            posting = self._postings[key]
+            posting.retain(alive)
+            if posting.bits is None and not len(posting.slots):
+                del self._postings[key]
+
+    def snapshot(self) -> Tuple[List[tuple], List[np.ndarray]]:
+        """Copies of the postings, so write_snapshot can run after the caller's lock is released."""
+        keys = list(self._postings)
+        return keys, [self._postings[key].to_slots() for key in keys]
+
+    @staticmethod
+    def write_snapshot(directory: str, snapshot: Tuple[List[tuple], List[np.ndarray]]):
+        keys, postings = snapshot
+        np.savez(os.path.join(directory, "metadata.npz"), **{str(number): slots for number, slots in enumerate(postings)})
+        with open(os.path.join(directory, "metadata.json"), "w", encoding="utf-8") as f:
+            json.dump([list(key) for key in keys], f)
+
+    def save(self, directory: str):
+        self.write_snapshot(directory, self.snapshot())
+
+    @classmethod
+    def load(cls, directory: str) -> "MetadataIndex":
+        metadata_index = cls()
+        keys_path = os.path.join(directory, "metadata.json")
+        if not os.path.exists(keys_path):
+            # Snapshots written before metadata support
+            return metadata_index
+        with open(keys_path, "r", encoding="utf-8") as f:
+            keys = json.load(f)
+        with np.load(os.path.join(directory, "metadata.npz")) as postings:
+            for number, (field, value) in enumerate(keys):
+                slots = postings[str(number)]
+                if len(slots):
+                    metadata_index._postings.setdefault((field, value), _Posting()).add(slots)
+        return metadata_index
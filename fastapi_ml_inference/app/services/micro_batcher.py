@@ -0,0 +1,137 @@
+import asyncio
+import time
+from typing import Any, Callable, List, Optional, Set
+from services.inference_executor import InferenceExecutor
+from utils.logger import logger
+from utils.metrics import batch_size, current_timings, start_timings, stage_seconds
+
+class MicroBatcher:
+    """
+    Coalesces concurrent requests into a single call of `handler`.
+
+    The first pending item opens a window of `window_ms`; everything submitted
+    before the window closes (or until `max_batch_size` items are pending) is
+    passed to `handler` as one list. `handler` must return one result per item,
+    in order, and each waiting caller receives the result at its own position.
+    With an `executor`, batches run on its threads and several batches may be
+    in flight at once; without one, `handler` runs inline on the event loop.
+    Stage timings recorded by `handler` are passed on to every caller in the
+    batch, along with the time the caller's item waited for the batch.
+
+    One bad item must not fail the callers batched with it. `validate` runs
+    on each item as it is submitted and its exception goes to that caller
+    alone. With `retry_singly`, a batch whose handler raises is run again one
+    item at a time, so only the items that fail on their own get the error;
+    only set it for handlers that can safely run an item twice (searches).
+    """
+
+    def __init__(self, handler: Callable[[List[Any]], List[Any]], window_ms: float, max_batch_size: int,
+                 name: str = "batcher", executor: Optional[InferenceExecutor] = None,
+                 validate: Optional[Callable[[Any], None]] = None, retry_singly: bool = False):
+        self.handler = handler
+        self.executor = executor
+        self.validate = validate
+        self.retry_singly = retry_singly
+        self.window = window_ms / 1000.0
+        self.max_batch_size = max_batch_size
+        self.name = name
+        self._queue: Optional[asyncio.Queue] = None
+        self._task: Optional[asyncio.Task] = None
+        self._in_flight: Set[asyncio.Task] = set()
+
+    def start(self):
+        self._queue = asyncio.Queue()
+        self._task = asyncio.create_task(self._run())
+        logger.info(f"Started {self.name} (window={self.window * 1000:.1f}ms, max_batch_size={self.max_batch_size})")
+
+    async def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+        if self._in_flight:
+            await asyncio.gather(*self._in_flight, return_exceptions=True)
+
+    async def submit(self, item: Any) -> Any:
+        if self._queue is None:
+            raise RuntimeError(f"{self.name} has not been started")
+        if self.validate is not None:
+            self.validate(item)
+        future = asyncio.get_running_loop().create_future()
+        await self._queue.put((item, future, time.perf_counter()))
+        result, stages = await future
+        timings = current_timings()
+        if timings is not None:
+            timings.add(stages)
+        return result
+
+    async def _collect(self) -> list:
+        loop = asyncio.get_running_loop()
+        batch = [await self._queue.get()]
+        deadline = loop.time() + self.window
+        while len(batch) < self.max_batch_size:
+            # Drain whatever is already queued before waiting on the clock
+            if not self._queue.empty():
+                batch.append(self._queue.get_nowait())
+                continue
+            timeout = deadline - loop.time()
+            if timeout <= 0:
+                break
+            try:
+                batch.append(await asyncio.wait_for(self._queue.get(), timeout))
+            except asyncio.TimeoutError:
+                break
+        return batch
+
+    async def _dispatch(self, batch: list):
+        # Callers that gave up (client disconnects) don't need to be computed
+        batch = [entry for entry in batch if not entry[1].done()]
+        if not batch:
+            return
+        dispatched = time.perf_counter()
+        batch_size.observe(len(batch), self.name)
+        # Collects the handler's stage timings for this batch alone
+        timings = start_timings()
+        try:
+            results = await self._handle([item for item, _, _ in batch])
+        except Exception as e:
+            logger.error(f"Error in {self.name} for batch of {len(batch)}: {str(e)}")
+            if not self.retry_singly or len(batch) == 1:
+                for _, future, _ in batch:
+                    if not future.done():
+                        future.set_exception(e)
+                return
+            results = []
+            for item, _, _ in batch:
+                try:
+                    results.append((await self._handle([item]))[0])
+                except Exception as item_error:
+                    results.append(item_error)
+        for (_, future, submitted), result in zip(batch, results):
+            waited = dispatched - submitted
+            stage_seconds.observe(waited, "batch_wait")
+            if future.done():
+                continue
+            if isinstance(result, Exception):
+                future.set_exception(result)
+            else:
+                future.set_result((result, dict(timings.stages, batch_wait=waited)))
+
+    async def _handle(self, items: list) -> list:
+        if self.executor is not None:
+            return await self.executor.run(self.handler, items)
+        return self.handler(items)
+
+    async def _run(self):
+        while True:
+            batch = await self._collect()
+            if self.executor is None:
+                await self._dispatch(batch)
+                continue
+            # Keep collecting the next batch while this one runs on the executor
+            task = asyncio.create_task(self._dispatch(batch))
+            self._in_flight.add(task)
+            task.add_done_callback(self._in_flight.discard)
@@ -0,0 +1,112 @@
+import gc
+import threading
+from collections import OrderedDict
+from contextlib import contextmanager
+from typing import Callable, Dict, Iterator, List
+from services.embedding_service import EmbeddingService
+from utils.logger import logger
+
+class _Entry:
+    __slots__ = ("service", "size", "users")
+
+    def __init__(self, service: EmbeddingService, size: int):
+        self.service = service
+        self.size = size
+        # Jobs currently encoding with the model; it can't be unloaded under them
+        self.users = 0
+
+class ModelPool:
+    """
+    Embedding models, loaded by `load` on first use and kept in least
+    recently used order. Whenever the loaded models' estimated size
+    (EmbeddingService.memory_bytes) exceeds `max_bytes`, the least recently
+    used ones that no job is using are unloaded; they load again on their
+    next use. With `max_bytes` 0 every model stays loaded.
+    """
+
+    def __init__(self, load: Callable[[str], EmbeddingService], max_bytes: int = 0):
+        self._load = load
+        self.max_bytes = max_bytes
+        self._entries: "OrderedDict[str, _Entry]" = OrderedDict()
+        # One lock per model, so loading one model doesn't hold up the others
+        self._load_locks: Dict[str, threading.Lock] = {}
+        self._lock = threading.Lock()
+        self.loads = 0
+        self.evictions = 0
+
+    @property
+    def current_bytes(self) -> int:
+        with self._lock:
+            return sum(entry.size for entry in self._entries.values())
+
+    def loaded(self) -> List[str]:
+        """Loaded models, least recently used first."""
+        with self._lock:
+            return list(self._entries)
+
+    @contextmanager
+    def use(self, model_name: str) -> Iterator[EmbeddingService]:
+        """The model's EmbeddingService, loaded if needed and kept loaded until the block exits."""
+        entry = self._acquire(model_name)
+        try:
+            yield entry.service
+        finally:
+            with self._lock:
+                entry.users -= 1
+                evicted = self._evict()
+            self._release(evicted)
+
+    def _use_loaded(self, model_name: str):
+        # Caller holds the lock
+        entry = self._entries.get(model_name)
+        if entry is not None:
+            entry.users += 1
+            self._entries.move_to_end(model_name)
+        return entry
+
+    def _acquire(self, model_name: str) -> _Entry:
+        with self._lock:
+            entry = self._use_loaded(model_name)
+            if entry is not None:
+                return entry
+            load_lock = self._load_locks.setdefault(model_name, threading.Lock())
+        with load_lock:
+            # Another job may have loaded it while this one waited
+            with self._lock:
+                entry = self._use_loaded(model_name)
+                if entry is not None:
+                    return entry
+            service = self._load(model_name)
+            entry = _Entry(service, service.memory_bytes())
+            with self._lock:
+                self._entries[model_name] = entry
+                entry.users = 1
+                self.loads += 1
+                evicted = self._evict()
+                total = sum(loaded.size for loaded in self._entries.values())
+        logger.info(f"Loaded embedding model {model_name} ({entry.size / 2 ** 20:.0f} MiB, pool now {total / 2 ** 20:.0f} MiB)")
+        self._release(evicted)
+        return entry
+
+    def _evict(self) -> List[str]:
+        # Caller holds the lock; least recently used first, skipping models in use
+        if not self.max_bytes:
+            return []
+        total = sum(entry.size for entry in self._entries.values())
+        evicted = []
+        for model_name, entry in list(self._entries.items()):
+            if total <= self.max_bytes:
+                break
+            if entry.users:
+                continue
+            del self._entries[model_name]
+            total -= entry.size
+            evicted.append(model_name)
+        self.evictions += len(evicted)
+        return evicted
+
+    def _release(self, evicted: List[str]):
+        if evicted:
+            logger.info(f"Unloaded embedding models {evicted} to stay within {self.max_bytes / 2 ** 20:.0f} MiB")
+            # Frees the models' tensors now rather than at the next collection
+            gc.collect()
@@ -0,0 +1,129 @@
+import os
+import threading
+import time
+from typing import List, Tuple
+import numpy as np
+import onnxruntime as ort
+import torch
+from sentence_transformers import SentenceTransformer
+from services.embedding_service import batch_padding_efficiency, feature_lengths, length_buckets
+from utils.logger import logger
+
+# Embeddings of these are compared with PyTorch's whenever an ONNX model is opened
+VERIFY_TEXTS = [
+    "hello world",
+    "FastAPI serves the embedding model behind a micro-batcher.",
+    "Vector search finds the documents closest to a query embedding.",
+    "int8 quantization trades a little accuracy for much faster CPU inference on long inputs " * 4,
+]
+MIN_COSINE = 0.99
+TRANSFORMER_INPUTS = ("input_ids", "attention_mask", "token_type_ids")
+
+class _TokenEmbeddings(torch.nn.Module):
+    # The exported graph: token ids in, token embeddings out
+    def __init__(self, transformer: torch.nn.Module, input_names: List[str]):
+        super().__init__()
+        self.transformer = transformer
+        self.input_names = input_names
+
+    def forward(self, *inputs):
+        return self.transformer(**dict(zip(self.input_names, inputs)))[0]
+
+def cosine_similarities(a: np.ndarray, b: np.ndarray) -> np.ndarray:
+    return (a * b).sum(axis=1) / np.maximum(np.linalg.norm(a, axis=1) * np.linalg.norm(b, axis=1), 1e-12)
+
+class OnnxEncoder:
+    """
+    Runs a SentenceTransformer's transformer with ONNX Runtime instead of
+    PyTorch. The transformer is exported once to `onnx_dir` (and with
+    `quantize`, dynamically quantized to int8 weights); tokenization and the
+    pooling / normalization modules stay in sentence-transformers, so the
+    embeddings match the PyTorch model's. Opening a model checks that they
+    do, on VERIFY_TEXTS, and refuses models below MIN_COSINE.
+
+    Same `encode()` contract as TimedEncoder.
+    """
+
+    def __init__(self, model: SentenceTransformer, model_name: str, onnx_dir: str, quantize: bool = False):
+        self.model = model
+        self.quantize = quantize
+        # encode() tokenizes through preprocess() in newer sentence-transformers, tokenize() in older ones
+        self._tokenize = getattr(model, "preprocess", None) or model.tokenize
+        self._post_modules = list(model)[1:]
+        self.path = path = self._export(model_name, onnx_dir)
+        options = ort.SessionOptions()
+        options.graph_optimization_level = ort.GraphOptimizationLevel.ORT_ENABLE_ALL
+        self.session = ort.InferenceSession(path, options, providers=["CPUExecutionProvider"])
+        self.input_names = [session_input.name for session_input in self.session.get_inputs()]
+        self.min_cosine = self.verify()
+        if self.min_cosine < MIN_COSINE:
+            raise ValueError(f"ONNX embeddings of {model_name} differ from PyTorch's (cosine {self.min_cosine:.4f} < {MIN_COSINE})")
+        logger.info(f"Loaded ONNX model {path} (cosine to PyTorch >= {self.min_cosine:.4f})")
+
+    def _features(self, texts: List[str]) -> dict:
+        return {name: value for name, value in self._tokenize(texts).items() if isinstance(value, torch.Tensor)}
+
+    def _export(self, model_name: str, onnx_dir: str) -> str:
+        directory = os.path.join(onnx_dir, model_name.replace("/", "__"))
+        path = os.path.join(directory, "model.onnx")
+        quantized_path = os.path.join(directory, "model.int8.onnx")
+        os.makedirs(directory, exist_ok=True)
+        # Temporary files plus rename, since several worker processes may export at once
+        suffix = f".{os.getpid()}.{threading.get_ident()}.tmp"
+        if not os.path.exists(path):
+            logger.info(f"Exporting {model_name} to ONNX at {path}")
+            features = self._features(VERIFY_TEXTS[:2])
+            input_names = [name for name in TRANSFORMER_INPUTS if name in features]
+            dynamic_axes = {name: {0: "batch", 1: "sequence"} for name in input_names + ["token_embeddings"]}
+            with torch.no_grad():
+                torch.onnx.export(_TokenEmbeddings(self.model[0].auto_model, input_names).eval(),
+                                  tuple(features[name] for name in input_names), path + suffix,
+                                  input_names=input_names, output_names=["token_embeddings"],
+                                  dynamic_axes=dynamic_axes, opset_version=17, dynamo=False)
+            os.replace(path + suffix, path)
+        if not self.quantize:
+            return path
+        if not os.path.exists(quantized_path):
+            from onnxruntime.quantization import QuantType, quantize_dynamic
+            logger.info(f"Quantizing {path} to int8 at {quantized_path}")
+            quantize_dynamic(path, quantized_path + suffix, weight_type=QuantType.QInt8)
+            os.replace(quantized_path + suffix, quantized_path)
+        return quantized_path
+
+    def _encode_batch(self, texts: List[str]) -> Tuple[np.ndarray, float, float, float]:
+        start = time.perf_counter()
+        features = self._features(texts)
+        efficiency = batch_padding_efficiency(feature_lengths(features))
+        tokenized = time.perf_counter()
+        token_embeddings = self.session.run(None, {name: features[name].numpy() for name in self.input_names})[0]
+        features["token_embeddings"] = torch.from_numpy(token_embeddings)
+        with torch.inference_mode():
+            for module in self._post_modules:
+                features = module(features)
+        return features["sentence_embedding"].numpy(), efficiency, tokenized - start, time.perf_counter() - tokenized
+
+    def encode(self, texts: List[str], batch_size: int) -> Tuple[np.ndarray, float, float, List[float]]:
+        """Same contract as TimedEncoder.encode; forward seconds cover the ONNX model and pooling."""
+        # Sorted by character length, like SentenceTransformer.encode, so
+        # batching costs no tokenization pass of its own
+        lengths = np.fromiter((len(text) for text in texts), dtype=np.int64, count=len(texts))
+        tokenize_seconds = forward_seconds = 0.0
+        embeddings = None
+        efficiencies = []
+        for bucket in length_buckets(lengths, batch_size):
+            batch, efficiency, tokenize, forward = self._encode_batch([texts[position] for position in bucket])
+            if embeddings is None:
+                embeddings = np.empty((len(texts), batch.shape[1]), dtype=np.float32)
+            embeddings[bucket] = batch
+            efficiencies.append(efficiency)
+            tokenize_seconds += tokenize
+            forward_seconds += forward
+        if embeddings is None:
+            embeddings = np.empty((0, 0), dtype=np.float32)
+        return embeddings, tokenize_seconds, forward_seconds, efficiencies
+
+    def verify(self, texts: List[str] = VERIFY_TEXTS) -> float:
+        """Smallest cosine similarity between these embeddings and the PyTorch model's."""
+        reference = self.model.encode(texts, convert_to_numpy=True)
+        embeddings = self.encode(texts, len(texts))[0]
+        return float(cosine_similarities(embeddings, reference).min())
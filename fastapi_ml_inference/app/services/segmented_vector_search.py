@@ -0,0 +1,345 @@
+import json
+import os
+import shutil
+import threading
+from contextlib import contextmanager
+from typing import List, Mapping, Optional, Sequence
+import numpy as np
+from services.metadata_index import MetadataValue
+from services.sharded_vector_search import merge_results
+from services.vector_search import COMPACTION_CHUNK, VectorSearch, assign_doc_ids
+from utils.logger import logger
+
+# Marks a directory as a segmented snapshot; each segment snapshots into its own subdirectory
+SEGMENTS_FILE = "segments.json"
+
+class _Segment:
+    __slots__ = ("name", "index", "raw", "readers", "retired")
+
+    def __init__(self, name: str, index: VectorSearch, raw: bool):
+        self.name = name
+        self.index = index
+        # Raw segments are former write segments, still in the flat write layout
+        self.raw = raw
+        # Searches currently reading the segment; once it has been merged away
+        # (retired), the last of them removes its files
+        self.readers = 0
+        self.retired = False
+
+class SegmentedVectorSearch:
+    """
+    Log-structured VectorSearch: all writes go to a small flat "mutable"
+    segment; once it holds `segment_size` vectors it is sealed and a fresh one
+    takes over. Sealed segments never receive vectors again, only tombstones.
+
+    Readers take the current tuple of segments (swapped atomically, never
+    modified in place) and search each of them, so they never wait for
+    writers beyond a segment's own brief lock. `merge()`, run in the
+    background, builds a segment of the configured index type from sealed
+    segments (raw ones first, then the smallest ones while there are more than
+    `max_segments`) on the side, including any training, and swaps it in.
+    Training and large index builds therefore never block searches.
+
+    Exposes the VectorSearch methods the service uses, so main.py can use
+    either one.
+    """
+
+    def __init__(self, dimension: int, segment_size: int = 10000, max_segments: int = 8, **vector_search_settings):
+        if segment_size < 1:
+            raise ValueError(f"Segment size must be positive, got {segment_size}")
+        logger.info(f"Initializing segmented vector search with {segment_size}-vector segments")
+        self._setup(dimension, segment_size, max_segments, vector_search_settings)
+        self._mutable = self._new_segment(raw=True)
+        self._sealed = ()
+        self._publish()
+
+    def _setup(self, dimension: int, segment_size: int, max_segments: int, vector_search_settings: dict):
+        self.dimension = dimension
+        self.segment_size = segment_size
+        self.max_segments = max(max_segments, 1)
+        self._rerank_path = vector_search_settings.pop("rerank_path", None)
+        self._settings = vector_search_settings
+        # Raw segments only need rebuilding if the configured layout differs from theirs
+        self._rebuild_raw = (vector_search_settings.get("index_type", "flat") != "flat"
+                             or vector_search_settings.get("storage", "float32") != "float32"
+                             or self._rerank_path is not None)
+        self._next_segment = 0
+        self._next_doc_id = 0
+        # Serializes writers: adds, deletes, sealing, merge swaps and the
+        # in-memory copies taken by saves
+        self._write_lock = threading.Lock()
+        self._merge_lock = threading.Lock()
+        self._save_lock = threading.Lock()
+        # Guards reader counts, and the layout readers pick up
+        self._readers_lock = threading.Lock()
+        self._layout_version = 0
+        self._saved_layout_version = 0
+
+    def _new_segment(self, raw: bool) -> _Segment:
+        name = f"segment-{self._next_segment}"
+        self._next_segment += 1
+        if raw:
+            index = VectorSearch(self.dimension, **dict(self._settings, index_type="flat", storage="float32"))
+        else:
+            index = VectorSearch(self.dimension, rerank_path=f"{self._rerank_path}.{name}" if self._rerank_path else None,
+                                 **self._settings)
+        return _Segment(name, index, raw)
+
+    def _publish(self):
+        # One reference assignment, so readers see either the old or the new layout
+        with self._readers_lock:
+            self._segments = self._sealed + (self._mutable,)
+        self._layout_version += 1
+
+    @contextmanager
+    def _reading(self):
+        """The current segments, kept from having their files removed until the block exits."""
+        with self._readers_lock:
+            segments = self._segments
+            for segment in segments:
+                segment.readers += 1
+        try:
+            yield segments
+        finally:
+            with self._readers_lock:
+                for segment in segments:
+                    segment.readers -= 1
+                done = [segment for segment in segments if segment.retired and not segment.readers]
+            for segment in done:
+                segment.index.remove_rerank_file()
+
+    @property
+    def ntotal(self) -> int:
+        return sum(segment.index.ntotal for segment in self._segments)
+
+    @property
+    def tombstone_ratio(self) -> float:
+        segments = self._segments
+        stored = sum(segment.index.stored for segment in segments)
+        return sum(segment.index.tombstones for segment in segments) / stored if stored else 0.0
+
+    @property
+    def has_unsaved_changes(self) -> bool:
+        return (self._layout_version != self._saved_layout_version
+                or any(segment.index.has_unsaved_changes for segment in self._segments))
+
+    def bytes_per_vector(self) -> float:
+        # The largest segment has the configured layout once merged
+        return max(self._segments, key=lambda segment: segment.index.ntotal).index.bytes_per_vector()
+
+    def contains(self, doc_id: int) -> bool:
+        return any(segment.index.contains(doc_id) for segment in self._segments)
+
+    def documents(self, doc_ids: Sequence[int], filter: Optional[Mapping] = None) -> List[Optional[str]]:
+        result: List[Optional[str]] = [None] * len(doc_ids)
+        # Newest segment first: during an upsert the new version is already there
+        for segment in reversed(self._segments):
+            missing = [position for position, text in enumerate(result) if text is None]
+            if not missing:
+                break
+            texts = segment.index.documents([doc_ids[position] for position in missing], filter)
+            for position, text in zip(missing, texts):
+                result[position] = text
+        return result
+
+    def vectors(self, doc_ids: Sequence[int]) -> np.ndarray:
+        result = np.full((len(doc_ids), self.dimension), np.nan, dtype=np.float32)
+        with self._reading() as segments:
+            # Newest segment first, as in documents()
+            for segment in reversed(segments):
+                missing = np.flatnonzero(np.isnan(result[:, 0]))
+                if not len(missing):
+                    break
+                vectors = segment.index.vectors([doc_ids[position] for position in missing.tolist()])
+                found = ~np.isnan(vectors[:, 0])
+                result[missing[found]] = vectors[found]
+        return result
+
+    def iter_live(self, batch_size: int = COMPACTION_CHUNK):
+        with self._reading() as segments:
+            for segment in segments:
+                yield from segment.index.iter_live(batch_size)
+
+    def add(self, embedding: np.ndarray, text: str, doc_id: Optional[int] = None,
+            metadata: Optional[Mapping[str, MetadataValue]] = None) -> int:
+        return self.add_batch(embedding.reshape(1, -1), [text], None if doc_id is None else [doc_id],
+                              None if metadata is None else [metadata])[0]
+
+    def add_batch(self, embeddings: np.ndarray, texts: List[str], doc_ids: Optional[Sequence[Optional[int]]] = None,
+                  metadata: Optional[Sequence[Optional[Mapping[str, MetadataValue]]]] = None) -> List[int]:
+        with self._write_lock:
+            assigned, self._next_doc_id = assign_doc_ids([None] * len(texts) if doc_ids is None else doc_ids,
+                                                         self._next_doc_id)
+            self._mutable.index.add_batch(embeddings, texts, assigned, metadata)
+            # Upserts: retire older versions in sealed segments (the mutable
+            # segment handles its own). Readers may briefly see both versions.
+            replaced = [doc_id for doc_id in (doc_ids or []) if doc_id is not None]
+            if replaced:
+                for segment in self._sealed:
+                    segment.index.delete(replaced)
+            if self._mutable.index.stored >= self.segment_size:
+                logger.info(f"Sealing {self._mutable.name} with {self._mutable.index.ntotal} vectors")
+                self._sealed += (self._mutable,)
+                self._mutable = self._new_segment(raw=True)
+                self._publish()
+        return assigned
+
+    def reserve_doc_ids(self, next_doc_id: int):
+        """Makes new ids start at `next_doc_id` or above, e.g. past documents deleted before a rebuild."""
+        with self._write_lock:
+            self._next_doc_id = max(self._next_doc_id, next_doc_id)
+
+    def delete(self, doc_ids: Sequence[int]) -> int:
+        with self._write_lock:
+            return sum(segment.index.delete(doc_ids) for segment in self._segments)
+
+    def search(self, query_embedding: np.ndarray, k: int, nprobe: Optional[int] = None, ef_search: Optional[int] = None,
+               filter: Optional[Mapping] = None) -> list:
+        return self.search_batch(query_embedding.reshape(1, -1), k, nprobe=nprobe, ef_search=ef_search, filter=filter)[0]
+
+    def search_batch(self, query_embeddings: np.ndarray, k: int, nprobe: Optional[int] = None,
+                     ef_search: Optional[int] = None, rerank: Optional[bool] = None, return_stats: bool = False,
+                     filter: Optional[Mapping] = None):
+        """Same contract as VectorSearch.search_batch, over all segments."""
+        try:
+            with self._reading() as segments:
+                batch_results, stats = merge_results([
+                    segment.index.search_batch(query_embeddings, k, nprobe=nprobe, ef_search=ef_search, rerank=rerank,
+                                               return_stats=True, filter=filter)
+                    for segment in segments
+                ], k)
+            if return_stats:
+                return batch_results, stats
+            return batch_results
+        except Exception as e:
+            logger.error(f"Error during segmented search: {str(e)}")
+            raise
+
+    def compact(self) -> int:
+        return sum(segment.index.compact() for segment in self._segments)
+
+    def _merge_candidates(self) -> List[_Segment]:
+        sealed = list(self._sealed)
+        if len(sealed) > self.max_segments:
+            by_size = sorted(sealed, key=lambda segment: segment.index.stored)
+            return by_size[:max(len(sealed) - self.max_segments + 1, 2)]
+        if self._rebuild_raw:
+            return [segment for segment in sealed if segment.raw]
+        return []
+
+    def merge(self) -> bool:
+        """
+        Merges sealed segments if the policy calls for it; returns whether it
+        did. Runs alongside searches and writes.
+        """
+        with self._merge_lock:
+            with self._write_lock:
+                candidates = self._merge_candidates()
+                if not candidates:
+                    return False
+                target = self._new_segment(raw=False)
+            logger.info(f"Merging {[segment.name for segment in candidates]} into {target.name}")
+            copied = []
+            for segment in candidates:
+                for vectors, texts, doc_ids, metadata in segment.index.iter_live():
+                    target.index.add_batch(vectors, texts, doc_ids, metadata)
+                    copied.append((segment, doc_ids))
+            with self._write_lock:
+                # Documents deleted or replaced while they were being copied
+                stale = [doc_id for segment, doc_ids in copied for doc_id in doc_ids if not segment.index.contains(doc_id)]
+                if stale:
+                    target.index.delete(stale)
+                self._sealed = tuple(segment for segment in self._sealed if segment not in candidates) + (target,)
+                self._publish()
+            # Searches that started before the swap may still read the
+            # sources; the last of them removes their files instead
+            with self._readers_lock:
+                for segment in candidates:
+                    segment.retired = True
+                idle = [segment for segment in candidates if not segment.readers]
+            for segment in idle:
+                segment.index.remove_rerank_file()
+            logger.info(f"Merged into {target.name} with {target.index.ntotal} vectors")
+            return True
+
+    @staticmethod
+    def latest_snapshot(directory: str) -> Optional[str]:
+        return directory if os.path.exists(os.path.join(directory, SEGMENTS_FILE)) else None
+
+    def save(self, directory: str, compress_texts: bool = False) -> str:
+        """
+        Snapshots the segments that changed since the last save, each into its
+        own subdirectory, then atomically replaces the segment list. Writes
+        wait only while the segments are copied in memory, so they are saved
+        in a consistent state; the disk writes happen after.
+        """
+        try:
+            os.makedirs(directory, exist_ok=True)
+            # One save at a time, since each removes segment directories the other may be writing
+            with self._save_lock:
+                with self._write_lock:
+                    segments = self._segments
+                    snapshots = [
+                        (segment, segment.index.snapshot()) for segment in segments
+                        if segment.index.has_unsaved_changes
+                        or VectorSearch.latest_snapshot(os.path.join(directory, segment.name)) is None
+                    ]
+                    layout = {
+                        "dimension": self.dimension,
+                        "segment_size": self.segment_size,
+                        "max_segments": self.max_segments,
+                        "settings": self._settings,
+                        "segments": [{"name": segment.name, "raw": segment.raw} for segment in self._sealed],
+                        "mutable": self._mutable.name,
+                        "next_segment": self._next_segment,
+                        "next_doc_id": self._next_doc_id,
+                    }
+                    layout_version = self._layout_version
+                for segment, snapshot in snapshots:
+                    segment.index.write_snapshot(os.path.join(directory, segment.name), snapshot, compress_texts)
+                layout_path = os.path.join(directory, SEGMENTS_FILE)
+                with open(layout_path + ".tmp", "w", encoding="utf-8") as f:
+                    json.dump(layout, f)
+                    f.flush()
+                    os.fsync(f.fileno())
+                os.replace(layout_path + ".tmp", layout_path)
+                names = {segment.name for segment in segments}
+                for entry in os.listdir(directory):
+                    if entry.startswith("segment-") and entry not in names:
+                        shutil.rmtree(os.path.join(directory, entry), ignore_errors=True)
+                self._saved_layout_version = layout_version
+            logger.info(f"Saved {len(segments)} segments to {directory}")
+            return directory
+        except Exception as e:
+            logger.error(f"Error saving segmented snapshot: {str(e)}")
+            raise
+
+    @classmethod
+    def load(cls, directory: str, mmap: bool = True, rerank_path: Optional[str] = None,
+             **search_settings) -> "SegmentedVectorSearch":
+        """Opens a segmented snapshot; `search_settings` override the saved query-time defaults."""
+        try:
+            with open(os.path.join(directory, SEGMENTS_FILE), "r", encoding="utf-8") as f:
+                layout = json.load(f)
+            segmented = cls.__new__(cls)
+            segmented._setup(layout["dimension"], layout["segment_size"], layout["max_segments"],
+                             dict(layout["settings"], rerank_path=rerank_path, **search_settings))
+            segmented._next_segment = layout["next_segment"]
+            segmented._next_doc_id = layout["next_doc_id"]
+
+            def open_segment(name: str, raw: bool, mapped: bool) -> _Segment:
+                path = os.path.join(directory, name)
+                segment_rerank_path = None if raw or not rerank_path else f"{rerank_path}.{name}"
+                return _Segment(name, VectorSearch.load(path, mmap=mapped, rerank_path=segment_rerank_path,
+                                                        **search_settings), raw)
+
+            segmented._sealed = tuple(open_segment(entry["name"], entry["raw"], mmap) for entry in layout["segments"])
+            # The write segment keeps growing, so it is read into memory
+            segmented._mutable = open_segment(layout["mutable"], True, False)
+            segmented._publish()
+            segmented._saved_layout_version = segmented._layout_version
+            logger.info(f"Loaded {len(segmented._segments)} segments with {segmented.ntotal} vectors from {directory}")
+            return segmented
+        except Exception as e:
+            logger.error(f"Error loading segmented snapshot: {str(e)}")
+            raise
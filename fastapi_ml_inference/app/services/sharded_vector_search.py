@@ -0,0 +1,238 @@
+import heapq
+import itertools
+import json
+import os
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from typing import List, Mapping, Optional, Sequence
+import numpy as np
+from services.metadata_index import MetadataValue
+from services.vector_search import COMPACTION_CHUNK, VectorSearch, assign_doc_ids
+from utils.logger import logger
+
+PLACEMENTS = ("round_robin", "hash")
+# Marks a directory as a sharded snapshot; each shard snapshots into shard-<n>/
+SHARDS_FILE = "shards.json"
+
+def merge_results(partial_results: list, k: int):
+    """
+    Merges (hits, stats) pairs from search_batch(return_stats=True) calls on
+    disjoint parts of the corpus into one (hits, stats) pair.
+    """
+    batch_results = []
+    stats = []
+    for query in range(len(partial_results[0][0])):
+        # Each part's hits are sorted by similarity already; merge the sorted runs
+        runs = [hits[query] for hits, _ in partial_results]
+        batch_results.append(list(itertools.islice(heapq.merge(*runs, key=lambda hit: -hit["similarity"]), k)))
+        losses = [part_stats[query]["recall_loss"] for _, part_stats in partial_results]
+        losses = [loss for loss in losses if loss is not None]
+        stats.append({"recall_loss": sum(losses) / len(losses) if losses else None})
+    return batch_results, stats
+
+class ShardedVectorSearch:
+    """
+    VectorSearch split into `shards` independent shards, each driven by its
+    own thread. FAISS releases the GIL while adding and searching, so the
+    shards run on separate cores.
+
+    Searches are scattered to every shard and the per-shard top-k lists are
+    merged with a heap. Adds are split by document id: "round_robin" places
+    id n on shard n % shards, which spreads the sequentially assigned ids
+    evenly, while "hash" mixes the id first for caller-chosen ids that are
+    not sequential. Either way a document's shard follows from its id, so
+    upserts and deletes reach the shard holding the old version.
+
+    Exposes the VectorSearch methods the service uses, so main.py can use
+    either one.
+    """
+
+    def __init__(self, dimension: int, shards: int, placement: str = "round_robin", **vector_search_settings):
+        if shards < 1:
+            raise ValueError(f"Need at least one shard, got {shards}")
+        if placement not in PLACEMENTS:
+            raise ValueError(f"Unknown placement {placement!r}, expected one of {PLACEMENTS}")
+        logger.info(f"Initializing {shards} {placement} vector search shards")
+        rerank_path = vector_search_settings.pop("rerank_path", None)
+        self._setup([
+            VectorSearch(dimension, rerank_path=f"{rerank_path}.shard{number}" if rerank_path else None,
+                         **vector_search_settings)
+            for number in range(shards)
+        ], placement)
+
+    def _setup(self, shards: List[VectorSearch], placement: str):
+        self.shards = shards
+        self.placement = placement
+        self.dimension = shards[0].dimension
+        self._next_doc_id = max(shard._next_doc_id for shard in shards)
+        self._id_lock = threading.Lock()
+        self._pool = ThreadPoolExecutor(max_workers=len(shards), thread_name_prefix="vector-shard")
+
+    def _shard_of(self, doc_id: int) -> int:
+        if self.placement == "hash":
+            # Fibonacci hashing spreads clustered ids
+            doc_id = ((doc_id * 0x9E3779B97F4A7C15) & 0xFFFFFFFFFFFFFFFF) >> 32
+        return doc_id % len(self.shards)
+
+    def _scatter(self, calls):
+        """Runs (shard, method, args, kwargs) calls on the shard threads and returns their results in order."""
+        futures = [self._pool.submit(getattr(shard, method), *args, **kwargs) for shard, method, args, kwargs in calls]
+        return [future.result() for future in futures]
+
+    @property
+    def ntotal(self) -> int:
+        return sum(shard.ntotal for shard in self.shards)
+
+    @property
+    def is_trained(self) -> bool:
+        return all(shard.is_trained for shard in self.shards)
+
+    @property
+    def can_rerank(self) -> bool:
+        return all(shard.can_rerank for shard in self.shards)
+
+    @property
+    def tombstone_ratio(self) -> float:
+        stored = sum(shard.stored for shard in self.shards)
+        return sum(shard.tombstones for shard in self.shards) / stored if stored else 0.0
+
+    @property
+    def has_unsaved_changes(self) -> bool:
+        return any(shard.has_unsaved_changes for shard in self.shards)
+
+    def bytes_per_vector(self) -> float:
+        return self.shards[0].bytes_per_vector()
+
+    def contains(self, doc_id: int) -> bool:
+        return self.shards[self._shard_of(doc_id)].contains(doc_id)
+
+    def documents(self, doc_ids: Sequence[int], filter: Optional[Mapping] = None) -> List[Optional[str]]:
+        positions = {}
+        for position, doc_id in enumerate(doc_ids):
+            positions.setdefault(self._shard_of(doc_id), []).append(position)
+        result: List[Optional[str]] = [None] * len(doc_ids)
+        for number, shard_positions in positions.items():
+            texts = self.shards[number].documents([doc_ids[position] for position in shard_positions], filter)
+            for position, text in zip(shard_positions, texts):
+                result[position] = text
+        return result
+
+    def vectors(self, doc_ids: Sequence[int]) -> np.ndarray:
+        positions = {}
+        for position, doc_id in enumerate(doc_ids):
+            positions.setdefault(self._shard_of(doc_id), []).append(position)
+        result = np.full((len(doc_ids), self.dimension), np.nan, dtype=np.float32)
+        for number, shard_positions in positions.items():
+            result[shard_positions] = self.shards[number].vectors([doc_ids[position] for position in shard_positions])
+        return result
+
+    def iter_live(self, batch_size: int = COMPACTION_CHUNK):
+        for shard in self.shards:
+            yield from shard.iter_live(batch_size)
+
+    def add(self, embedding: np.ndarray, text: str, doc_id: Optional[int] = None,
+            metadata: Optional[Mapping[str, MetadataValue]] = None) -> int:
+        return self.add_batch(embedding.reshape(1, -1), [text], None if doc_id is None else [doc_id],
+                              None if metadata is None else [metadata])[0]
+
+    def add_batch(self, embeddings: np.ndarray, texts: List[str], doc_ids: Optional[Sequence[Optional[int]]] = None,
+                  metadata: Optional[Sequence[Optional[Mapping[str, MetadataValue]]]] = None) -> List[int]:
+        if len(embeddings) != len(texts):
+            raise ValueError(f"Got {len(embeddings)} embeddings for {len(texts)} texts")
+        # Ids are assigned here rather than per shard, so they are unique across shards
+        with self._id_lock:
+            assigned, self._next_doc_id = assign_doc_ids([None] * len(texts) if doc_ids is None else doc_ids,
+                                                         self._next_doc_id)
+        rows = {}
+        for row, doc_id in enumerate(assigned):
+            rows.setdefault(self._shard_of(doc_id), []).append(row)
+        self._scatter([
+            (self.shards[number], "add_batch",
+             (embeddings[shard_rows], [texts[row] for row in shard_rows], [assigned[row] for row in shard_rows],
+              None if metadata is None else [metadata[row] for row in shard_rows]), {})
+            for number, shard_rows in rows.items()
+        ])
+        return assigned
+
+    def reserve_doc_ids(self, next_doc_id: int):
+        """Makes new ids start at `next_doc_id` or above, e.g. past documents deleted before a rebuild."""
+        with self._id_lock:
+            self._next_doc_id = max(self._next_doc_id, next_doc_id)
+
+    def delete(self, doc_ids: Sequence[int]) -> int:
+        grouped = {}
+        for doc_id in doc_ids:
+            grouped.setdefault(self._shard_of(doc_id), []).append(doc_id)
+        return sum(self.shards[number].delete(shard_doc_ids) for number, shard_doc_ids in grouped.items())
+
+    def search(self, query_embedding: np.ndarray, k: int, nprobe: Optional[int] = None, ef_search: Optional[int] = None,
+               filter: Optional[Mapping] = None) -> list:
+        return self.search_batch(query_embedding.reshape(1, -1), k, nprobe=nprobe, ef_search=ef_search, filter=filter)[0]
+
+    def search_batch(self, query_embeddings: np.ndarray, k: int, nprobe: Optional[int] = None,
+                     ef_search: Optional[int] = None, rerank: Optional[bool] = None, return_stats: bool = False,
+                     filter: Optional[Mapping] = None):
+        """Same contract as VectorSearch.search_batch, over all shards."""
+        try:
+            shard_results = self._scatter([
+                (shard, "search_batch", (query_embeddings, k),
+                 dict(nprobe=nprobe, ef_search=ef_search, rerank=rerank, return_stats=True, filter=filter))
+                for shard in self.shards
+            ])
+            batch_results, stats = merge_results(shard_results, k)
+            if return_stats:
+                return batch_results, stats
+            return batch_results
+        except Exception as e:
+            logger.error(f"Error during sharded search: {str(e)}")
+            raise
+
+    def compact(self) -> int:
+        return sum(self._scatter([(shard, "compact", (), {}) for shard in self.shards]))
+
+    @staticmethod
+    def latest_snapshot(directory: str) -> Optional[str]:
+        return directory if os.path.exists(os.path.join(directory, SHARDS_FILE)) else None
+
+    def save(self, directory: str, compress_texts: bool = False) -> str:
+        """
+        Snapshots every shard into its own subdirectory (each one atomic on
+        its own), then records the shard layout.
+        """
+        try:
+            self._scatter([
+                (shard, "save", (os.path.join(directory, f"shard-{number}"), compress_texts), {})
+                for number, shard in enumerate(self.shards)
+            ])
+            layout = os.path.join(directory, SHARDS_FILE)
+            with open(layout + ".tmp", "w", encoding="utf-8") as f:
+                json.dump({"shards": len(self.shards), "placement": self.placement}, f)
+            os.replace(layout + ".tmp", layout)
+            return directory
+        except Exception as e:
+            logger.error(f"Error saving sharded snapshot: {str(e)}")
+            raise
+
+    @classmethod
+    def load(cls, directory: str, mmap: bool = True, rerank_path: Optional[str] = None,
+             **search_settings) -> "ShardedVectorSearch":
+        """Opens a sharded snapshot; the shard count and placement come from the snapshot."""
+        try:
+            with open(os.path.join(directory, SHARDS_FILE), "r", encoding="utf-8") as f:
+                layout = json.load(f)
+            with ThreadPoolExecutor(max_workers=layout["shards"]) as pool:
+                shards = list(pool.map(
+                    lambda number: VectorSearch.load(os.path.join(directory, f"shard-{number}"), mmap=mmap,
+                                                     rerank_path=f"{rerank_path}.shard{number}" if rerank_path else None,
+                                                     **search_settings),
+                    range(layout["shards"])))
+            sharded = cls.__new__(cls)
+            sharded._setup(shards, layout["placement"])
+            logger.info(f"Loaded {layout['shards']} shards with {sharded.ntotal} vectors from {directory}")
+            return sharded
+        except Exception as e:
+            logger.error(f"Error loading sharded snapshot: {str(e)}")
+            raise
+
+    def close(self):
+        self._pool.shutdown(wait=True)
@@ -0,0 +1,101 @@
+import asyncio
+import time
+from typing import AsyncIterator, Awaitable, Callable, Dict, List, Optional, Tuple
+
+# Error lines streamed back before only the count is reported
+MAX_REPORTED_ERRORS = 100
+
+async def iter_ndjson_lines(chunks: AsyncIterator[bytes], max_line_bytes: int) -> AsyncIterator[Tuple[int, Optional[bytes]]]:
+    """
+    Splits a byte stream into (line number, line) pairs without holding more
+    than one line. Lines longer than `max_line_bytes` are skipped and yielded
+    as None; blank lines are dropped.
+    """
+    buffer = bytearray()
+    line_number = 0
+    too_long = False
+    async for chunk in chunks:
+        start = 0
+        while True:
+            end = chunk.find(b"\n", start)
+            piece = chunk[start:] if end < 0 else chunk[start:end]
+            if not too_long:
+                buffer += piece
+                if len(buffer) > max_line_bytes:
+                    too_long = True
+                    buffer.clear()
+            if end < 0:
+                break
+            start = end + 1
+            line_number += 1
+            if too_long:
+                too_long = False
+                yield line_number, None
+            elif buffer.strip():
+                yield line_number, bytes(buffer)
+            buffer.clear()
+    if too_long:
+        yield line_number + 1, None
+    elif buffer.strip():
+        yield line_number + 1, bytes(buffer)
+
+async def ingest_ndjson(lines: AsyncIterator[Tuple[int, Optional[bytes]]], parse: Callable[[bytes], tuple],
+                        index_batch: Callable[[List[tuple]], Awaitable[object]], batch_size: int) -> AsyncIterator[dict]:
+    """
+    Parses lines into items, indexes them `batch_size` at a time and yields
+    progress records. One batch is indexed while the next one is read; the
+    source is not read further until that batch is done, so memory stays at
+    about two batches however long the stream is. If `index_batch` returns a
+    dict of counts, their running totals are added to the progress records.
+    """
+    started = time.perf_counter()
+    indexed = 0
+    errors = 0
+    totals: Dict[str, int] = {}
+    batch: List[tuple] = []
+    pending: Optional[asyncio.Task] = None
+    pending_size = 0
+
+    async def finish_pending():
+        nonlocal indexed
+        counts = await pending
+        indexed += pending_size
+        if isinstance(counts, dict):
+            for name, count in counts.items():
+                totals[name] = totals.get(name, 0) + count
+        return {"line": line_number, "indexed": indexed, "errors": errors, **totals,
+                "texts_per_second": indexed / max(time.perf_counter() - started, 1e-9)}
+
+    line_number = 0
+    try:
+        async for line_number, line in lines:
+            if line is None:
+                errors += 1
+                if errors <= MAX_REPORTED_ERRORS:
+                    yield {"line": line_number, "error": "Line too long"}
+                continue
+            try:
+                batch.append(parse(line))
+            except Exception as e:
+                errors += 1
+                if errors <= MAX_REPORTED_ERRORS:
+                    yield {"line": line_number, "error": str(e)}
+                continue
+            if len(batch) >= batch_size:
+                if pending is not None:
+                    yield await finish_pending()
+                pending, pending_size = asyncio.ensure_future(index_batch(batch)), len(batch)
+                batch = []
+        if pending is not None:
+            yield await finish_pending()
+            pending = None
+        if batch:
+            pending, pending_size = asyncio.ensure_future(index_batch(batch)), len(batch)
+            yield await finish_pending()
+            pending = None
+        yield {"done": True, "line": line_number, "indexed": indexed, "errors": errors, **totals,
+               "seconds": time.perf_counter() - started}
+    finally:
+        # The client went away or indexing failed; don't leave a batch running unobserved
+        if pending is not None and not pending.done():
+            pending.cancel()
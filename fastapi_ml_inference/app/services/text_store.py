@@ -0,0 +1,143 @@
+import json
+import os
+import threading
+from array import array
+from collections import OrderedDict
+from typing import Iterable, Iterator, List, Optional, Sequence
+import numpy as np
+from utils.logger import logger
+
+try:
+    import zstandard
+except ImportError:  # Compression is optional
+    zstandard = None
+
+class TextStore:
+    """
+    Compact append-only store of strings, addressed by position.
+
+    Texts are kept as UTF-8 in one contiguous byte buffer plus an int64
+    offsets array, instead of one Python object per text. A store loaded from
+    disk keeps that part (the base) memory-mapped, optionally zstd-compressed
+    in blocks of `block_size` texts; later appends go to an in-memory tail.
+    Strings are only materialized when looked up.
+    """
+
+    def __init__(self):
+        self._base_data = np.empty(0, dtype=np.uint8)
+        self._base_offsets = np.zeros(1, dtype=np.int64)
+        self._block_size = 0  # 0 means the base is not compressed
+        self._block_offsets = None
+        self._decoded_blocks: "OrderedDict[int, bytes]" = OrderedDict()
+        self._blocks_lock = threading.Lock()
+        self._tail = bytearray()
+        self._tail_offsets = array("q", [0])
+
+    @property
+    def _base_count(self) -> int:
+        return len(self._base_offsets) - 1
+
+    def __len__(self) -> int:
+        return self._base_count + len(self._tail_offsets) - 1
+
+    @property
+    def nbytes(self) -> int:
+        """Bytes held by this store, whether in memory or mapped."""
+        return (self._base_data.nbytes + self._base_offsets.nbytes + len(self._tail)
+                + self._tail_offsets.itemsize * len(self._tail_offsets))
+
+    def append(self, text: str):
+        self._tail += text.encode("utf-8")
+        self._tail_offsets.append(len(self._tail))
+
+    def extend(self, texts: Iterable[str]):
+        for text in texts:
+            self.append(text)
+
+    def _block(self, block_no: int) -> bytes:
+        with self._blocks_lock:
+            block = self._decoded_blocks.get(block_no)
+            if block is not None:
+                self._decoded_blocks.move_to_end(block_no)
+                return block
+        start, end = self._block_offsets[block_no], self._block_offsets[block_no + 1]
+        block = zstandard.ZstdDecompressor().decompress(self._base_data[start:end].tobytes())
+        with self._blocks_lock:
+            self._decoded_blocks[block_no] = block
+            if len(self._decoded_blocks) > 64:
+                self._decoded_blocks.popitem(last=False)
+        return block
+
+    def _base_bytes(self, position: int) -> bytes:
+        start, end = self._base_offsets[position], self._base_offsets[position + 1]
+        if not self._block_size:
+            return self._base_data[start:end].tobytes()
+        block_no = position // self._block_size
+        block_start = self._base_offsets[block_no * self._block_size]
+        return self._block(block_no)[start - block_start:end - block_start]
+
+    def __getitem__(self, position: int) -> str:
+        if position < 0:
+            position += len(self)
+        if not 0 <= position < len(self):
+            raise IndexError(f"TextStore index {position} out of range")
+        if position < self._base_count:
+            return self._base_bytes(position).decode("utf-8")
+        position -= self._base_count
+        return self._tail[self._tail_offsets[position]:self._tail_offsets[position + 1]].decode("utf-8")
+
+    def get_many(self, positions: Sequence[int]) -> List[str]:
+        return [self[position] for position in positions]
+
+    def iter_range(self, start: int, end: int) -> Iterator[str]:
+        for position in range(start, end):
+            yield self[position]
+
+    def save(self, directory: str, count: Optional[int] = None, compress: bool = False, block_size: int = 256):
+        """Writes the first `count` texts (default: all) as data.bin + offsets.npy."""
+        if compress and zstandard is None:
+            raise RuntimeError("Compressed text stores need the 'zstandard' package")
+        count = len(self) if count is None else count
+        os.makedirs(directory, exist_ok=True)
+        offsets = np.zeros(count + 1, dtype=np.int64)
+        block_offsets = [0]
+        compressor = zstandard.ZstdCompressor() if compress else None
+        with open(os.path.join(directory, "data.bin"), "wb") as f:
+            # Compressed stores are written one block at a time
+            chunk = block_size if compress else 65536
+            for start in range(0, count, chunk):
+                encoded = [text.encode("utf-8") for text in self.iter_range(start, min(start + chunk, count))]
+                lengths = np.fromiter((len(data) for data in encoded), dtype=np.int64, count=len(encoded))
+                offsets[start + 1:start + 1 + len(encoded)] = offsets[start] + np.cumsum(lengths)
+                payload = b"".join(encoded)
+                if compressor is not None:
+                    payload = compressor.compress(payload)
+                    block_offsets.append(block_offsets[-1] + len(payload))
+                f.write(payload)
+        np.save(os.path.join(directory, "offsets.npy"), offsets)
+        if compress:
+            np.save(os.path.join(directory, "blocks.npy"), np.asarray(block_offsets, dtype=np.int64))
+        with open(os.path.join(directory, "meta.json"), "w", encoding="utf-8") as f:
+            json.dump({"count": count, "block_size": block_size if compress else 0}, f)
+
+    @classmethod
+    def load(cls, directory: str, mmap: bool = True) -> "TextStore":
+        with open(os.path.join(directory, "meta.json"), "r", encoding="utf-8") as f:
+            meta = json.load(f)
+        store = cls()
+        mmap_mode = "r" if mmap else None
+        data_path = os.path.join(directory, "data.bin")
+        if os.path.getsize(data_path) == 0:
+            store._base_data = np.empty(0, dtype=np.uint8)
+        elif mmap:
+            store._base_data = np.memmap(data_path, dtype=np.uint8, mode="r")
+        else:
+            store._base_data = np.fromfile(data_path, dtype=np.uint8)
+        store._base_offsets = np.load(os.path.join(directory, "offsets.npy"), mmap_mode=mmap_mode)
+        store._block_size = meta["block_size"]
+        if store._block_size:
+            if zstandard is None:
+                raise RuntimeError("This text store is compressed and needs the 'zstandard' package")
+            store._block_offsets = np.load(os.path.join(directory, "blocks.npy"))
+        logger.info(f"Loaded text store with {meta['count']} texts from {directory} (mmap={mmap})")
+        return store
@@ -0,0 +1,156 @@
+import io
+from typing import AsyncIterator, Iterator, List, Optional, Sequence, Tuple
+import numpy as np
+
+# Rows of little-endian float32 (vectors) or int64 (ids), no framing
+RAW_MEDIA_TYPE = "application/octet-stream"
+ARROW_MEDIA_TYPE = "application/vnd.apache.arrow.stream"
+VECTOR_DTYPE = np.dtype("<f4")
+ID_DTYPE = np.dtype("<i8")
+
+class UnsupportedFormatError(Exception):
+    """Raised for a body format the service can't read or write, e.g. Arrow without pyarrow."""
+
+def _pyarrow():
+    # Only the Arrow format needs pyarrow
+    try:
+        import pyarrow
+        import pyarrow.ipc  # noqa: F401
+    except ImportError:
+        raise UnsupportedFormatError("Arrow IPC needs pyarrow installed; use application/octet-stream instead")
+    return pyarrow
+
+async def iter_raw_batches(chunks: AsyncIterator[bytes], row_bytes: int, batch_rows: int) -> AsyncIterator[bytes]:
+    """
+    Regroups a byte stream into buffers of `batch_rows` whole rows (the last
+    one may be shorter), so the caller can np.frombuffer them without ever
+    holding the whole body. Raises ValueError if the stream ends mid-row.
+    """
+    batch_bytes = row_bytes * batch_rows
+    buffer = bytearray()
+    async for chunk in chunks:
+        buffer += chunk
+        if len(buffer) >= batch_bytes:
+            whole = len(buffer) - len(buffer) % batch_bytes
+            for start in range(0, whole, batch_bytes):
+                yield bytes(buffer[start:start + batch_bytes])
+            del buffer[:whole]
+    if len(buffer) % row_bytes:
+        raise ValueError(f"Body ends with a partial row: {len(buffer) % row_bytes} of {row_bytes} bytes")
+    if buffer:
+        yield bytes(buffer)
+
+def _vector_column(column, dimension: int) -> np.ndarray:
+    pa = _pyarrow()
+    if isinstance(column, pa.ChunkedArray):
+        column = column.combine_chunks()
+    if column.null_count:
+        raise ValueError("The vector column must not contain nulls")
+    if pa.types.is_fixed_size_list(column.type):
+        width = column.type.list_size
+    elif pa.types.is_list(column.type) or pa.types.is_large_list(column.type):
+        offsets = column.offsets.to_numpy()
+        lengths = np.diff(offsets)
+        if len(lengths) and (lengths != lengths[0]).any():
+            raise ValueError("All vectors must have the same length")
+        width = int(lengths[0]) if len(lengths) else dimension
+    else:
+        raise ValueError(f"The vector column must be a list of float32, got {column.type}")
+    if width != dimension:
+        raise ValueError(f"Vectors have {width} dimensions, the index has {dimension}")
+    values = column.flatten()
+    if values.type != pa.float32():
+        values = values.cast(pa.float32())
+    # A view of the Arrow buffer, not a copy
+    return values.to_numpy(zero_copy_only=True).reshape(-1, dimension)
+
+def read_arrow(body: bytes, dimension: int, vectors: bool = True) -> Iterator[
+        Tuple[Optional[np.ndarray], Optional[List[str]], Optional[List[Optional[int]]]]]:
+    """
+    Yields (vectors, texts, ids) per record batch of an Arrow IPC stream with
+    a `vector` column and optional `text` and `id` columns. Without
+    `vectors`, the stream needs an `id` column instead and vectors are None.
+    """
+    pa = _pyarrow()
+    try:
+        reader = pa.ipc.open_stream(pa.py_buffer(body))
+    except pa.ArrowInvalid as e:
+        raise ValueError(f"Not an Arrow IPC stream: {str(e)}")
+    required = "vector" if vectors else "id"
+    if required not in reader.schema.names:
+        raise ValueError(f"The Arrow stream needs a {required!r} column")
+    for batch in reader:
+        names = batch.schema.names
+        texts = [text or "" for text in batch.column("text").to_pylist()] if "text" in names else None
+        ids = batch.column("id").to_pylist() if "id" in names else None
+        yield _vector_column(batch.column("vector"), dimension) if vectors else None, texts, ids
+
+class _ChunkSink(io.RawIOBase):
+    # File-like sink the Arrow writer flushes into; drained after every batch
+    def __init__(self):
+        super().__init__()
+        self.chunks: List[bytes] = []
+
+    def writable(self) -> bool:
+        return True
+
+    def write(self, data) -> int:
+        self.chunks.append(bytes(data))
+        return len(data)
+
+    def drain(self) -> bytes:
+        data = b"".join(self.chunks)
+        self.chunks.clear()
+        return data
+
+class ArrowStreamWriter:
+    """
+    Encodes record batches as an Arrow IPC stream and hands back the bytes of
+    each batch as it is written, so a response can stream them without
+    building the whole table. `columns` are (name, kind) pairs, kind being a
+    pyarrow type name such as "int64" or "string", or "vector" for
+    fixed-size lists of `dimension` float32 values.
+    """
+
+    def __init__(self, columns: Sequence[Tuple[str, str]], dimension: int):
+        pa = _pyarrow()
+        self._pa = pa
+        self.dimension = dimension
+        self.schema = pa.schema([(name, pa.list_(pa.float32(), dimension) if kind == "vector" else getattr(pa, kind)())
+                                 for name, kind in columns])
+        self._vector_columns = {name for name, kind in columns if kind == "vector"}
+        self._sink = _ChunkSink()
+        self._writer = pa.ipc.new_stream(self._sink, self.schema)
+
+    def write(self, columns: dict) -> bytes:
+        """Encodes one record batch (after the schema, the first time); vector columns are (n, dimension) arrays."""
+        pa = self._pa
+        arrays = []
+        for field in self.schema:
+            values = columns[field.name]
+            if field.name in self._vector_columns:
+                flat = np.ascontiguousarray(values, dtype=VECTOR_DTYPE).reshape(-1)
+                # pa.array wraps the float32 buffer without copying it
+                arrays.append(pa.FixedSizeListArray.from_arrays(pa.array(flat), self.dimension))
+            else:
+                arrays.append(pa.array(values, type=field.type))
+        self._writer.write_batch(pa.record_batch(arrays, schema=self.schema))
+        return self._sink.drain()
+
+    def close(self) -> bytes:
+        """The end-of-stream marker (and the schema, if no batch was written)."""
+        self._writer.close()
+        return self._sink.drain()
+
+def record_dtype(dimension: int) -> np.dtype:
+    """Raw export record: int64 document id, then the float32 vector, packed."""
+    return np.dtype([("id", ID_DTYPE), ("vector", VECTOR_DTYPE, (dimension,))])
+
+def hits_to_arrays(batch_results: List[List[dict]], k: int) -> Tuple[np.ndarray, np.ndarray]:
+    """(ids, similarities) of shape (queries, k); missing hits are id -1 with similarity 0."""
+    ids = np.full((len(batch_results), k), -1, dtype=ID_DTYPE)
+    similarities = np.zeros((len(batch_results), k), dtype=VECTOR_DTYPE)
+    for row, hits in enumerate(batch_results):
+        ids[row, :len(hits)] = [hit["id"] for hit in hits]
+        similarities[row, :len(hits)] = [hit["similarity"] for hit in hits]
+    return ids, similarities
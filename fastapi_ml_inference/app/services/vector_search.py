@@ -1,32 +1,792 @@
 import faiss
+import json
+import os
+import shutil
+import threading
+import time
+from array import array
 import numpy as np
-from utils.logger import logger
+from typing import List, Mapping, Optional, Sequence
+from services.embedding_store import MmapVectorFile
+from services.metadata_index import MetadataIndex, MetadataValue
+from services.text_store import TextStore
+from utils.logger import logger, sampled
+
+INDEX_TYPES = ("flat", "ivf_flat", "hnsw", "ivf_pq")
+# How each vector is encoded inside the index
+STORAGE_TYPES = ("float32", "float16", "int8", "pq")
+# File in a snapshot directory naming the latest complete snapshot
+SNAPSHOT_POINTER = "CURRENT"
+# IndexIDMap2 keeps an 8-byte id per vector plus a reverse hash map entry
+IDMAP_BYTES_PER_VECTOR = 48
+# Stored vectors copied per lock acquisition during compaction
+COMPACTION_CHUNK = 16384
+# Document ids are int64; -1 pads missing hits in search results
+MAX_DOC_ID = 2**63 - 1
+
+def assign_doc_ids(doc_ids: Sequence[Optional[int]], next_doc_id: int):
+    """
+    Fills in missing (None) document ids and returns (ids, next free id).
+    Fresh ids start above every id given explicitly. Raises ValueError for
+    ids outside [0, MAX_DOC_ID], before anything is indexed.
+    """
+    next_doc_id = max([next_doc_id] + [doc_id + 1 for doc_id in doc_ids if doc_id is not None])
+    assigned = []
+    for doc_id in doc_ids:
+        if doc_id is None:
+            doc_id = next_doc_id
+            next_doc_id += 1
+        assigned.append(int(doc_id))
+    if assigned and not (0 <= min(assigned) and max(assigned) <= MAX_DOC_ID):
+        raise ValueError(f"Document ids must be between 0 and {MAX_DOC_ID}")
+    return assigned, next_doc_id
 
 class VectorSearch:
-    def __init__(self, dimension: int):
-        logger.info(f"Initializing Faiss index with dimension: {dimension}")
-        self.index = faiss.IndexFlatL2(dimension)  # L2 distance index
-        self.texts = []  # Store original texts
+    """
+    FAISS index plus the texts it was built from.
+
+    `index_type` selects the ANN structure: "flat" (exact brute force),
+    "ivf_flat", "hnsw" or "ivf_pq". Index types that need training (the IVF
+    variants) start out serving exact search from a flat staging index; once
+    `train_size` vectors have arrived the real index is trained on them and
+    takes over, keeping the same ids.
+
+    `storage` selects how vectors are encoded inside the index: "float32",
+    "float16" or "int8" scalar quantization, or "pq" product quantization
+    ("ivf_pq" always uses "pq"). When `rerank_path` is given, full-precision
+    copies of the vectors are appended to that file, and searches can re-rank
+    `rerank_factor * k` compressed candidates by their exact distance.
+
+    Every stored vector has a slot, its FAISS id (via IndexIDMap2), which is
+    never reused and survives compaction. Documents have stable ids that map
+    to their current slot. Deleting or replacing a document tombstones its old
+    slot in a bitmap that searches hand to FAISS as an IDSelector, and
+    `compact()` rebuilds the index without tombstones while searches go on.
+
+    Documents may carry flat metadata. Searches can be filtered on it: the
+    filter becomes a slot bitmap that FAISS applies while searching, and
+    filters matching at most `filter_exact_threshold` documents are answered
+    by exact search over just those vectors, which is both faster and, for
+    HNSW, avoids graph walks that find no match at all.
+
+    `save()` writes an atomic snapshot of the index and texts; `load()` opens
+    one with FAISS memory mapping (the inverted lists of IVF indexes, the codes
+    and graph of flat and HNSW ones), so startup time doesn't grow with the
+    corpus and processes loading the same snapshot share its pages. The
+    mapping is read-only: the first write copies the index into memory.
+    """
+
+    def __init__(self, dimension: int, index_type: str = "flat", nlist: int = 1024, hnsw_m: int = 32,
+                 pq_m: int = 16, train_size: int = 0, nprobe: int = 8, ef_search: int = 64,
+                 storage: str = "float32", rerank_path: Optional[str] = None, rerank_factor: int = 4,
+                 filter_exact_threshold: int = 10000):
+        if index_type not in INDEX_TYPES:
+            raise ValueError(f"Unknown index type {index_type!r}, expected one of {INDEX_TYPES}")
+        if storage not in STORAGE_TYPES:
+            raise ValueError(f"Unknown storage type {storage!r}, expected one of {STORAGE_TYPES}")
+        if index_type == "ivf_pq":
+            if storage not in ("float32", "pq"):
+                raise ValueError(f"ivf_pq always stores PQ codes, it cannot use {storage!r} storage")
+            storage = "pq"
+        logger.info(f"Initializing Faiss {index_type} index ({storage} storage) with dimension: {dimension}")
+        self.dimension = dimension
+        self.index_type = index_type
+        self.storage = storage
+        # Structural settings, recorded in snapshots so load() can rebuild the same index
+        self.config = {"index_type": index_type, "storage": storage, "nlist": nlist, "hnsw_m": hnsw_m,
+                       "pq_m": pq_m, "train_size": train_size}
+        self.nprobe = nprobe
+        self.ef_search = ef_search
+        self._factory = self._factory_string(index_type, storage, nlist, hnsw_m, pq_m)
+        self.index = faiss.IndexIDMap2(self._new_inner_index())
+        # FAISS warns below ~39 training points per IVF list or PQ centroid
+        if index_type.startswith("ivf"):
+            default_train_size = 39 * nlist
+        else:
+            default_train_size = 39 * 256 if storage == "pq" else 1000
+        # k-means needs at least one point per IVF list and per PQ centroid
+        minimum_train_size = max(nlist if index_type.startswith("ivf") else 1, 256 if storage == "pq" else 1)
+        self.train_size = max(train_size or default_train_size, minimum_train_size)
+        self._staging = None if self.index.is_trained else self._new_staging_index()
+        self.rerank_factor = rerank_factor
+        self.filter_exact_threshold = filter_exact_threshold
+        self._full_vectors = None
+        self._rerank_generation = 0
+        if rerank_path:
+            # A new index starts empty
+            self._open_full_vectors(rerank_path, 0)
+        self.texts = TextStore()  # Store original texts, UTF-8 in one arena
+        self.metadata = MetadataIndex()
+        # Per stored vector, in slot order: its slot and the document it holds
+        self._slots = array("q")
+        self._doc_ids = array("q")
+        self._slot_of_doc = {}  # live document id -> slot
+        # One bit per slot, set while the slot holds a live document
+        self._alive = np.zeros(1024, dtype=np.uint8)
+        self._alive_selector = faiss.IDSelectorBitmap(len(self._alive), faiss.swig_ptr(self._alive))
+        self._next_slot = 0
+        self._next_doc_id = 0
+        self.tombstones = 0
+        # An index memory-mapped from a snapshot is read-only until the first write
+        self._mapped = False
+        # Bumped on every change so snapshots can be skipped when nothing changed
+        self.version = 0
+        self.saved_version = 0
+        # Adds and searches run on inference executor threads; the index and
+        # text store must not be mutated while a search reads them
+        self._lock = threading.Lock()
+        self._compaction_lock = threading.Lock()
+
+    @staticmethod
+    def _read_rerank_generation(path: str) -> int:
+        try:
+            with open(path + ".generation", "r", encoding="utf-8") as f:
+                return int(f.read().strip())
+        except FileNotFoundError:
+            return 0
+
+    @staticmethod
+    def _write_rerank_generation(path: str, generation: int):
+        with open(path + ".generation.tmp", "w", encoding="utf-8") as f:
+            f.write(str(generation))
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(path + ".generation.tmp", path + ".generation")
+
+    def _open_full_vectors(self, path: str, rows: int, generation: Optional[int] = None):
+        """
+        Opens the rerank file for the first `rows` stored vectors. The file
+        lives outside the snapshots and compaction rewrites it in place, so
+        `generation` is the one a snapshot was taken at; a file rewritten
+        since then no longer lines up with the snapshot's slots.
+        """
+        current = self._read_rerank_generation(path)
+        if generation is not None and generation != current:
+            logger.warning(f"Rerank file {path} was rewritten since the snapshot (generation {current}, "
+                           f"snapshot {generation}), re-ranking disabled")
+            return
+        full_vectors = MmapVectorFile(path, self.dimension)
+        if len(full_vectors) < rows:
+            logger.warning(f"Rerank file {path} has {len(full_vectors)} of {rows} vectors, re-ranking disabled")
+            full_vectors.close()
+            return
+        # Rows must line up with stored vectors
+        full_vectors.truncate(rows)
+        self._full_vectors = full_vectors
+        self._rerank_generation = current
+
+    @staticmethod
+    def _factory_string(index_type: str, storage: str, nlist: int, hnsw_m: int, pq_m: int) -> str:
+        codec = {"float32": "Flat", "float16": "SQfp16", "int8": "SQ8", "pq": f"PQ{pq_m}"}[storage]
+        if index_type == "flat":
+            return codec
+        if index_type == "hnsw":
+            return f"HNSW{hnsw_m}" if storage == "float32" else f"HNSW{hnsw_m},{codec}"
+        return f"IVF{nlist},{codec}"
+
+    def _new_inner_index(self):
+        index = faiss.index_factory(self.dimension, self._factory, faiss.METRIC_L2)
+        if self.index_type.startswith("ivf"):
+            # Lets compaction reconstruct vectors by id
+            faiss.extract_index_ivf(index).make_direct_map()
+        return index
+
+    def _new_staging_index(self):
+        return faiss.IndexIDMap2(faiss.IndexFlatL2(self.dimension))
+
+    @property
+    def can_rerank(self) -> bool:
+        return self._full_vectors is not None
+
+    def remove_rerank_file(self):
+        """Closes and deletes the rerank file, e.g. once this index has been merged away."""
+        with self._lock:
+            full_vectors, self._full_vectors = self._full_vectors, None
+        if full_vectors is not None:
+            full_vectors.close()
+            os.remove(full_vectors.path)
+
+    def bytes_per_vector(self) -> float:
+        """Index memory per stored vector: the encoded vector plus structural overhead."""
+        index = faiss.downcast_index(self.index.index)
+        if isinstance(index, faiss.IndexHNSW):
+            # Codes in the storage index plus 4-byte neighbour ids on the base layer
+            storage = faiss.downcast_index(index.storage)
+            return storage.sa_code_size() + 4 * index.hnsw.nb_neighbors(0) + IDMAP_BYTES_PER_VECTOR
+        if isinstance(index, faiss.IndexIVF):
+            # Codes in the inverted lists plus an 8-byte id per entry and its direct map entry
+            return index.code_size + 16 + IDMAP_BYTES_PER_VECTOR
+        return index.sa_code_size() + IDMAP_BYTES_PER_VECTOR
+
+    @property
+    def is_trained(self) -> bool:
+        return self._staging is None
+
+    @property
+    def ntotal(self) -> int:
+        """Number of live documents."""
+        return len(self._slot_of_doc)
+
+    @property
+    def stored(self) -> int:
+        """Number of stored vectors, tombstoned ones included."""
+        return len(self._slots)
+
+    @property
+    def tombstone_ratio(self) -> float:
+        stored = self.stored
+        return self.tombstones / stored if stored else 0.0
+
+    def _positions(self, slots: np.ndarray) -> np.ndarray:
+        """Text store / rerank file rows of stored `slots`."""
+        return np.searchsorted(np.frombuffer(self._slots, dtype=np.int64), slots)
+
+    def _is_alive(self, slots: np.ndarray) -> np.ndarray:
+        slots = np.asarray(slots, dtype=np.int64)
+        return ((self._alive[slots >> 3] >> (slots & 7).astype(np.uint8)) & 1).astype(bool)
+
+    def _set_alive(self, slots: np.ndarray):
+        needed = int(slots.max() >> 3) + 1
+        if needed > len(self._alive):
+            grown = np.zeros(max(needed, 2 * len(self._alive)), dtype=np.uint8)
+            grown[:len(self._alive)] = self._alive
+            self._alive = grown
+            # The selector points at the bitmap's memory, so it follows the new array
+            self._alive_selector = faiss.IDSelectorBitmap(len(self._alive), faiss.swig_ptr(self._alive))
+        np.bitwise_or.at(self._alive, slots >> 3, (1 << (slots & 7)).astype(np.uint8))
+
+    def _tombstone(self, slot: int):
+        self._alive[slot >> 3] &= np.uint8(~(1 << (slot & 7)) & 0xFF)
+        self.tombstones += 1
+
+    def _copy_mapped_to_memory(self):
+        if self._staging is None and self.index_type.startswith("ivf"):
+            self._copy_invlists_to_memory()
+        elif self._staging is None:
+            # IO_FLAG_MMAP_IFC indexes point straight into the file and abort
+            # on resize; a serialization round trip gives an owned copy
+            self.index = faiss.deserialize_index(faiss.serialize_index(self.index))
+        else:
+            self._staging = faiss.deserialize_index(faiss.serialize_index(self._staging))
+        self._mapped = False
+        logger.info("Copied memory-mapped index into memory for writing")
+
+    def _copy_invlists_to_memory(self):
+        # OnDiskInvertedLists from an mmap'd snapshot can't grow; copy them into
+        # ordinary in-memory lists so this process can keep adding
+        ivf = faiss.extract_index_ivf(self.index)
+        invlists = faiss.ArrayInvertedLists(ivf.nlist, ivf.code_size)
+        mapped = ivf.invlists
+        for list_no in range(ivf.nlist):
+            size = mapped.list_size(list_no)
+            if size:
+                invlists.add_entries(list_no, size, mapped.get_ids(list_no), mapped.get_codes(list_no))
+        ivf.replace_invlists(invlists, True)
+        invlists.this.disown()
+
+    def _add_vectors(self, vectors: np.ndarray, slots: np.ndarray):
+        if self._mapped:
+            self._copy_mapped_to_memory()
+        if self._full_vectors is not None:
+            self._full_vectors.append(vectors)
+        if self._staging is None:
+            self.index.add_with_ids(vectors, slots)
+            return
+        self._staging.add_with_ids(vectors, slots)
+        if self._staging.ntotal >= self.train_size:
+            staged = self._staging.index.reconstruct_n(0, self._staging.ntotal)
+            staged_slots = faiss.vector_to_array(self._staging.id_map)
+            logger.info(f"Training {self.index_type} index on {len(staged)} vectors")
+            try:
+                self.index.train(staged)
+                self.index.add_with_ids(staged, staged_slots)
+            except Exception as e:
+                # The vectors are safe in the staging index; keep serving from it
+                logger.error(f"Training {self.index_type} index failed, staying on exact search: {str(e)}")
+                self.index.reset()
+                return
+            self._staging = None
 
-    def add(self, embedding: np.ndarray, text: str):
+    def add(self, embedding: np.ndarray, text: str, doc_id: Optional[int] = None,
+            metadata: Optional[Mapping[str, MetadataValue]] = None) -> int:
+        return self.add_batch(embedding.reshape(1, -1), [text], None if doc_id is None else [doc_id],
+                              None if metadata is None else [metadata])[0]
+
+    def add_batch(self, embeddings: np.ndarray, texts: List[str], doc_ids: Optional[Sequence[Optional[int]]] = None,
+                  metadata: Optional[Sequence[Optional[Mapping[str, MetadataValue]]]] = None) -> List[int]:
+        """
+        Adds documents and returns their ids. A document whose id is already
+        live replaces it (upsert), metadata included; documents without an id
+        (None) get new ones.
+        """
         try:
-            self.index.add(embedding.reshape(1, -1).astype(np.float32))
-            self.texts.append(text)
-            logger.info(f"Added text to index: {text[:50]}...")
+            if len(embeddings) != len(texts):
+                raise ValueError(f"Got {len(embeddings)} embeddings for {len(texts)} texts")
+            if doc_ids is not None and len(doc_ids) != len(texts):
+                raise ValueError(f"Got {len(doc_ids)} ids for {len(texts)} texts")
+            if metadata is not None and len(metadata) != len(texts):
+                raise ValueError(f"Got {len(metadata)} metadata entries for {len(texts)} texts")
+            # A single matrix add instead of one index.add per text
+            vectors = np.ascontiguousarray(embeddings, dtype=np.float32)
+            with self._lock:
+                # Everything that can reject the batch runs before the index changes,
+                # so a failure leaves the FAISS rows and the id arrays aligned
+                doc_ids, next_doc_id = assign_doc_ids([None] * len(texts) if doc_ids is None else doc_ids,
+                                                      self._next_doc_id)
+                new_doc_ids = array("q", doc_ids)
+                slots = np.arange(self._next_slot, self._next_slot + len(texts), dtype=np.int64)
+                self._add_vectors(vectors, slots)
+                self._next_slot += len(texts)
+                self.texts.extend(texts)
+                self._slots.frombytes(slots.tobytes())
+                self._doc_ids.extend(new_doc_ids)
+                self._set_alive(slots)
+                if metadata is not None:
+                    self.metadata.add(slots, metadata)
+                for doc_id, slot in zip(doc_ids, slots.tolist()):
+                    previous = self._slot_of_doc.get(doc_id)
+                    if previous is not None:
+                        self._tombstone(previous)
+                    self._slot_of_doc[doc_id] = slot
+                self._next_doc_id = next_doc_id
+                self.version += 1
+            if sampled("index.add"):
+                logger.info("Added %d texts to index", len(texts))
+            return doc_ids
         except Exception as e:
-            logger.error(f"Error adding to index: {str(e)}")
+            logger.error(f"Error adding batch to index: {str(e)}")
             raise
 
-    def search(self, query_embedding: np.ndarray, k: int) -> list:
+    def reserve_doc_ids(self, next_doc_id: int):
+        """Makes new ids start at `next_doc_id` or above, e.g. past documents deleted before a rebuild."""
+        with self._lock:
+            self._next_doc_id = max(self._next_doc_id, next_doc_id)
+
+    def delete(self, doc_ids: Sequence[int]) -> int:
+        """Tombstones the given documents and returns how many of them were live."""
+        with self._lock:
+            deleted = 0
+            for doc_id in doc_ids:
+                slot = self._slot_of_doc.pop(doc_id, None)
+                if slot is not None:
+                    self._tombstone(slot)
+                    deleted += 1
+            if deleted:
+                self.version += 1
+        if sampled("index.delete"):
+            logger.info("Deleted %d documents, tombstone ratio %.2f", deleted, self.tombstone_ratio)
+        return deleted
+
+    def contains(self, doc_id: int) -> bool:
+        return doc_id in self._slot_of_doc
+
+    def documents(self, doc_ids: Sequence[int], filter: Optional[Mapping] = None) -> List[Optional[str]]:
+        """Text of each live document matching `filter`, or None, e.g. to resolve hits from another index."""
+        with self._lock:
+            found = [(position, self._slot_of_doc[doc_id]) for position, doc_id in enumerate(doc_ids)
+                     if doc_id in self._slot_of_doc]
+            result: List[Optional[str]] = [None] * len(doc_ids)
+            if not found:
+                return result
+            slots = np.array([slot for _, slot in found], dtype=np.int64)
+            if filter:
+                bitmap = self.metadata.match(filter, len(self._alive))
+                matches = ((bitmap[slots >> 3] >> (slots & 7).astype(np.uint8)) & 1).astype(bool)
+                found = [entry for entry, match in zip(found, matches.tolist()) if match]
+                slots = slots[matches]
+            texts = self.texts.get_many(self._positions(slots).tolist())
+        for (position, _), text in zip(found, texts):
+            result[position] = text
+        return result
+
+    def vectors(self, doc_ids: Sequence[int]) -> np.ndarray:
+        """Stored vector of each live document, as an (n, dimension) float32 array with NaN rows for the others."""
+        result = np.full((len(doc_ids), self.dimension), np.nan, dtype=np.float32)
+        with self._lock:
+            found = [(position, self._slot_of_doc[doc_id]) for position, doc_id in enumerate(doc_ids)
+                     if doc_id in self._slot_of_doc]
+            if not found:
+                return result
+            slots = np.array([slot for _, slot in found], dtype=np.int64)
+            if self._full_vectors is not None:
+                vectors = self._full_vectors.read(self._positions(slots))
+            else:
+                source = self._staging if self._staging is not None else self.index
+                vectors = source.reconstruct_batch(slots)
+        result[[position for position, _ in found]] = vectors
+        return result
+
+    def _search_params(self, nprobe: Optional[int], ef_search: Optional[int], staging: bool = False, selector=None):
+        # Per-call parameter objects, so concurrent searches with different
+        # settings don't race on index-wide attributes
+        if staging or self.index_type == "flat":
+            params = faiss.SearchParameters()
+        elif self.index_type == "hnsw":
+            params = faiss.SearchParametersHNSW()
+            params.efSearch = ef_search or self.ef_search
+        else:
+            params = faiss.SearchParametersIVF()
+            params.nprobe = nprobe or self.nprobe
+        if selector is not None:
+            params.sel = selector
+        elif self.tombstones:
+            # Skip deleted and replaced vectors inside FAISS rather than over-fetching
+            params.sel = self._alive_selector
+        return params
+
+    def _exact_search(self, queries: np.ndarray, slots: np.ndarray, k: int):
+        """Brute-force search over the given slots only."""
+        if self._full_vectors is not None:
+            vectors = self._full_vectors.read(self._positions(slots))
+        else:
+            vectors = (self.index if self._staging is None else self._staging).reconstruct_batch(slots)
+        distances, rows = faiss.knn(queries, vectors, min(k, len(slots)))
+        indices = np.where(rows >= 0, slots[np.maximum(rows, 0)], -1)
+        return distances, indices
+
+    def _rerank(self, queries: np.ndarray, indices: np.ndarray, k: int):
+        """Re-orders candidates by exact L2 distance to the full-precision vectors."""
+        reranked_distances = np.full((len(queries), k), np.inf, dtype=np.float32)
+        reranked_indices = np.full((len(queries), k), -1, dtype=np.int64)
+        recall_losses = []
+        for row, (query, candidates) in enumerate(zip(queries, indices)):
+            candidates = candidates[candidates >= 0]
+            if len(candidates) == 0:
+                recall_losses.append(0.0)
+                continue
+            exact = ((self._full_vectors.read(self._positions(candidates)) - query) ** 2).sum(axis=1)
+            order = np.argsort(exact, kind="stable")[:k]
+            reranked_distances[row, :len(order)] = exact[order]
+            reranked_indices[row, :len(order)] = candidates[order]
+            # Share of the exact top-k (within the candidate pool) that the
+            # compressed index alone would have missed
+            missed = set(candidates[order].tolist()) - set(candidates[:k].tolist())
+            recall_losses.append(len(missed) / len(order))
+        return reranked_distances, reranked_indices, recall_losses
+
+    def search(self, query_embedding: np.ndarray, k: int, nprobe: Optional[int] = None, ef_search: Optional[int] = None,
+               filter: Optional[Mapping] = None) -> list:
+        return self.search_batch(query_embedding.reshape(1, -1), k, nprobe=nprobe, ef_search=ef_search, filter=filter)[0]
+
+    def search_batch(self, query_embeddings: np.ndarray, k: int, nprobe: Optional[int] = None,
+                     ef_search: Optional[int] = None, rerank: Optional[bool] = None, return_stats: bool = False,
+                     filter: Optional[Mapping] = None):
+        """
+        Returns one list of {"id", "text", "similarity"} hits per query. With
+        `return_stats`, returns (hits, stats) where stats holds a per-query
+        "recall_loss" (None unless the query was re-ranked).
+
+        `filter` maps metadata fields to a value or a list of accepted values;
+        only documents matching every field are returned.
+        """
         try:
-            distances, indices = self.index.search(query_embedding.reshape(1, -1).astype(np.float32), k)
-            results = [
-                {"text": self.texts[idx], "similarity": 1 / (1 + dist)}  # Convert L2 distance to similarity
-                for idx, dist in zip(indices[0], distances[0])
-                if idx < len(self.texts)
-            ]
-            logger.info(f"Search completed, found {len(results)} results")
-            return results
+            queries = np.ascontiguousarray(query_embeddings, dtype=np.float32).reshape(-1, self.dimension)
+            rerank = self.can_rerank if rerank is None else rerank and self.can_rerank
+            fetch = k * self.rerank_factor if rerank else k
+            with self._lock:
+                selector = None
+                matched = None
+                if filter:
+                    bitmap = self.metadata.match(filter, len(self._alive)) & self._alive
+                    matched = np.flatnonzero(np.unpackbits(bitmap, bitorder="little"))
+                    selector = faiss.IDSelectorBitmap(len(bitmap), faiss.swig_ptr(bitmap))
+                if matched is not None and len(matched) == 0:
+                    distances = np.zeros((len(queries), 0), dtype=np.float32)
+                    indices = np.zeros((len(queries), 0), dtype=np.int64)
+                    recall_losses = [None] * len(queries)
+                elif matched is not None and self._staging is None and len(matched) <= self.filter_exact_threshold:
+                    # Scanning a few matches beats probing an index built for all of them
+                    distances, indices = self._exact_search(queries, matched, k)
+                    recall_losses = [0.0 if rerank else None] * len(queries)
+                elif self._staging is not None:
+                    # Staged vectors are exact already, there is nothing to re-rank
+                    distances, indices = self._staging.search(queries, k, params=self._search_params(None, None, staging=True, selector=selector))
+                    recall_losses = [0.0 if rerank else None] * len(queries)
+                else:
+                    if matched is not None and self.index_type == "hnsw":
+                        # Only a fraction of the visited nodes pass the filter, so widen the beam to compensate
+                        selectivity = len(matched) / max(len(self._slot_of_doc), 1)
+                        ef_search = min(int((ef_search or self.ef_search) / max(selectivity, 1e-3)), 4096)
+                    if self.index_type == "flat" and self.storage == "pq":
+                        # IndexPQ takes no search parameters, so no selector either; without one to
+                        # apply it is searched as is, otherwise the wanted slots' codes are scanned
+                        if selector is None and not self.tombstones:
+                            distances, indices = self.index.search(queries, fetch)
+                        else:
+                            slots = matched if matched is not None else np.flatnonzero(np.unpackbits(self._alive, bitorder="little"))
+                            distances, indices = self._exact_search(queries, slots, fetch)
+                    else:
+                        distances, indices = self.index.search(queries, fetch, params=self._search_params(nprobe, ef_search, selector=selector))
+                    if rerank:
+                        distances, indices, recall_losses = self._rerank(queries, indices, k)
+                    else:
+                        recall_losses = [None] * len(queries)
+                positions = self._positions(np.maximum(indices, 0))
+                batch_results = [
+                    [
+                        # Convert L2 distance to similarity
+                        {"id": self._doc_ids[position], "text": self.texts[position], "similarity": 1 / (1 + dist)}
+                        for slot, position, dist in zip(row_slots, row_positions, row_distances)
+                        if slot >= 0
+                    ]
+                    for row_slots, row_positions, row_distances in zip(indices, positions, distances)
+                ]
+            if sampled("index.search"):
+                logger.info("Search completed for %d queries", len(queries))
+            if return_stats:
+                return batch_results, [{"recall_loss": loss} for loss in recall_losses]
+            return batch_results
         except Exception as e:
             logger.error(f"Error during search: {str(e)}")
-            raise
\ No newline at end of file
+            raise
+
+    def _read_live(self, start: int, end: int, source):
+        """Slots, vectors, texts and document ids of the live vectors stored at rows [start, end)."""
+        slots = np.frombuffer(self._slots, dtype=np.int64)[start:end].copy()
+        live = self._is_alive(slots)
+        slots = slots[live]
+        if len(slots) == 0:
+            return slots, None, [], []
+        rows = np.arange(start, end)[live]
+        if self._full_vectors is not None:
+            vectors = self._full_vectors.read(rows)
+        else:
+            # Lossy for compressed storage, but it is what the index holds anyway
+            vectors = source.reconstruct_batch(slots)
+        return slots, vectors, self.texts.get_many(rows.tolist()), [self._doc_ids[row] for row in rows.tolist()]
+
+    def iter_live(self, batch_size: int = COMPACTION_CHUNK):
+        """
+        Yields (vectors, texts, doc_ids, metadata) batches of the live
+        documents, taking the lock per batch. Holds off compaction until the
+        caller has consumed every batch.
+        """
+        with self._compaction_lock:
+            with self._lock:
+                stored = len(self._slots)
+                source = self._staging if self._staging is not None else self.index
+                slots = np.frombuffer(self._slots, dtype=np.int64)[:stored].copy()
+                live_slots = slots[self._is_alive(slots)]
+                metadata = self.metadata.entries(live_slots) if len(self.metadata) else None
+            for start in range(0, stored, batch_size):
+                with self._lock:
+                    batch_slots, vectors, texts, doc_ids = self._read_live(start, min(start + batch_size, stored), source)
+                if len(batch_slots) == 0:
+                    continue
+                batch_metadata = None
+                if metadata is not None:
+                    batch_metadata = [metadata[row] for row in np.searchsorted(live_slots, batch_slots).tolist()]
+                yield vectors, texts, doc_ids, batch_metadata
+
+    def compact(self) -> int:
+        """
+        Rebuilds the index, text store and rerank file without tombstoned
+        vectors and returns how many were dropped. Live vectors are copied in
+        chunks with the lock released in between, so searches and adds keep
+        running; only catching up with concurrent adds and the final swap
+        hold the lock for longer.
+        """
+        with self._compaction_lock:
+            with self._lock:
+                if not self.tombstones:
+                    return 0
+                if self._mapped:
+                    self._copy_mapped_to_memory()
+                staging = self._staging is not None
+                source = self._staging if staging else self.index
+                if staging:
+                    target = self._new_staging_index()
+                else:
+                    # A trained, empty copy of the index
+                    inner = faiss.clone_index(self.index.index)
+                    inner.reset()
+                    target = faiss.IndexIDMap2(inner)
+                stored = len(self._slots)
+            started = time.perf_counter()
+            texts, slots, doc_ids = TextStore(), array("q"), array("q")
+            full_vectors = None
+            if self._full_vectors is not None:
+                full_vectors = MmapVectorFile(self._full_vectors.path + ".compact", self.dimension)
+                full_vectors.truncate(0)
+
+            def copy(chunk):
+                chunk_slots, vectors, chunk_texts, chunk_doc_ids = chunk
+                if len(chunk_slots) == 0:
+                    return
+                target.add_with_ids(vectors, chunk_slots)
+                if full_vectors is not None:
+                    full_vectors.append(vectors)
+                texts.extend(chunk_texts)
+                slots.frombytes(chunk_slots.tobytes())
+                doc_ids.extend(chunk_doc_ids)
+
+            for start in range(0, stored, COMPACTION_CHUNK):
+                with self._lock:
+                    if (self._staging is not None) != staging:
+                        break
+                    chunk = self._read_live(start, min(start + COMPACTION_CHUNK, stored), source)
+                copy(chunk)
+            with self._lock:
+                if (self._staging is not None) != staging:
+                    # The index was trained meanwhile, so the copy is stale; the next run retries
+                    if full_vectors is not None:
+                        full_vectors.close()
+                        os.remove(full_vectors.path)
+                    logger.info("Compaction abandoned because the index was trained while it ran")
+                    return 0
+                # Catch up with vectors added during the copy
+                copy(self._read_live(stored, len(self._slots), source))
+                dropped = len(self._slots) - len(slots)
+                if staging:
+                    self._staging = target
+                else:
+                    self.index = target
+                self.texts = texts
+                self._slots = slots
+                self._doc_ids = doc_ids
+                if full_vectors is not None:
+                    path = self._full_vectors.path
+                    self._full_vectors.close()
+                    full_vectors.close()
+                    # Bumped before the swap: after a crash in between, snapshots
+                    # taken before this compaction must not trust the old file either
+                    self._rerank_generation += 1
+                    self._write_rerank_generation(path, self._rerank_generation)
+                    os.replace(full_vectors.path, path)
+                    self._full_vectors = MmapVectorFile(path, self.dimension)
+                # Documents deleted after their chunk was copied are still tombstones
+                self.tombstones = int(np.count_nonzero(~self._is_alive(np.frombuffer(slots, dtype=np.int64))))
+                self.metadata.retain(self._alive)
+                self.version += 1
+            logger.info(f"Compaction dropped {dropped} vectors in {time.perf_counter() - started:.2f}s")
+            return dropped
+
+    @staticmethod
+    def latest_snapshot(directory: str) -> Optional[str]:
+        pointer = os.path.join(directory, SNAPSHOT_POINTER)
+        if not os.path.exists(pointer):
+            return None
+        with open(pointer, "r", encoding="utf-8") as f:
+            return os.path.join(directory, f.read().strip())
+
+    @property
+    def has_unsaved_changes(self) -> bool:
+        return self.version != self.saved_version
+
+    def snapshot(self) -> dict:
+        """
+        In-memory copies of everything a snapshot holds, so `write_snapshot`
+        can run after the lock is released: adds and searches wait for a
+        memcpy of the index, not for the disk writes.
+        """
+        with self._lock:
+            trained = self._staging is None
+            stored = len(self._slots)
+            return {
+                "index_bytes": faiss.serialize_index(self.index if trained else self._staging),
+                "slots": np.frombuffer(self._slots, dtype=np.int64).copy(),
+                "doc_ids": np.frombuffer(self._doc_ids, dtype=np.int64).copy(),
+                "alive": self._alive.copy(),
+                "metadata": self.metadata.snapshot(),
+                "meta": {"dimension": self.dimension, "config": self.config, "trained": trained, "stored": stored,
+                         "next_slot": self._next_slot, "next_doc_id": self._next_doc_id, "tombstones": self.tombstones,
+                         "rerank_generation": self._rerank_generation if self._full_vectors is not None else None},
+                # A text store only grows (compaction swaps in a new one), so its
+                # first `stored` entries can be written outside the lock
+                "texts": self.texts,
+                "version": self.version,
+            }
+
+    def save(self, directory: str, compress_texts: bool = False) -> str:
+        """
+        Writes a snapshot into a fresh subdirectory of `directory` and then
+        atomically repoints CURRENT at it, so a crash mid-write never leaves a
+        half-written snapshot behind. Older snapshots are removed afterwards.
+        """
+        return self.write_snapshot(directory, self.snapshot(), compress_texts)
+
+    def write_snapshot(self, directory: str, snapshot: dict, compress_texts: bool = False) -> str:
+        """Writes a `snapshot()` taken earlier, as `save()` does."""
+        try:
+            os.makedirs(directory, exist_ok=True)
+            name = f"snapshot-{time.time_ns()}"
+            path = os.path.join(directory, name)
+            staging_path = path + ".tmp"
+            os.makedirs(staging_path)
+            meta, stored = snapshot["meta"], snapshot["meta"]["stored"]
+            # Popped so the serialized index is freed as soon as it is on disk
+            snapshot.pop("index_bytes").tofile(os.path.join(staging_path, "index.faiss"))
+            np.save(os.path.join(staging_path, "slots.npy"), snapshot["slots"])
+            np.save(os.path.join(staging_path, "doc_ids.npy"), snapshot["doc_ids"])
+            np.save(os.path.join(staging_path, "alive.npy"), snapshot["alive"])
+            MetadataIndex.write_snapshot(staging_path, snapshot["metadata"])
+            snapshot["texts"].save(os.path.join(staging_path, "texts"), count=stored, compress=compress_texts)
+            with open(os.path.join(staging_path, "meta.json"), "w", encoding="utf-8") as f:
+                json.dump(meta, f)
+            os.replace(staging_path, path)
+            pointer = os.path.join(directory, SNAPSHOT_POINTER)
+            with open(pointer + ".tmp", "w", encoding="utf-8") as f:
+                f.write(name)
+                f.flush()
+                os.fsync(f.fileno())
+            os.replace(pointer + ".tmp", pointer)
+            for entry in os.listdir(directory):
+                # Processes that still map an old snapshot keep its pages until they reload
+                if entry.startswith("snapshot-") and entry != name:
+                    shutil.rmtree(os.path.join(directory, entry), ignore_errors=True)
+            self.saved_version = snapshot["version"]
+            logger.info(f"Saved snapshot of {stored} vectors to {path}")
+            return path
+        except Exception as e:
+            logger.error(f"Error saving snapshot: {str(e)}")
+            raise
+
+    @classmethod
+    def load(cls, directory: str, mmap: bool = True, rerank_path: Optional[str] = None, **search_settings) -> "VectorSearch":
+        """
+        Opens the latest snapshot in `directory`. With `mmap`, FAISS maps the
+        index file instead of reading it into memory: IVF inverted lists
+        through IO_FLAG_MMAP, any other index (including the flat staging
+        index of an untrained IVF) through IO_FLAG_MMAP_IFC. The structure
+        (index type, storage, ...) comes from the snapshot; `search_settings`
+        may override the query-time defaults nprobe, ef_search and
+        rerank_factor.
+        """
+        path = cls.latest_snapshot(directory)
+        if path is None:
+            raise FileNotFoundError(f"No snapshot in {directory}")
+        try:
+            with open(os.path.join(path, "meta.json"), "r", encoding="utf-8") as f:
+                meta = json.load(f)
+            vector_search = cls(meta["dimension"], **meta["config"], **search_settings)
+            # IO_FLAG_MMAP_IFC can't open IVF indexes, and IO_FLAG_MMAP maps nothing else
+            ivf = meta["trained"] and vector_search.index_type.startswith("ivf")
+            flags = (faiss.IO_FLAG_MMAP if ivf else faiss.IO_FLAG_MMAP_IFC) if mmap else 0
+            index = faiss.read_index(os.path.join(path, "index.faiss"), flags)
+            if meta["trained"]:
+                vector_search.index = index
+                vector_search._staging = None
+            else:
+                vector_search._staging = index
+            vector_search._mapped = mmap
+            vector_search.texts = TextStore.load(os.path.join(path, "texts"), mmap=mmap)
+            slots = np.load(os.path.join(path, "slots.npy"))
+            doc_ids = np.load(os.path.join(path, "doc_ids.npy"))
+            vector_search._slots.frombytes(slots.tobytes())
+            vector_search._doc_ids.frombytes(doc_ids.tobytes())
+            vector_search._alive = np.load(os.path.join(path, "alive.npy"))
+            vector_search._alive_selector = faiss.IDSelectorBitmap(len(vector_search._alive),
+                                                                   faiss.swig_ptr(vector_search._alive))
+            live = vector_search._is_alive(slots)
+            vector_search._slot_of_doc = dict(zip(doc_ids[live].tolist(), slots[live].tolist()))
+            vector_search._next_slot = meta["next_slot"]
+            vector_search._next_doc_id = meta["next_doc_id"]
+            vector_search.tombstones = meta["tombstones"]
+            vector_search.metadata = MetadataIndex.load(path)
+            if rerank_path:
+                vector_search._open_full_vectors(rerank_path, meta["stored"], meta.get("rerank_generation"))
+            logger.info(f"Loaded snapshot of {meta['stored']} vectors from {path} (mmap={mmap})")
+            return vector_search
+        except Exception as e:
+            logger.error(f"Error loading snapshot: {str(e)}")
+            raise
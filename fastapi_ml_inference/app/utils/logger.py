@@ -1,12 +1,81 @@
+import atexit
+import itertools
 import logging
+import logging.handlers
+import queue
 import sys
+from typing import Dict
+from utils.settings import get_settings
+
+class QueueFullDropHandler(logging.handlers.QueueHandler):
+    """
+    QueueHandler that hands records to the writer thread unformatted, so the
+    message is only built there, and drops them (counting) when the queue is
+    full rather than blocking the request that logged.
+    """
+
+    def __init__(self, log_queue: queue.Queue):
+        super().__init__(log_queue)
+        self.dropped = 0
+
+    def prepare(self, record: logging.LogRecord) -> logging.LogRecord:
+        # The listener runs in this process, so the record needs no pickling
+        return record
+
+    def enqueue(self, record: logging.LogRecord):
+        try:
+            self.queue.put_nowait(record)
+        except queue.Full:
+            self.dropped += 1
+
+class DrainingQueueListener(logging.handlers.QueueListener):
+    def enqueue_sentinel(self):
+        # Waits for room in a full queue, so what was logged before stop() is still written
+        self.queue.put(self._sentinel)
+
+class EventSampler:
+    """
+    Keeps 1 in N occurrences of each sampled event, for log lines that would
+    otherwise be written on every request. Events without a rate always pass.
+    """
+
+    def __init__(self, rates: Dict[str, int]):
+        self.rates = rates
+        # next() on itertools.count is atomic, so no lock is needed
+        self._counters = {event: itertools.count() for event in rates}
+
+    def __call__(self, event: str) -> bool:
+        counter = self._counters.get(event)
+        return counter is None or next(counter) % self.rates[event] == 0
+
+def parse_sample_rates(value: str) -> Dict[str, int]:
+    """"index.search=1000,index.add=100" -> {"index.search": 1000, "index.add": 100}"""
+    rates = {}
+    for entry in filter(None, (part.strip() for part in value.split(","))):
+        event, _, rate = entry.partition("=")
+        if int(rate) < 1:
+            raise ValueError(f"Log sample rate for {event!r} must be at least 1, got {rate}")
+        rates[event.strip()] = int(rate)
+    return rates
 
 def setup_logger():
+    settings = get_settings()
     logger = logging.getLogger("FastAPI_ML")
     logger.setLevel(logging.INFO)
     handler = logging.StreamHandler(sys.stdout)
     handler.setFormatter(logging.Formatter('%(asctime)s - %(name)s - %(levelname)s - %(message)s'))
-    logger.addHandler(handler)
-    return logger
+    # Requests only put records on the queue; a background thread formats and writes them
+    log_queue = queue.Queue(settings.log_queue_size)
+    queue_handler = QueueFullDropHandler(log_queue)
+    listener = DrainingQueueListener(log_queue, handler)
+    listener.start()
+    # Flushes what is still queued when the process exits
+    atexit.register(listener.stop)
+    logger.addHandler(queue_handler)
+    return logger, queue_handler, EventSampler(parse_sample_rates(settings.log_sample_rates))
 
-logger = setup_logger()
\ No newline at end of file
+logger, log_queue_handler, sampled = setup_logger()
+# Guard for hot-path log lines; checked before the record is built, so a
+# sampled-out line costs a dict lookup:
+#     if sampled("index.search"):
+#         logger.info("Search completed for %d queries", len(queries))
@@ -0,0 +1,215 @@
+import bisect
+import contextvars
+import functools
+import threading
+import time
+from typing import Callable, Dict, List, Optional, Sequence
+from fastapi.routing import APIRoute
+
+# Seconds; spans cache hits (sub-millisecond) to large encode batches
+LATENCY_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+SIZE_BUCKETS = (1, 2, 4, 8, 16, 32, 64, 128, 256, 512, 1024, 4096)
+
+def _escape(value: str) -> str:
+    return value.replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+def _format_labels(names: Sequence[str], values: Sequence[str], extra: str = "") -> str:
+    pairs = [f'{name}="{_escape(str(value))}"' for name, value in zip(names, values)]
+    if extra:
+        pairs.append(extra)
+    return "{" + ",".join(pairs) + "}" if pairs else ""
+
+class Counter:
+    def __init__(self, name: str, help: str, label_names: Sequence[str] = ()):
+        self.name = name
+        self.help = help
+        self.label_names = tuple(label_names)
+        self._values: Dict[tuple, float] = {}
+        self._lock = threading.Lock()
+
+    def inc(self, *labels: str, amount: float = 1.0):
+        with self._lock:
+            self._values[labels] = self._values.get(labels, 0.0) + amount
+
+    def render(self) -> List[str]:
+        with self._lock:
+            values = list(self._values.items())
+        return [f"{self.name}{_format_labels(self.label_names, labels)} {value}" for labels, value in values]
+
+class Histogram:
+    """Cumulative-bucket histogram; `observe()` is one bisect and one locked increment."""
+
+    def __init__(self, name: str, help: str, label_names: Sequence[str] = (), buckets: Sequence[float] = LATENCY_BUCKETS):
+        self.name = name
+        self.help = help
+        self.label_names = tuple(label_names)
+        self.buckets = tuple(buckets)
+        # labels -> [per-bucket counts (last one is +Inf), sum]
+        self._children: Dict[tuple, list] = {}
+        self._lock = threading.Lock()
+
+    def observe(self, value: float, *labels: str):
+        bucket = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            child = self._children.get(labels)
+            if child is None:
+                child = self._children[labels] = [[0] * (len(self.buckets) + 1), 0.0]
+            child[0][bucket] += 1
+            child[1] += value
+
+    def render(self) -> List[str]:
+        with self._lock:
+            children = [(labels, list(counts), total) for labels, (counts, total) in self._children.items()]
+        lines = []
+        for labels, counts, total in children:
+            cumulative = 0
+            for bound, count in zip(self.buckets + (float("inf"),), counts):
+                cumulative += count
+                le = 'le="+Inf"' if bound == float("inf") else f'le="{float(bound)!r}"'
+                lines.append(f"{self.name}_bucket{_format_labels(self.label_names, labels, le)} {cumulative}")
+            lines.append(f"{self.name}_sum{_format_labels(self.label_names, labels)} {total}")
+            lines.append(f"{self.name}_count{_format_labels(self.label_names, labels)} {cumulative}")
+        return lines
+
+class Gauge:
+    """Value read from `read` at scrape time, so nothing is tracked between scrapes."""
+
+    def __init__(self, name: str, help: str, read: Callable[[], Optional[float]], kind: str = "gauge"):
+        self.name = name
+        self.help = help
+        self.read = read
+        # "counter" for running totals kept elsewhere, e.g. the embedding cache's hits
+        self.kind = kind
+
+    def render(self) -> List[str]:
+        value = self.read()
+        return [] if value is None else [f"{self.name} {value}"]
+
+class MetricsRegistry:
+    """Metrics rendered together in the Prometheus text exposition format."""
+
+    def __init__(self):
+        self._metrics: Dict[str, object] = {}
+
+    def _register(self, metric):
+        if metric.name in self._metrics:
+            raise ValueError(f"Metric {metric.name} is already registered")
+        self._metrics[metric.name] = metric
+        return metric
+
+    def counter(self, name: str, help: str, label_names: Sequence[str] = ()) -> Counter:
+        return self._register(Counter(name, help, label_names))
+
+    def histogram(self, name: str, help: str, label_names: Sequence[str] = (),
+                  buckets: Sequence[float] = LATENCY_BUCKETS) -> Histogram:
+        return self._register(Histogram(name, help, label_names, buckets))
+
+    def gauge(self, name: str, help: str, read: Callable[[], Optional[float]], kind: str = "gauge") -> Gauge:
+        return self._register(Gauge(name, help, read, kind))
+
+    def render(self) -> str:
+        lines = []
+        for metric in self._metrics.values():
+            kind = getattr(metric, "kind", None) or type(metric).__name__.lower()
+            lines.append(f"# HELP {metric.name} {metric.help}")
+            lines.append(f"# TYPE {metric.name} {kind}")
+            lines.extend(metric.render())
+        return "\n".join(lines) + "\n"
+
+registry = MetricsRegistry()
+stage_seconds = registry.histogram("inference_stage_seconds", "Time spent in each processing stage", ["stage"])
+request_seconds = registry.histogram("http_request_duration_seconds", "Time from request to last response byte",
+                                     ["method", "path", "status"])
+batch_size = registry.histogram("inference_batch_size", "Items per micro-batch", ["batcher"], SIZE_BUCKETS)
+padding_efficiency = registry.histogram("embedding_padding_efficiency", "Real tokens per computed (padded) token in each model batch",
+                                        buckets=(0.1, 0.2, 0.3, 0.4, 0.5, 0.6, 0.7, 0.8, 0.9, 0.95, 1.0))
+rejected_jobs = registry.counter("inference_rejected_jobs_total", "Jobs rejected because the inference queue was full")
+
+class RequestTimings:
+    __slots__ = ("stages", "handled_at")
+
+    def __init__(self):
+        # Stage name -> seconds, in the order the stages were first recorded
+        self.stages: Dict[str, float] = {}
+        # When the endpoint returned; what follows is response serialization
+        self.handled_at: Optional[float] = None
+
+    def add(self, stages: Dict[str, float]):
+        for stage, seconds in stages.items():
+            self.stages[stage] = self.stages.get(stage, 0.0) + seconds
+
+# Timings of the request being handled. Executor threads run in a copy of the
+# request's context, which still points at the same RequestTimings object.
+_current_timings: contextvars.ContextVar[Optional[RequestTimings]] = contextvars.ContextVar("request_timings", default=None)
+
+def start_timings() -> RequestTimings:
+    """Starts collecting stage timings for the current context (a request or a batch)."""
+    timings = RequestTimings()
+    _current_timings.set(timings)
+    return timings
+
+def current_timings() -> Optional[RequestTimings]:
+    return _current_timings.get()
+
+def record_stage(stage: str, seconds: float):
+    stage_seconds.observe(seconds, stage)
+    timings = _current_timings.get()
+    if timings is not None:
+        timings.stages[stage] = timings.stages.get(stage, 0.0) + seconds
+
+def server_timing(stages: Dict[str, float]) -> str:
+    return ", ".join(f"{stage};dur={seconds * 1000:.2f}" for stage, seconds in stages.items())
+
+class TimedRoute(APIRoute):
+    """APIRoute that notes when the endpoint returns, so serialization can be timed separately."""
+
+    def __init__(self, path: str, endpoint: Callable, **kwargs):
+        @functools.wraps(endpoint)
+        async def timed_endpoint(*args, **endpoint_kwargs):
+            try:
+                return await endpoint(*args, **endpoint_kwargs)
+            finally:
+                timings = _current_timings.get()
+                if timings is not None:
+                    timings.handled_at = time.perf_counter()
+
+        super().__init__(path, timed_endpoint, **kwargs)
+
+class MetricsMiddleware:
+    """
+    Pure ASGI middleware (no extra task per request) that collects stage
+    timings for each HTTP request, adds them as a Server-Timing header and
+    records the request duration.
+    """
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+        start = time.perf_counter()
+        timings = RequestTimings()
+        token = _current_timings.set(timings)
+        status = 500
+
+        async def send_with_timing(message):
+            nonlocal status
+            if message["type"] == "http.response.start":
+                status = message["status"]
+                now = time.perf_counter()
+                if timings.handled_at is not None:
+                    record_stage("serialize", now - timings.handled_at)
+                header = server_timing(dict(timings.stages, total=now - start))
+                message = dict(message, headers=list(message.get("headers", [])) + [(b"server-timing", header.encode("latin-1"))])
+            await send(message)
+
+        try:
+            await self.app(scope, receive, send_with_timing)
+        finally:
+            _current_timings.reset(token)
+            # The route template, so /documents/{doc_id} is one series rather than one per id
+            route = scope.get("route")
+            request_seconds.observe(time.perf_counter() - start, scope["method"],
+                                    getattr(route, "path", "unmatched"), str(status))
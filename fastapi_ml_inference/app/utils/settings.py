@@ -1,5 +1,6 @@
 from pydantic_settings import BaseSettings, SettingsConfigDict
 from pydantic import Field
+from typing import Literal
 from functools import lru_cache
 import os # Although Pydantic handles env vars, os module is useful for general paths if needed
 
@@ -18,6 +19,12 @@ class Settings(BaseSettings):
     # Host and port for the FastAPI application
     host: str = Field("127.0.0.1", env="HOST", description="Host address for the FastAPI server.")
     port: int = Field(8000, env="PORT", description="Port for the FastAPI server.")
+    # Logging goes through a queue to a background writer thread
+    log_queue_size: int = Field(10000, env="LOG_QUEUE_SIZE", ge=1,
+                                description="Log records waiting for the writer thread; further records are dropped and counted.")
+    log_sample_rates: str = Field("embedding.generate=100,index.add=100,index.search=100,index.delete=100",
+                                  env="LOG_SAMPLE_RATES",
+                                  description="Comma-separated event=N pairs; only 1 in N records of each per-request event is logged.")
 
     # --- LLM / Ollama Settings ---
     # `OLLAMA_MODEL` specifies the LLM model to use (e.g., "llama3")
@@ -25,15 +32,150 @@ class Settings(BaseSettings):
 
     # --- Embedding Model Settings ---
     # `EMBEDDING_MODEL` for generating document embeddings
+    # Embedding stores, cache keys and ONNX exports are keyed by this name; stores
+    # written as "all-MiniLM-L6-v2" (the same model) need EMBEDDING_MODEL set to that
     embedding_model: str = Field("sentence-transformers/all-MiniLM-L6-v2",
                                   env="EMBEDDING_MODEL",
-                                  description="Name of the embedding model.")
+                                  description="Name of the default embedding model.")
+    # Further models requests may select; each gets its own index, BM25 index and embedding store
+    embedding_models: str = Field("", env="EMBEDDING_MODELS",
+                                  description="Comma-separated embedding models besides EMBEDDING_MODEL that requests may select.")
+    embedding_pool_max_bytes: int = Field(0, env="EMBEDDING_POOL_MAX_BYTES", ge=0,
+                                          description="Memory budget for loaded embedding models; least recently used ones are unloaded beyond it. 0 = no limit.")
+    # `EMBEDDING_BACKEND=onnx` exports the model to ONNX on first start and runs it with ONNX Runtime
+    embedding_backend: Literal["torch", "onnx"] = Field("torch", env="EMBEDDING_BACKEND",
+                                                       description="Runtime that executes the embedding model.")
+    embedding_onnx_quantize: bool = Field(False, env="EMBEDDING_ONNX_QUANTIZE",
+                                          description="Use dynamically int8-quantized weights with the ONNX backend.")
+    embedding_onnx_dir: str = Field("onnx_models", env="EMBEDDING_ONNX_DIR",
+                                    description="Directory for exported (and quantized) ONNX models.")
   
     # --- FAISS Index Settings ---
     # Directory where FAISS indexes are stored or loaded from
     faiss_index_dir: str = Field("faiss_index", env="FAISS_INDEX_DIR",
                                  description="Directory for storing/loading FAISS index files.")
 
+    # Snapshots of the index and its texts are written to `faiss_index_dir` and loaded with mmap on startup
+    faiss_snapshot: bool = Field(False, env="FAISS_SNAPSHOT",
+                                 description="Load the latest index snapshot on startup and save one on shutdown.")
+    faiss_snapshot_interval_seconds: float = Field(300, env="FAISS_SNAPSHOT_INTERVAL_SECONDS", ge=0,
+                                                   description="Seconds between periodic snapshots; 0 only snapshots on shutdown.")
+    faiss_snapshot_mmap: bool = Field(True, env="FAISS_SNAPSHOT_MMAP",
+                                      description="Memory-map snapshots instead of reading them into memory.")
+    faiss_snapshot_compress_texts: bool = Field(False, env="FAISS_SNAPSHOT_COMPRESS_TEXTS",
+                                                description="zstd-compress snapshot texts in blocks (needs 'zstandard').")
+    # `FAISS_INDEX_TYPE` selects the ANN structure used by VectorSearch
+    faiss_index_type: Literal["flat", "ivf_flat", "hnsw", "ivf_pq"] = Field("flat", env="FAISS_INDEX_TYPE",
+                                                                          description="FAISS index type.")
+    # `FAISS_STORAGE` selects how vectors are encoded: full float32, float16, int8 scalar or product quantization
+    faiss_storage: Literal["float32", "float16", "int8", "pq"] = Field("float32", env="FAISS_STORAGE",
+                                                                     description="Vector encoding inside the index.")
+    faiss_rerank_path: str = Field("", env="FAISS_RERANK_PATH",
+                                   description="File for full-precision vectors used to re-rank compressed results; empty disables.")
+    faiss_rerank_factor: int = Field(4, env="FAISS_RERANK_FACTOR", ge=1,
+                                     description="Candidates fetched per requested result when re-ranking.")
+    faiss_nlist: int = Field(1024, env="FAISS_NLIST", ge=1,
+                             description="Number of IVF lists (ivf_flat, ivf_pq).")
+    faiss_hnsw_m: int = Field(32, env="FAISS_HNSW_M", ge=2,
+                              description="Graph neighbours per node (hnsw).")
+    faiss_pq_m: int = Field(16, env="FAISS_PQ_M", ge=1,
+                            description="Product quantizer sub-vectors; must divide the dimension (ivf_pq).")
+    faiss_train_size: int = Field(0, env="FAISS_TRAIN_SIZE", ge=0,
+                                  description="Vectors collected before IVF training; 0 uses 39 * nlist.")
+    faiss_nprobe: int = Field(8, env="FAISS_NPROBE", ge=1,
+                              description="Default IVF lists probed per query.")
+    faiss_ef_search: int = Field(64, env="FAISS_EF_SEARCH", ge=1,
+                                 description="Default HNSW search beam width.")
+    # Sharding splits the index across threads so one large query batch uses several cores
+    faiss_shards: int = Field(1, env="FAISS_SHARDS", ge=1,
+                              description="Number of index shards; 1 disables sharding.")
+    faiss_shard_placement: Literal["round_robin", "hash"] = Field("round_robin", env="FAISS_SHARD_PLACEMENT",
+                                                                  description="How documents are assigned to shards by id.")
+    faiss_omp_threads: int = Field(0, env="FAISS_OMP_THREADS", ge=0,
+                                   description="OpenMP threads per FAISS call; 0 divides the CPU cores between the shards.")
+    # Segmented (log-structured) mode: writes go to a small segment, background merges build the index
+    faiss_segment_size: int = Field(0, env="FAISS_SEGMENT_SIZE", ge=0,
+                                    description="Vectors per write segment before it is sealed; 0 uses a single index. Needs FAISS_SHARDS=1.")
+    faiss_max_segments: int = Field(8, env="FAISS_MAX_SEGMENTS", ge=1,
+                                    description="Sealed segments kept before the smallest ones are merged.")
+    faiss_merge_interval_seconds: float = Field(5, env="FAISS_MERGE_INTERVAL_SECONDS", gt=0,
+                                                description="Seconds between background segment merge checks.")
+    # Filtered searches matching few documents scan them exactly instead of searching the index
+    faiss_filter_exact_threshold: int = Field(10000, env="FAISS_FILTER_EXACT_THRESHOLD", ge=0,
+                                              description="Filtered searches matching at most this many documents use exact search.")
+    # Deleted and replaced documents leave tombstones that a background task compacts away
+    compaction_tombstone_ratio: float = Field(0.2, env="COMPACTION_TOMBSTONE_RATIO", ge=0, le=1,
+                                              description="Share of tombstoned vectors that triggers compaction; 0 disables it.")
+    compaction_check_interval_seconds: float = Field(10, env="COMPACTION_CHECK_INTERVAL_SECONDS", gt=0,
+                                                     description="Seconds between tombstone ratio checks.")
+
+    # --- Embedding Store Settings ---
+    # Directory of the persistent, memory-mapped embedding store; empty keeps embeddings in memory only
+    embedding_store_dir: str = Field("", env="EMBEDDING_STORE_DIR",
+                                     description="Directory for persisted document embeddings; empty disables it.")
+
+    # --- Micro-Batching Settings ---
+    # Concurrent /add and /search requests arriving within this window are encoded together
+    batch_window_ms: float = Field(5.0, env="BATCH_WINDOW_MS", ge=0,
+                                   description="Milliseconds to wait for more requests before running a batch.")
+    # A batch is dispatched early once it reaches this many requests
+    max_batch_size: int = Field(64, env="MAX_BATCH_SIZE", ge=1,
+                                description="Maximum number of requests coalesced into one batch.")
+
+    # /search_batch runs in chunks so one large request cannot hold the executor for long
+    search_batch_max_queries: int = Field(1024, env="SEARCH_BATCH_MAX_QUERIES", ge=1,
+                                          description="Maximum queries accepted by one /search_batch request.")
+    search_batch_chunk_size: int = Field(64, env="SEARCH_BATCH_CHUNK_SIZE", ge=1,
+                                         description="Queries encoded and searched per executor job in /search_batch.")
+
+    # --- Keyword / Hybrid Search Settings ---
+    # A BM25 index kept next to the vector index serves `mode=sparse` and `mode=hybrid` searches.
+    # Off by default, since it costs memory and add time for every document
+    bm25_enabled: bool = Field(False, env="BM25_ENABLED", description="Maintain a BM25 keyword index of all documents.")
+    bm25_k1: float = Field(1.2, env="BM25_K1", ge=0, description="BM25 term frequency saturation.")
+    bm25_b: float = Field(0.75, env="BM25_B", ge=0, le=1, description="BM25 document length normalization.")
+    hybrid_rrf_k: int = Field(60, env="HYBRID_RRF_K", ge=1, description="Rank offset in reciprocal rank fusion.")
+    hybrid_candidate_factor: int = Field(4, env="HYBRID_CANDIDATE_FACTOR", ge=1,
+                                         description="Hybrid search fuses k times this many hits from each side.")
+
+    # /ingest/stream reads NDJSON incrementally and indexes it in batches of this size
+    ingest_batch_size: int = Field(256, env="INGEST_BATCH_SIZE", ge=1,
+                                   description="Texts encoded and indexed per batch by /ingest/stream.")
+    ingest_max_line_bytes: int = Field(1024 * 1024, env="INGEST_MAX_LINE_BYTES", ge=1,
+                                       description="Longest accepted NDJSON line; longer lines are skipped and reported.")
+
+    # --- Ingest Deduplication Settings ---
+    # Off by default: with it on, adding a text that is already indexed returns the existing
+    # document's id instead of creating a new document
+    dedup_exact: bool = Field(False, env="DEDUP_EXACT",
+                              description="Skip texts whose exact content and metadata are already indexed.")
+    dedup_near_threshold: float = Field(0.0, env="DEDUP_NEAR_THRESHOLD", ge=0, le=1,
+                                        description="Skip texts whose word shingles overlap an indexed document's by at "
+                                                    "least this Jaccard similarity (MinHash-LSH); 0 disables.")
+    dedup_minhash_permutations: int = Field(64, env="DEDUP_MINHASH_PERMUTATIONS", ge=1,
+                                            description="MinHash signature length of near-duplicate detection.")
+    dedup_minhash_bands: int = Field(16, env="DEDUP_MINHASH_BANDS", ge=1,
+                                     description="LSH bands the signature is split into; must divide the permutations.")
+
+    # --- Embedding Cache Settings ---
+    # Repeated texts are served from an in-memory LRU cache instead of the model
+    embedding_cache_max_bytes: int = Field(256 * 1024 * 1024, env="EMBEDDING_CACHE_MAX_BYTES", ge=0,
+                                           description="Memory budget of the embedding cache in bytes; 0 disables it.")
+    embedding_cache_ttl_seconds: float = Field(0, env="EMBEDDING_CACHE_TTL_SECONDS", ge=0,
+                                               description="Seconds before a cached embedding expires; 0 never expires.")
+
+    # --- Inference Executor Settings ---
+    # Model and index work runs on a thread pool so the event loop stays responsive
+    inference_workers: int = Field(0, env="INFERENCE_WORKERS", ge=0,
+                                   description="Inference threads; 0 uses one per CPU core.")
+    inference_concurrency: int = Field(0, env="INFERENCE_CONCURRENCY", ge=0,
+                                       description="Maximum inference jobs running at once; 0 uses the thread count.")
+    inference_max_queue: int = Field(1024, env="INFERENCE_MAX_QUEUE", ge=0,
+                                     description="Maximum inference jobs waiting before requests are rejected with 503.")
+    # Optional process pool for encoding; each process loads its own copy of the model
+    inference_process_workers: int = Field(0, env="INFERENCE_PROCESS_WORKERS", ge=0,
+                                           description="Encode in this many worker processes instead of threads; 0 disables.")
+
     # --- Document Storage Settings ---
     # Directory where source documents are located
     docs_dir: str = Field("documents", env="DOCS_DIR",
@@ -68,8 +210,27 @@ if settings.debug:
     print(f"App Name: {settings.app_name}")
     print(f"Debug Mode: {settings.debug}")
     print(f"Host: {settings.host}, Port: {settings.port}")
+    print(f"Logging: queue of {settings.log_queue_size} records, sampling {settings.log_sample_rates or '(disabled)'}")
     print(f"Ollama Model: {settings.ollama_model}")
-    print(f"Embedding Model: {settings.embedding_model}")
+    print(f"Embedding Model: {settings.embedding_model}, others: {settings.embedding_models or '(none)'}")
+    print(f"Embedding Model Pool: {settings.embedding_pool_max_bytes or '(unlimited)'} bytes")
+    print(f"Embedding Backend: {settings.embedding_backend} (int8={settings.embedding_onnx_quantize}, dir={settings.embedding_onnx_dir})")
     print(f"FAISS Index Directory: {settings.faiss_index_dir}")
+    print(f"FAISS Snapshots: {settings.faiss_snapshot} (every {settings.faiss_snapshot_interval_seconds}s, mmap={settings.faiss_snapshot_mmap})")
+    print(f"FAISS Index Type: {settings.faiss_index_type} (nlist={settings.faiss_nlist}, hnsw_m={settings.faiss_hnsw_m}, pq_m={settings.faiss_pq_m})")
+    print(f"FAISS Storage: {settings.faiss_storage}, Rerank Path: {settings.faiss_rerank_path or '(disabled)'}")
+    print(f"FAISS Shards: {settings.faiss_shards} ({settings.faiss_shard_placement}), OpenMP Threads: {settings.faiss_omp_threads or '(auto)'}")
+    print(f"FAISS Segments: {settings.faiss_segment_size or '(disabled)'} vectors each, at most {settings.faiss_max_segments} sealed")
+    print(f"FAISS Filter Exact Threshold: {settings.faiss_filter_exact_threshold}")
+    print(f"BM25: {settings.bm25_enabled} (k1={settings.bm25_k1}, b={settings.bm25_b}), Hybrid: RRF k={settings.hybrid_rrf_k}, {settings.hybrid_candidate_factor}x candidates")
+    print(f"Compaction: at {settings.compaction_tombstone_ratio:.0%} tombstones, checked every {settings.compaction_check_interval_seconds}s")
+    print(f"Embedding Store Directory: {settings.embedding_store_dir or '(disabled)'}")
+    print(f"Batch Window: {settings.batch_window_ms}ms, Max Batch Size: {settings.max_batch_size}")
+    print(f"Search Batch: up to {settings.search_batch_max_queries} queries in chunks of {settings.search_batch_chunk_size}")
+    print(f"Stream Ingest: batches of {settings.ingest_batch_size}, lines up to {settings.ingest_max_line_bytes} bytes")
+    print(f"Ingest Dedup: exact={settings.dedup_exact}, near={settings.dedup_near_threshold or '(disabled)'}"
+          f" ({settings.dedup_minhash_permutations} permutations in {settings.dedup_minhash_bands} bands)")
+    print(f"Embedding Cache: {settings.embedding_cache_max_bytes} bytes, TTL {settings.embedding_cache_ttl_seconds}s")
+    print(f"Inference Workers: {settings.inference_workers or os.cpu_count()}, Process Workers: {settings.inference_process_workers}")
     print(f"Documents Directory: {settings.docs_dir}")
     print("----------------------------------------")
\ No newline at end of file
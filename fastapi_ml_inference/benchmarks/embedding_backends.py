@@ -0,0 +1,83 @@
+"""
+Throughput and equivalence report for the embedding backends.
+
+Encodes the same synthetic texts with PyTorch, ONNX Runtime and ONNX Runtime
+with int8 weights, and compares each backend's embeddings with PyTorch's.
+Also reports how much of each batch is padding, with and without length
+bucketing:
+
+    python benchmarks/embedding_backends.py --model sentence-transformers/all-MiniLM-L6-v2 --texts 2000 --batch-size 64
+    python benchmarks/embedding_backends.py --words 200   # longer texts
+
+The ONNX models are exported to --onnx-dir on the first run.
+"""
+import argparse
+import json
+import os
+import sys
+import time
+import numpy as np
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "app"))
+
+from services.embedding_service import batch_padding_efficiency, load_encoder, token_lengths  # noqa: E402
+from services.onnx_encoder import MIN_COSINE, cosine_similarities  # noqa: E402
+from utils.logger import logger  # noqa: E402
+
+VOCABULARY = ("vector search index query document embedding model batch latency throughput cpu memory cache "
+              "server request response token sentence quantized weights runtime export graph node layer").split()
+
+def synthetic_texts(n: int, max_words: int, rng: np.random.Generator) -> list:
+    lengths = rng.integers(3, max_words + 1, size=n)
+    return [" ".join(rng.choice(VOCABULARY, size=length)) for length in lengths]
+
+def run(args) -> list:
+    texts = synthetic_texts(args.texts, args.words, np.random.default_rng(args.seed))
+    backends = {
+        "torch": dict(backend="torch"),
+        "onnx": dict(backend="onnx", onnx_dir=args.onnx_dir),
+        "onnx_int8": dict(backend="onnx", onnx_dir=args.onnx_dir, onnx_quantize=True),
+    }
+    lengths = token_lengths(load_encoder(args.model).model, texts)
+    # What batches in arrival order would have computed, for comparison with the length buckets
+    arrival = [batch_padding_efficiency(lengths[start:start + args.batch_size]) for start in range(0, len(texts), args.batch_size)]
+    print(f"padding efficiency in arrival order: {np.mean(arrival):.2f}")
+    report = []
+    reference = None
+    for name, options in backends.items():
+        encoder = load_encoder(args.model, **options)
+        encoder.encode(texts[:args.batch_size], args.batch_size)  # warm up
+        start = time.perf_counter()
+        embeddings, tokenize_seconds, forward_seconds, efficiencies = encoder.encode(texts, args.batch_size)
+        elapsed = time.perf_counter() - start
+        if reference is None:
+            reference = embeddings
+        cosine = cosine_similarities(embeddings, reference)
+        row = {
+            "backend": name,
+            "texts_per_second": len(texts) / elapsed,
+            "tokenize_seconds": tokenize_seconds,
+            "forward_seconds": forward_seconds,
+            "padding_efficiency": float(np.mean(efficiencies)),
+            "min_cosine": float(cosine.min()),
+            "mean_cosine": float(cosine.mean()),
+            "equivalent": bool(cosine.min() > MIN_COSINE),
+        }
+        report.append(row)
+        print(json.dumps(row) if args.json else
+              f"{name:10s} {row['texts_per_second']:8.1f} texts/s  tokenize {tokenize_seconds:.2f}s  "
+              f"forward {forward_seconds:.2f}s  padding efficiency {row['padding_efficiency']:.2f}  cosine min {row['min_cosine']:.4f} mean {row['mean_cosine']:.4f}")
+    return report
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--model", default="sentence-transformers/all-MiniLM-L6-v2")
+    parser.add_argument("--texts", type=int, default=2000)
+    parser.add_argument("--words", type=int, default=40, help="Maximum words per text")
+    parser.add_argument("--batch-size", type=int, default=64)
+    parser.add_argument("--onnx-dir", default="onnx_models")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--json", action="store_true", help="Print one JSON object per row")
+    args = parser.parse_args()
+    logger.setLevel("WARNING")
+    run(args)
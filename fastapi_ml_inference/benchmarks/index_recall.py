@@ -0,0 +1,171 @@
+"""
+Micro-benchmark and recall report for the VectorSearch index configurations.
+
+Builds every index type / storage combination VectorSearch supports (and,
+for compressed storage, the same with full-precision re-ranking) on random
+and on clustered synthetic vectors. For each it reports add throughput,
+memory per vector, and search latency and recall@k against exact
+brute-force ground truth, over a sweep of nprobe / efSearch values and
+several k. Needs neither the network nor the embedding model:
+
+    python benchmarks/index_recall.py --vectors 200000 --queries 1000 --k 1,10,100
+    python benchmarks/index_recall.py --storage int8 --index-types hnsw   # one configuration
+    python benchmarks/index_recall.py --vectors 20000 --data random --output recall.json   # quick, for CI
+"""
+import argparse
+import json
+import os
+import sys
+import tempfile
+import time
+import faiss
+import numpy as np
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "app"))
+
+from services.vector_codec import hits_to_arrays  # noqa: E402
+from services.vector_search import INDEX_TYPES, STORAGE_TYPES, VectorSearch  # noqa: E402
+from utils.logger import logger  # noqa: E402
+
+def clustered_vectors(n: int, dimension: int, clusters: int, rng: np.random.Generator) -> np.ndarray:
+    """Gaussian blobs, closer to real embedding distributions than uniform noise."""
+    centers = rng.standard_normal((clusters, dimension)).astype(np.float32)
+    labels = rng.integers(0, clusters, size=n)
+    return centers[labels] + 0.3 * rng.standard_normal((n, dimension)).astype(np.float32)
+
+def random_vectors(n: int, dimension: int, rng: np.random.Generator) -> np.ndarray:
+    """Isotropic noise: no structure for IVF or PQ to exploit, so the hardest case for recall."""
+    return rng.standard_normal((n, dimension)).astype(np.float32)
+
+def exact_neighbours(corpus: np.ndarray, queries: np.ndarray, k: int) -> np.ndarray:
+    # Brute force over the same L2 metric VectorSearch uses; ids are corpus rows
+    index = faiss.IndexFlatL2(corpus.shape[1])
+    index.add(corpus)
+    return index.search(queries, k)[1]
+
+def configurations(index_types: list, storages: list) -> list:
+    """(index_type, storage, rerank) combinations VectorSearch accepts."""
+    configs = []
+    for index_type in index_types:
+        for storage in storages:
+            # ivf_pq always stores PQ codes
+            if index_type == "ivf_pq" and storage != "pq":
+                continue
+            # ivf_flat with PQ storage builds the same index as ivf_pq
+            if index_type == "ivf_flat" and storage == "pq":
+                continue
+            configs.append((index_type, storage, False))
+            if storage != "float32":
+                configs.append((index_type, storage, True))
+    return configs
+
+def search_ids(vector_search: VectorSearch, queries: np.ndarray, k: int, **params) -> np.ndarray:
+    # Doc ids equal corpus rows on a freshly built index
+    return hits_to_arrays(vector_search.search_batch(queries, k, **params), k)[0]
+
+def recall_at_k(found: np.ndarray, truth: np.ndarray) -> float:
+    k = truth.shape[1]
+    return float(np.mean([len(set(f) & set(t)) / k for f, t in zip(found, truth)]))
+
+def build(corpus: np.ndarray, index_type: str, storage: str, rerank_path, args) -> tuple:
+    """The index with `corpus` added in batches of --add-batch, and the seconds that took (training included)."""
+    vector_search = VectorSearch(corpus.shape[1], index_type=index_type, nlist=args.nlist, hnsw_m=args.hnsw_m,
+                                 pq_m=args.pq_m, train_size=min(len(corpus), 39 * args.nlist), storage=storage,
+                                 rerank_path=rerank_path)
+    texts = [""] * args.add_batch
+    start = time.perf_counter()
+    for offset in range(0, len(corpus), args.add_batch):
+        batch = corpus[offset:offset + args.add_batch]
+        vector_search.add_batch(batch, texts[:len(batch)])
+    return vector_search, time.perf_counter() - start
+
+def run(args) -> list:
+    report = []
+    with tempfile.TemporaryDirectory() as scratch:
+        for data in args.data:
+            rng = np.random.default_rng(args.seed)
+            if data == "clustered":
+                corpus = clustered_vectors(args.vectors, args.dimension, args.clusters, rng)
+                queries = clustered_vectors(args.queries, args.dimension, args.clusters, rng)
+            else:
+                corpus = random_vectors(args.vectors, args.dimension, rng)
+                queries = random_vectors(args.queries, args.dimension, rng)
+            truth = exact_neighbours(corpus, queries, max(args.k))
+            for index_type, storage, rerank in configurations(args.index_types, args.storage):
+                rerank_path = os.path.join(scratch, f"{data}_{index_type}_{storage}.f32") if rerank else None
+                vector_search, build_seconds = build(corpus, index_type, storage, rerank_path, args)
+                sweep = {"ivf_flat": "nprobe", "ivf_pq": "nprobe", "hnsw": "ef_search"}.get(index_type)
+                settings = [{sweep: value} for value in (args.nprobe if sweep == "nprobe" else args.ef_search)] if sweep else [{}]
+                common = {
+                    "data": data,
+                    "index_type": index_type,
+                    "storage": vector_search.storage,
+                    "rerank": rerank,
+                    # False if the corpus was too small to train on; searches then scan the exact staging index
+                    "trained": vector_search.is_trained,
+                    "vectors_per_second": len(corpus) / build_seconds,
+                    "bytes_per_vector": vector_search.bytes_per_vector(),
+                    # Measured, where bytes_per_vector is an estimate; the re-rank file is on disk and not included
+                    "serialized_bytes_per_vector": faiss.serialize_index(vector_search.index).nbytes / len(corpus),
+                }
+                for params in settings:
+                    for k in args.k:
+                        search_ids(vector_search, queries[:10], k, rerank=rerank, **params)  # warm up
+                        start = time.perf_counter()
+                        ids = search_ids(vector_search, queries, k, rerank=rerank, **params)
+                        elapsed = time.perf_counter() - start
+                        # One query per call, as a single /search request sees it
+                        latencies = []
+                        for query in queries[:args.latency_queries]:
+                            start = time.perf_counter()
+                            vector_search.search_batch(query[None], k, rerank=rerank, **params)
+                            latencies.append(1000 * (time.perf_counter() - start))
+                        row = {
+                            **common,
+                            **params,
+                            "k": k,
+                            "recall_at_k": recall_at_k(ids, truth[:, :k]),
+                            "ms_per_query": 1000 * elapsed / len(queries),
+                            "p50_ms": float(np.percentile(latencies, 50)),
+                            "p99_ms": float(np.percentile(latencies, 99)),
+                        }
+                        report.append(row)
+                        print(json.dumps(row) if args.json else
+                              f"{data:9s} {index_type:8s} {row['storage']:7s} {'rerank' if rerank else '':6s} "
+                              f"{str(params):20s} recall@{k}={row['recall_at_k']:.3f} {row['ms_per_query']:.3f} ms/query "
+                              f"(single p50 {row['p50_ms']:.3f} p99 {row['p99_ms']:.3f} ms)  "
+                              f"{row['bytes_per_vector']:.0f} B/vector  add {row['vectors_per_second']:.0f} vectors/s")
+                if vector_search.can_rerank:
+                    vector_search._full_vectors.close()
+    return report
+
+def _list(cast):
+    return lambda value: [cast(part) for part in value.split(",")]
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--vectors", type=int, default=100000)
+    parser.add_argument("--queries", type=int, default=1000)
+    parser.add_argument("--dimension", type=int, default=384)
+    parser.add_argument("--clusters", type=int, default=256)
+    parser.add_argument("--data", type=_list(str), default=["random", "clustered"], help="random and/or clustered")
+    parser.add_argument("--k", type=_list(int), default=[1, 10, 100], help="Comma-separated k values")
+    parser.add_argument("--index-types", type=_list(str), default=list(INDEX_TYPES))
+    parser.add_argument("--storage", type=_list(str), default=list(STORAGE_TYPES),
+                        help="Comma-separated vector storages to build each index type with")
+    parser.add_argument("--nlist", type=int, default=1024)
+    parser.add_argument("--nprobe", type=_list(int), default=[1, 4, 16, 64], help="IVF sweep")
+    parser.add_argument("--hnsw-m", type=int, default=32)
+    parser.add_argument("--ef-search", type=_list(int), default=[16, 64, 256], help="HNSW sweep")
+    parser.add_argument("--pq-m", type=int, default=16)
+    parser.add_argument("--add-batch", type=int, default=10000, help="Vectors per add_batch call")
+    parser.add_argument("--latency-queries", type=int, default=200, help="Queries timed one at a time")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--output", help="Write the report as JSON to this file")
+    parser.add_argument("--json", action="store_true", help="Print one JSON object per row")
+    args = parser.parse_args()
+    logger.setLevel("WARNING")
+    report = run(args)
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(report, f, indent=2)
@@ -0,0 +1,262 @@
+"""
+Load test of /add and /search, in-process and over a local uvicorn.
+
+Preloads the index with synthetic vectors through /vectors/add (no encoding),
+growing it through each --corpus size in turn, then drives /add (unique
+texts) and /search (random queries) at each --concurrency level. Each run is
+reported with throughput, latency percentiles, RSS and CPU use of the server
+process; write it with --output and compare two commits with --baseline:
+
+    python benchmarks/load_test.py --corpus 10000,100000,1000000 --concurrency 1,8,32 --output before.json
+    python benchmarks/load_test.py --corpus 10000,100000,1000000 --concurrency 1,8,32 --baseline before.json
+    FAISS_INDEX_TYPE=hnsw python benchmarks/load_test.py --transport uvicorn --corpus 10000000
+
+The app is configured from the environment as usual. --transport asgi runs
+it in this process through httpx's ASGI transport (no sockets, but the load
+generator shares the CPU and the event loop); uvicorn starts it as a
+separate server process, which is what the RSS and CPU figures then cover.
+The embedding model is loaded as usual; --dimension must match it.
+"""
+import argparse
+import asyncio
+import itertools
+import json
+import os
+import socket
+import subprocess
+import sys
+import time
+import httpx
+import numpy as np
+
+APP_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "app")
+sys.path.insert(0, APP_DIR)
+
+VOCABULARY = ("vector search index query document embedding model batch latency throughput cpu memory cache "
+              "server request response token sentence quantized weights runtime export graph node layer").split()
+
+def synthetic_vectors(n: int, dimension: int, rng: np.random.Generator) -> np.ndarray:
+    # Unit length, like the sentence-transformers embeddings they stand in for
+    vectors = rng.standard_normal((n, dimension)).astype(np.float32)
+    return vectors / np.linalg.norm(vectors, axis=1, keepdims=True)
+
+def synthetic_text(rng: np.random.Generator, words: int) -> str:
+    return " ".join(rng.choice(VOCABULARY, size=rng.integers(3, words + 1)))
+
+class ProcessStats:
+    """RSS and CPU time of a process, from /proc on Linux, else from psutil if installed."""
+
+    def __init__(self, pid: int):
+        self.pid = pid
+        self._process = None
+        if not os.path.exists(f"/proc/{pid}/stat"):
+            try:
+                import psutil
+                self._process = psutil.Process(pid)
+            except ImportError:
+                pass
+
+    def cpu_seconds(self) -> float:
+        if self._process is not None:
+            times = self._process.cpu_times()
+            return times.user + times.system
+        try:
+            with open(f"/proc/{self.pid}/stat") as f:
+                # Fields after the parenthesised command name; utime and stime are the 12th and 13th
+                fields = f.read().rsplit(")", 1)[1].split()
+        except OSError:
+            return float("nan")
+        return (int(fields[11]) + int(fields[12])) / os.sysconf("SC_CLK_TCK")
+
+    def memory(self) -> dict:
+        if self._process is not None:
+            return {"rss_bytes": self._process.memory_info().rss, "peak_rss_bytes": None}
+        values = {}
+        try:
+            with open(f"/proc/{self.pid}/status") as f:
+                for line in f:
+                    name, _, value = line.partition(":")
+                    if name in ("VmRSS", "VmHWM"):
+                        values[name] = int(value.split()[0]) * 1024
+        except OSError:
+            pass
+        return {"rss_bytes": values.get("VmRSS"), "peak_rss_bytes": values.get("VmHWM")}
+
+async def drive(client: httpx.AsyncClient, make_request, total: int, concurrency: int, stats: ProcessStats) -> dict:
+    """Sends `total` requests from `concurrency` concurrent workers and summarises them."""
+    latencies = []
+    errors = 0
+    numbers = itertools.count()
+
+    async def worker():
+        nonlocal errors
+        while (number := next(numbers)) < total:
+            url, body = make_request(number)
+            start = time.perf_counter()
+            try:
+                response = await client.post(url, json=body)
+                failed = response.status_code >= 400
+            except httpx.HTTPError:
+                failed = True
+            if failed:
+                errors += 1
+            else:
+                latencies.append(time.perf_counter() - start)
+
+    cpu_before = stats.cpu_seconds()
+    start = time.perf_counter()
+    await asyncio.gather(*[worker() for _ in range(concurrency)])
+    seconds = time.perf_counter() - start
+    cpu_seconds = stats.cpu_seconds() - cpu_before
+    latencies_ms = 1000 * np.array(latencies) if latencies else np.zeros(1)
+    return {
+        "requests": total,
+        "errors": errors,
+        "seconds": seconds,
+        "qps": len(latencies) / seconds,
+        "latency_ms": {"mean": float(latencies_ms.mean()),
+                       **{f"p{q}": float(np.percentile(latencies_ms, q)) for q in (50, 90, 99)},
+                       "max": float(latencies_ms.max())},
+        # 1.0 is one core busy for the whole run
+        "cpu_utilisation": cpu_seconds / seconds,
+        **stats.memory(),
+    }
+
+async def preload(client: httpx.AsyncClient, count: int, dimension: int, chunk: int, rng: np.random.Generator) -> float:
+    start = time.perf_counter()
+    for offset in range(0, count, chunk):
+        vectors = synthetic_vectors(min(chunk, count - offset), dimension, rng)
+        response = await client.post("/vectors/add", content=vectors.tobytes(),
+                                     headers={"content-type": "application/octet-stream"})
+        if response.status_code != 200:
+            raise RuntimeError(f"/vectors/add failed with {response.status_code}: {response.text}"
+                               f" (does --dimension {dimension} match the model?)")
+    return time.perf_counter() - start
+
+async def run_transport(transport: str, client: httpx.AsyncClient, stats: ProcessStats, args) -> list:
+    rng = np.random.default_rng(args.seed)
+    report = []
+    indexed = 0
+    added = itertools.count()
+
+    def add_request(_):
+        # Unique texts, so neither the embedding cache nor ingest dedup skips the encode
+        return "/add", {"text": f"{synthetic_text(rng, args.words)} {next(added)}"}
+
+    def search_request(_):
+        return "/search", {"query": synthetic_text(rng, args.words), "k": args.k}
+
+    requests = {"add": add_request, "search": search_request}
+    for corpus in args.corpus:
+        preload_seconds = await preload(client, max(corpus - indexed, 0), args.dimension, args.preload_chunk, rng)
+        indexed = max(corpus, indexed)
+        for endpoint in args.endpoints:
+            for concurrency in args.concurrency:
+                await drive(client, requests[endpoint], args.warmup, concurrency, stats)
+                result = await drive(client, requests[endpoint], args.requests, concurrency, stats)
+                indexed += args.warmup + args.requests if endpoint == "add" else 0
+                row = {"transport": transport, "corpus": corpus, "endpoint": endpoint, "concurrency": concurrency,
+                       "preload_seconds": preload_seconds, **result}
+                report.append(row)
+                print(json.dumps(row) if args.json else
+                      f"{transport:7s} corpus={corpus:<9d} {endpoint:6s} c={concurrency:<4d} {row['qps']:8.1f} req/s  "
+                      f"p50 {row['latency_ms']['p50']:7.2f} ms  p99 {row['latency_ms']['p99']:7.2f} ms  "
+                      f"errors {row['errors']}  cpu {row['cpu_utilisation']:.2f}  rss {(row['rss_bytes'] or 0) / 2**20:.0f} MiB")
+    return report
+
+async def run_asgi(args) -> list:
+    import main
+    from utils.logger import logger
+    logger.setLevel("WARNING")
+    # httpx's ASGI transport doesn't send lifespan events, so the app is started here
+    async with main.app.router.lifespan_context(main.app):
+        transport = httpx.ASGITransport(app=main.app)
+        async with httpx.AsyncClient(transport=transport, base_url="http://asgi", timeout=None) as client:
+            return await run_transport("asgi", client, ProcessStats(os.getpid()), args)
+
+def _free_port() -> int:
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+async def run_uvicorn(args) -> list:
+    port = _free_port()
+    server = subprocess.Popen([sys.executable, "-m", "uvicorn", "main:app", "--host", "127.0.0.1", "--port", str(port),
+                               "--log-level", "warning"], cwd=APP_DIR)
+    try:
+        limits = httpx.Limits(max_connections=max(args.concurrency), max_keepalive_connections=max(args.concurrency))
+        async with httpx.AsyncClient(base_url=f"http://127.0.0.1:{port}", timeout=None, limits=limits) as client:
+            deadline = time.monotonic() + args.startup_timeout
+            while True:
+                if server.poll() is not None:
+                    raise RuntimeError(f"uvicorn exited with {server.returncode} during startup")
+                try:
+                    if (await client.get("/health")).status_code == 200:
+                        break
+                except httpx.TransportError:
+                    pass
+                if time.monotonic() > deadline:
+                    raise RuntimeError(f"uvicorn did not start within {args.startup_timeout}s")
+                await asyncio.sleep(0.2)
+            return await run_transport("uvicorn", client, ProcessStats(server.pid), args)
+    finally:
+        server.terminate()
+        server.wait()
+
+def _commit() -> str:
+    try:
+        return subprocess.run(["git", "rev-parse", "--short", "HEAD"], cwd=APP_DIR, capture_output=True, text=True,
+                              check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return "unknown"
+
+def compare(report: dict, baseline: dict):
+    """Prints the throughput and p99 change of every run that is also in the baseline."""
+    key = lambda row: (row["transport"], row["corpus"], row["endpoint"], row["concurrency"])
+    before = {key(row): row for row in baseline["runs"]}
+    print(f"\nchange against {baseline['commit']}:")
+    for row in report["runs"]:
+        old = before.get(key(row))
+        if old is None:
+            continue
+        qps = row["qps"] / old["qps"] - 1 if old["qps"] else float("nan")
+        p99 = row["latency_ms"]["p99"] / old["latency_ms"]["p99"] - 1 if old["latency_ms"]["p99"] else float("nan")
+        print(f"{row['transport']:7s} corpus={row['corpus']:<9d} {row['endpoint']:6s} c={row['concurrency']:<4d} "
+              f"qps {qps:+7.1%}  p99 {p99:+7.1%}")
+
+def _int_list(value: str) -> list:
+    return [int(part) for part in value.split(",")]
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--transport", choices=["asgi", "uvicorn", "both"], default="both")
+    parser.add_argument("--corpus", type=_int_list, default=[10000, 100000],
+                        help="Comma-separated index sizes to measure at, ascending (e.g. 10000,1000000,10000000)")
+    parser.add_argument("--concurrency", type=_int_list, default=[1, 8, 32], help="Comma-separated concurrent clients")
+    parser.add_argument("--endpoints", type=lambda value: value.split(","), default=["add", "search"])
+    parser.add_argument("--requests", type=int, default=500, help="Requests per endpoint, corpus size and concurrency")
+    parser.add_argument("--warmup", type=int, default=20, help="Unmeasured requests before each run")
+    parser.add_argument("--dimension", type=int, default=384, help="Embedding dimension of the configured model")
+    parser.add_argument("--k", type=int, default=10)
+    parser.add_argument("--words", type=int, default=20, help="Maximum words per synthetic text")
+    parser.add_argument("--preload-chunk", type=int, default=50000, help="Vectors per /vectors/add request")
+    parser.add_argument("--startup-timeout", type=float, default=600)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--output", help="Write the report as JSON to this file")
+    parser.add_argument("--baseline", help="Report of an earlier run to compare against")
+    parser.add_argument("--json", action="store_true", help="Print one JSON object per row")
+    args = parser.parse_args()
+    args.corpus = sorted(args.corpus)
+    runs = []
+    if args.transport in ("asgi", "both"):
+        runs += asyncio.run(run_asgi(args))
+    if args.transport in ("uvicorn", "both"):
+        runs += asyncio.run(run_uvicorn(args))
+    report = {"commit": _commit(), "cpu_count": os.cpu_count(), "arguments": {name: value for name, value in vars(args).items()
+              if name not in ("output", "baseline", "json")}, "runs": runs}
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(report, f, indent=2)
+    if args.baseline:
+        with open(args.baseline) as f:
+            compare(report, json.load(f))
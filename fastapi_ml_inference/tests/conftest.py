@@ -0,0 +1,26 @@
+import os
+import sys
+import pytest
+
+# The app imports its modules flat (services.x, utils.y), as when run from app/
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "app"))
+
+@pytest.fixture(scope="session")
+def tiny_model_dir(tmp_path_factory):
+    """A randomly initialised one-layer BERT saved locally, so encoder tests need no download."""
+    from transformers import BertConfig, BertModel, BertTokenizerFast
+    directory = str(tmp_path_factory.mktemp("tiny-bert"))
+    words = "hello world the a vector search fast api model embedding".split()
+    with open(os.path.join(directory, "vocab.txt"), "w", encoding="utf-8") as f:
+        f.write("\n".join(["[PAD]", "[UNK]", "[CLS]", "[SEP]", "[MASK]"] + words))
+    BertTokenizerFast(os.path.join(directory, "vocab.txt")).save_pretrained(directory)
+    config = BertConfig(vocab_size=5 + len(words), hidden_size=16, num_hidden_layers=1, num_attention_heads=2,
+                        intermediate_size=32)
+    BertModel(config).save_pretrained(directory)
+    return directory
+
+@pytest.fixture
+def tiny_model(tiny_model_dir):
+    from sentence_transformers import SentenceTransformer, models
+    transformer = models.Transformer(tiny_model_dir)
+    return SentenceTransformer(modules=[transformer, models.Pooling(transformer.auto_model.config.hidden_size)])
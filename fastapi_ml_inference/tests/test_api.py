@@ -0,0 +1,26 @@
+import pytest
+from fastapi.testclient import TestClient
+import main
+
+@pytest.fixture
+def client():
+    # Requests rejected by validation never reach the model, so the app is not started
+    return TestClient(main.app)
+
+@pytest.mark.parametrize("doc_id", ["-1", str(2**63)])
+def test_out_of_range_document_ids_are_rejected(client, doc_id):
+    assert client.put(f"/documents/{doc_id}", json={"text": "hello"}).status_code == 422
+    assert client.delete(f"/documents/{doc_id}").status_code == 422
+    assert client.post("/add_batch", json={"texts": ["hello"], "ids": [int(doc_id)]}).status_code == 422
+
+def test_bad_add_item_is_rejected_before_batching():
+    with pytest.raises(ValueError):
+        main._check_add_item((main.settings.embedding_model, "hello", 2**63, None))
+    main._check_add_item((main.settings.embedding_model, "hello", 5, None))
+
+def test_shards_and_segments_are_rejected_at_startup(monkeypatch):
+    monkeypatch.setattr(main.settings, "faiss_shards", 2)
+    monkeypatch.setattr(main.settings, "faiss_segment_size", 100)
+    with pytest.raises(ValueError, match="FAISS_SHARDS=1"):
+        with TestClient(main.app):
+            pass
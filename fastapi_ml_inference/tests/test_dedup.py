@@ -0,0 +1,21 @@
+from services.dedup import DedupIndex
+
+def test_exact_duplicate_survives_deleting_one_copy():
+    dedup = DedupIndex(exact=True)
+    # An upsert to an explicit id is indexed even though its text is already there
+    fingerprints, duplicates = dedup.check(["same text", "same text"], [None, None], skip=[False, True])
+    assert duplicates == [None, None]
+    dedup.add([0, 1], fingerprints)
+    dedup.remove([0])
+    _, duplicates = dedup.check(["same text"], [None])
+    assert duplicates[0].kind == "exact" and duplicates[0].doc_id == 1
+    dedup.remove([1])
+    assert dedup.check(["same text"], [None])[1] == [None]
+
+def test_near_duplicate_within_threshold():
+    dedup = DedupIndex(exact=True, near_threshold=0.5)
+    dedup.add_texts([0], ["the quick brown fox jumps over the lazy dog near the river bank"])
+    _, duplicates = dedup.check(["the quick brown fox jumps over the lazy dog near the river bank today"], [None])
+    assert duplicates[0].kind == "near" and duplicates[0].doc_id == 0
+    _, duplicates = dedup.check(["the quick brown fox jumps over the lazy dog"], [{"tenant": "b"}])
+    assert duplicates == [None]
@@ -0,0 +1,65 @@
+import numpy as np
+import pytest
+import services.embedding_cache as embedding_cache_module
+from services.embedding_cache import EmbeddingCache, embedding_key
+from services.embedding_service import EmbeddingService
+
+DIMENSION = 4
+# Two entries fit, a third evicts the least recently used one
+ENTRY_BYTES = DIMENSION * 4 + embedding_cache_module._ENTRY_OVERHEAD_BYTES
+
+def vector(value):
+    return np.full(DIMENSION, value, dtype=np.float32)
+
+def test_lru_eviction_keeps_recently_used_entries():
+    cache = EmbeddingCache(2 * ENTRY_BYTES)
+    cache.put(b"a", vector(1))
+    cache.put(b"b", vector(2))
+    assert cache.get(b"a") is not None
+    cache.put(b"c", vector(3))
+    assert cache.get(b"b") is None
+    assert cache.get(b"a")[0] == 1 and cache.get(b"c")[0] == 3
+    stats = cache.stats()
+    assert stats["entries"] == 2 and stats["bytes"] == 2 * ENTRY_BYTES
+    assert (stats["hits"], stats["misses"], stats["evictions"]) == (3, 1, 1)
+
+def test_entries_expire_after_ttl(monkeypatch):
+    now = [100.0]
+    monkeypatch.setattr(embedding_cache_module.time, "monotonic", lambda: now[0])
+    cache = EmbeddingCache(10 * ENTRY_BYTES, ttl_seconds=5)
+    cache.put(b"a", vector(1))
+    now[0] += 4
+    assert cache.get(b"a") is not None
+    now[0] += 2
+    assert cache.get(b"a") is None
+    assert cache.stats()["expirations"] == 1 and cache.current_bytes == 0
+
+def test_cached_arrays_are_read_only_copies():
+    cache = EmbeddingCache(10 * ENTRY_BYTES)
+    original = vector(1)
+    cache.put(b"a", original)
+    original[0] = 7
+    cached = cache.get(b"a")
+    assert cached[0] == 1
+    with pytest.raises(ValueError):
+        cached[0] = 2
+    # Entries larger than the whole budget are not cached at all
+    cache.put(b"big", np.zeros(1000, dtype=np.float32))
+    assert cache.get(b"big") is None
+
+def test_service_encodes_each_distinct_missing_text_once():
+    encoded = []
+
+    def encoder(texts, batch_size):
+        encoded.append(list(texts))
+        return np.stack([vector(len(text)) for text in texts])
+
+    service = EmbeddingService("test-model", encoder=encoder, cache=EmbeddingCache(100 * ENTRY_BYTES))
+    first = service.generate_embeddings(["aa", "b", "aa"])
+    assert encoded == [["aa", "b"]]
+    assert first[:, 0].tolist() == [2, 1, 2]
+    second = service.generate_embeddings(["b", "ccc"])
+    assert encoded[1:] == [["ccc"]]
+    assert second[:, 0].tolist() == [1, 3]
+    # Keys depend on the model, so another model's embeddings are never served
+    assert embedding_key("test-model", "b") != embedding_key("other-model", "b")
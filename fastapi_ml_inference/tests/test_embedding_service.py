@@ -0,0 +1,22 @@
+import numpy as np
+import pytest
+import services.embedding_service as embedding_service
+from services.embedding_service import TimedEncoder
+
+TEXTS = ["hello", "hello world the a vector search fast", "fast", "model embedding api", "a"]
+
+def test_timed_encoder_keeps_input_order_without_a_tokenization_pass(tiny_model, monkeypatch):
+    expected = tiny_model.encode(TEXTS, convert_to_numpy=True)
+    monkeypatch.setattr(embedding_service, "token_lengths", lambda *args: pytest.fail("extra tokenization pass"))
+    embeddings, tokenize_seconds, forward_seconds, efficiencies = TimedEncoder(tiny_model).encode(TEXTS, 2)
+    np.testing.assert_allclose(embeddings, expected, atol=1e-6)
+    assert tokenize_seconds > 0 and forward_seconds > 0
+    # One efficiency per model batch, from that batch's attention mask
+    assert len(efficiencies) == 3
+    assert all(0 < efficiency <= 1 for efficiency in efficiencies)
+    # The lone shortest text is a batch of its own, so nothing is padding
+    assert efficiencies[-1] == 1.0
+
+def test_timed_encoder_empty_input(tiny_model):
+    embeddings, _, _, efficiencies = TimedEncoder(tiny_model).encode([], 2)
+    assert embeddings.shape == (0, 0) and efficiencies == []
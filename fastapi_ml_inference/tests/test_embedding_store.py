@@ -0,0 +1,121 @@
+import numpy as np
+import pytest
+import main
+from services.bm25_index import BM25Index
+from services.embedding_store import EmbeddingStore
+from services.vector_search import VectorSearch
+
+DIMENSION = 8
+
+def embed(texts):
+    return np.stack([np.random.default_rng(sum(text.encode())).standard_normal(DIMENSION).astype(np.float32)
+                     for text in texts])
+
+def open_namespace(directory):
+    store = EmbeddingStore(str(directory), DIMENSION, "test-model")
+    return main.Namespace("test-model", None, VectorSearch(DIMENSION), BM25Index(), None, store)
+
+def live_docs(namespace):
+    hits = namespace.vector_search.search_batch(embed(["query"]), 10)[0]
+    return {hit["id"]: hit["text"] for hit in hits}
+
+@pytest.fixture
+def namespace(tmp_path):
+    namespace = open_namespace(tmp_path)
+    yield namespace
+    namespace.store.close()
+
+def test_rebuild_keeps_ids_upserts_and_deletes(namespace, tmp_path):
+    texts = ["alpha one", "beta two", "gamma three"]
+    main._index_texts(namespace, embed(texts), texts)
+    main._delete_documents(namespace, [0])
+    main._index_texts(namespace, embed(["beta REPLACED"]), ["beta REPLACED"], [1])
+    before = live_docs(namespace)
+    assert before == {1: "beta REPLACED", 2: "gamma three"}
+    namespace.store.close()
+
+    rebuilt = open_namespace(tmp_path)
+    main._rebuild_from_store(rebuilt)
+    assert live_docs(rebuilt) == before
+    doc_ids, _ = rebuilt.bm25_index.search("beta", 10)
+    assert doc_ids.tolist() == [1]
+    rebuilt.store.close()
+
+def test_rebuild_keeps_metadata(namespace, tmp_path):
+    texts = ["alpha one", "beta two", "gamma three"]
+    main._index_texts(namespace, embed(texts), texts, None, [{"tenant": "a"}, {"tenant": "b"}, None])
+    main._index_texts(namespace, embed(["beta two"]), ["beta two"], [1], [{"tenant": "a"}])
+    namespace.store.close()
+
+    rebuilt = open_namespace(tmp_path)
+    main._rebuild_from_store(rebuilt)
+    hits = rebuilt.vector_search.search_batch(embed(["query"]), 10, filter={"tenant": "a"})[0]
+    assert sorted(hit["id"] for hit in hits) == [0, 1]
+    assert rebuilt.vector_search.search_batch(embed(["query"]), 10, filter={"tenant": "b"})[0] == []
+    rebuilt.store.close()
+
+def test_rebuild_does_not_reuse_deleted_ids(namespace, tmp_path):
+    main._index_texts(namespace, embed(["a", "b"]), ["a", "b"])
+    main._delete_documents(namespace, [1])
+    namespace.store.close()
+
+    rebuilt = open_namespace(tmp_path)
+    main._rebuild_from_store(rebuilt)
+    assert main._index_texts(rebuilt, embed(["c"]), ["c"]) == [2]
+    rebuilt.store.close()
+
+def test_store_written_before_the_document_log(namespace, tmp_path):
+    # Stores from before the log hold one document per row, numbered in row order
+    main._index_texts(namespace, embed(["a", "b"]), ["a", "b"])
+    namespace.store.close()
+    (tmp_path / "documents.jsonl").unlink()
+
+    rebuilt = open_namespace(tmp_path)
+    main._rebuild_from_store(rebuilt)
+    assert live_docs(rebuilt) == {0: "a", 1: "b"}
+    rebuilt.store.close()
+
+def test_snapshot_replays_later_store_changes(tmp_path):
+    index_dir = str(tmp_path / "index")
+    store = EmbeddingStore(str(tmp_path / "store"), DIMENSION, "test-model")
+    namespace = main.Namespace("test-model", index_dir, VectorSearch(DIMENSION), None, None, store)
+    main._index_texts(namespace, embed(["a", "c"]), ["a", "c"])
+    main._save_snapshot(namespace)
+    main._index_texts(namespace, embed(["b"]), ["b"])
+    main._index_texts(namespace, embed(["a v2"]), ["a v2"], [0])
+    main._delete_documents(namespace, [1])
+    expected = live_docs(namespace)
+    assert expected == {0: "a v2", 2: "b"}
+    # Crash: the snapshot only has "a" and "c"
+    store.close()
+
+    for _ in range(2):
+        store = EmbeddingStore(str(tmp_path / "store"), DIMENSION, "test-model")
+        restarted = main.Namespace("test-model", index_dir, VectorSearch.load(index_dir), None, None, store)
+        main._replay_store(restarted)
+        assert live_docs(restarted) == expected
+        store.close()
+    store = EmbeddingStore(str(tmp_path / "store"), DIMENSION, "test-model")
+    restarted = main.Namespace("test-model", index_dir, VectorSearch.load(index_dir), None, None, store)
+    main._replay_store(restarted)
+    assert main._index_texts(restarted, embed(["d"]), ["d"]) == [3]
+    # Once a snapshot covers everything, nothing is replayed
+    main._save_snapshot(restarted)
+    store.close()
+    store = EmbeddingStore(str(tmp_path / "store"), DIMENSION, "test-model")
+    restarted = main.Namespace("test-model", index_dir, VectorSearch.load(index_dir), None, None, store)
+    assert main._replay_store(restarted) == 0
+    assert live_docs(restarted) == {**expected, 3: "d"}
+    store.close()
+
+def test_deleted_ids_stay_reserved_across_restarts(namespace, tmp_path):
+    main._index_texts(namespace, embed(["a", "b"]), ["a", "b"])
+    main._delete_documents(namespace, [1])
+    namespace.store.close()
+    # The first reopen rewrites the log without the deleted document
+    for _ in range(2):
+        EmbeddingStore(str(tmp_path), DIMENSION, "test-model").close()
+    rebuilt = open_namespace(tmp_path)
+    main._rebuild_from_store(rebuilt)
+    assert main._index_texts(rebuilt, embed(["c"]), ["c"]) == [2]
+    rebuilt.store.close()
@@ -0,0 +1,48 @@
+import logging
+import queue
+import threading
+import pytest
+from utils.logger import DrainingQueueListener, EventSampler, QueueFullDropHandler, parse_sample_rates
+
+def test_sampler_keeps_one_in_n():
+    sampled = EventSampler({"index.search": 3})
+    assert [sampled("index.search") for _ in range(7)] == [True, False, False, True, False, False, True]
+    assert all(sampled("not.sampled") for _ in range(3))
+
+def test_sampler_counts_exactly_across_threads():
+    sampled = EventSampler({"event": 10})
+    kept = []
+
+    def run():
+        kept.append(sum(sampled("event") for _ in range(1000)))
+
+    threads = [threading.Thread(target=run) for _ in range(4)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    assert sum(kept) == 400
+
+def test_parse_sample_rates():
+    assert parse_sample_rates(" index.search=1000, index.add=100,") == {"index.search": 1000, "index.add": 100}
+    assert parse_sample_rates("") == {}
+    with pytest.raises(ValueError):
+        parse_sample_rates("index.search=0")
+
+def test_full_queue_drops_records_but_stop_drains_the_rest():
+    log_queue = queue.Queue(2)
+    handler = QueueFullDropHandler(log_queue)
+    written = []
+
+    class ListHandler(logging.Handler):
+        def emit(self, record):
+            written.append(record.getMessage())
+
+    for number in range(5):
+        handler.handle(logging.LogRecord("test", logging.INFO, __file__, 1, "line %d", (number,), None))
+    assert handler.dropped == 3
+    listener = DrainingQueueListener(log_queue, ListHandler())
+    listener.start()
+    listener.stop()
+    # Formatted by the writer thread, from the unformatted record
+    assert written == ["line 0", "line 1"]
@@ -0,0 +1,54 @@
+import pytest
+from fastapi import FastAPI
+from fastapi.testclient import TestClient
+from utils.metrics import MetricsMiddleware, MetricsRegistry, TimedRoute, record_stage, request_seconds
+
+def test_histogram_renders_cumulative_buckets():
+    registry = MetricsRegistry()
+    histogram = registry.histogram("job_seconds", "Job time", ["kind"], buckets=(0.1, 1.0))
+    for value in (0.05, 0.5, 0.7, 3.0):
+        histogram.observe(value, 'say "hi"')
+    lines = registry.render().splitlines()
+    assert lines[:2] == ["# HELP job_seconds Job time", "# TYPE job_seconds histogram"]
+    assert lines[2:] == [
+        'job_seconds_bucket{kind="say \\"hi\\"",le="0.1"} 1',
+        'job_seconds_bucket{kind="say \\"hi\\"",le="1.0"} 3',
+        'job_seconds_bucket{kind="say \\"hi\\"",le="+Inf"} 4',
+        'job_seconds_sum{kind="say \\"hi\\""} 4.25',
+        'job_seconds_count{kind="say \\"hi\\""} 4',
+    ]
+
+def test_counters_gauges_and_duplicate_names():
+    registry = MetricsRegistry()
+    counter = registry.counter("jobs_total", "Jobs", ["status"])
+    counter.inc("ok")
+    counter.inc("ok", amount=2)
+    registry.gauge("cache_hits_total", "Hits kept elsewhere", lambda: 5, kind="counter")
+    registry.gauge("unknown", "Not available yet", lambda: None)
+    rendered = registry.render()
+    assert 'jobs_total{status="ok"} 3.0' in rendered
+    assert "# TYPE cache_hits_total counter\ncache_hits_total 5\n" in rendered
+    assert "# TYPE unknown gauge\n" in rendered and "unknown None" not in rendered
+    with pytest.raises(ValueError):
+        registry.counter("jobs_total", "Again")
+
+def test_middleware_reports_stages_per_route_template():
+    app = FastAPI()
+    app.router.route_class = TimedRoute
+    app.add_middleware(MetricsMiddleware)
+
+    @app.get("/items/{item_id}")
+    async def item(item_id: int):
+        record_stage("lookup", 0.002)
+        return {"id": item_id}
+
+    client = TestClient(app)
+    response = client.get("/items/7")
+    assert response.status_code == 200
+    stages = dict(part.split(";dur=") for part in response.headers["server-timing"].split(", "))
+    assert float(stages["lookup"]) == pytest.approx(2.0)
+    assert list(stages)[-1] == "total"
+    assert client.get("/missing").status_code == 404
+    rendered = "\n".join(request_seconds.render())
+    assert 'path="/items/{item_id}",status="200",le="+Inf"} 1' in rendered
+    assert 'path="unmatched",status="404"' in rendered
@@ -0,0 +1,68 @@
+import asyncio
+import pytest
+from services.micro_batcher import MicroBatcher
+
+def run_batched(batcher, items):
+    """Submits `items` concurrently and returns each caller's result or exception."""
+    async def main():
+        batcher.start()
+        try:
+            return await asyncio.gather(*[batcher.submit(item) for item in items], return_exceptions=True)
+        finally:
+            await batcher.stop()
+    return asyncio.run(main())
+
+def test_concurrent_items_share_one_call():
+    calls = []
+
+    def handler(items):
+        calls.append(list(items))
+        return [item * 2 for item in items]
+
+    assert run_batched(MicroBatcher(handler, window_ms=50, max_batch_size=10), [1, 2, 3]) == [2, 4, 6]
+    assert calls == [[1, 2, 3]]
+
+def test_max_batch_size_splits_batches():
+    calls = []
+
+    def handler(items):
+        calls.append(len(items))
+        return items
+
+    assert run_batched(MicroBatcher(handler, window_ms=50, max_batch_size=2), [1, 2, 3, 4, 5]) == [1, 2, 3, 4, 5]
+    assert calls == [2, 2, 1]
+
+def fails_on_negative(items):
+    if any(item < 0 for item in items):
+        raise ValueError("negative item")
+    return [item + 1 for item in items]
+
+def test_handler_error_fails_the_whole_batch_by_default():
+    results = run_batched(MicroBatcher(fails_on_negative, window_ms=50, max_batch_size=10), [1, -1, 2])
+    assert all(isinstance(result, ValueError) for result in results)
+
+def test_retry_singly_fails_only_the_bad_item():
+    results = run_batched(MicroBatcher(fails_on_negative, window_ms=50, max_batch_size=10, retry_singly=True),
+                          [1, -1, 2])
+    assert results[0] == 2 and results[2] == 3
+    assert isinstance(results[1], ValueError)
+
+def test_validate_rejects_the_item_before_batching():
+    calls = []
+
+    def handler(items):
+        calls.append(list(items))
+        return fails_on_negative(items)
+
+    def validate(item):
+        if item < 0:
+            raise ValueError("negative item")
+
+    results = run_batched(MicroBatcher(handler, window_ms=50, max_batch_size=10, validate=validate), [1, -1, 2])
+    assert results[0] == 2 and results[2] == 3
+    assert isinstance(results[1], ValueError)
+    assert calls == [[1, 2]]
+
+def test_submit_before_start():
+    with pytest.raises(RuntimeError):
+        asyncio.run(MicroBatcher(lambda items: items, window_ms=1, max_batch_size=1).submit(1))
@@ -0,0 +1,66 @@
+import threading
+import time
+from services.model_pool import ModelPool
+
+class FakeService:
+    def __init__(self, model_name, size):
+        self.model_name = model_name
+        self.size = size
+
+    def memory_bytes(self):
+        return self.size
+
+def pool(max_bytes, sizes=None, delay=0.0):
+    loaded = []
+
+    def load(model_name):
+        time.sleep(delay)
+        loaded.append(model_name)
+        return FakeService(model_name, (sizes or {}).get(model_name, 100))
+
+    return ModelPool(load, max_bytes), loaded
+
+def test_least_recently_used_models_are_unloaded_over_budget():
+    models, loaded = pool(250)
+    for model_name in ("a", "b", "a", "c"):
+        with models.use(model_name) as service:
+            assert service.model_name == model_name
+    # "b" was used least recently when "c" pushed the pool over 250 bytes
+    assert models.loaded() == ["a", "c"]
+    assert models.current_bytes == 200 and models.evictions == 1
+    with models.use("b"):
+        pass
+    assert loaded == ["a", "b", "c", "b"] and models.loads == 4
+
+def test_models_in_use_are_not_unloaded():
+    models, _ = pool(150)
+    with models.use("a"):
+        with models.use("b"):
+            # Both in use, so the pool may exceed its budget for now
+            assert models.loaded() == ["a", "b"]
+        # "b" was the least recently used model not in use
+        assert models.loaded() == ["a"]
+    assert models.loaded() == ["a"]
+
+def test_concurrent_first_uses_load_once():
+    models, loaded = pool(0, delay=0.05)
+    services = []
+
+    def use():
+        with models.use("a") as service:
+            services.append(service)
+
+    threads = [threading.Thread(target=use) for _ in range(4)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    assert loaded == ["a"]
+    assert all(service is services[0] for service in services)
+
+def test_no_budget_keeps_every_model():
+    models, _ = pool(0, sizes={"a": 10 ** 12, "b": 10 ** 12})
+    for model_name in ("a", "b"):
+        with models.use(model_name):
+            pass
+    assert models.loaded() == ["a", "b"] and models.evictions == 0
@@ -0,0 +1,35 @@
+import os
+import numpy as np
+import pytest
+
+pytest.importorskip("onnxruntime")
+import services.onnx_encoder as onnx_encoder_module  # noqa: E402
+from services.onnx_encoder import OnnxEncoder, cosine_similarities  # noqa: E402
+
+TEXTS = ["hello world", "a", "vector search fast api model embedding the world"]
+
+def test_matches_the_pytorch_model_and_reuses_the_export(tiny_model, tmp_path):
+    encoder = OnnxEncoder(tiny_model, "org/tiny", str(tmp_path))
+    assert encoder.path == os.path.join(str(tmp_path), "org__tiny", "model.onnx")
+    embeddings, tokenize_seconds, forward_seconds, efficiencies = encoder.encode(TEXTS, 2)
+    expected = tiny_model.encode(TEXTS, convert_to_numpy=True)
+    assert cosine_similarities(embeddings, expected).min() > 0.999
+    assert tokenize_seconds > 0 and forward_seconds > 0
+    assert len(efficiencies) == 2 and efficiencies[-1] == 1.0
+    exported_at = os.path.getmtime(encoder.path)
+    assert OnnxEncoder(tiny_model, "org/tiny", str(tmp_path)).path == encoder.path
+    assert os.path.getmtime(encoder.path) == exported_at
+
+def test_empty_input(tiny_model, tmp_path):
+    embeddings, _, _, efficiencies = OnnxEncoder(tiny_model, "tiny", str(tmp_path)).encode([], 4)
+    assert embeddings.shape == (0, 0) and efficiencies == []
+
+def test_models_that_drift_from_pytorch_are_refused(tiny_model, tmp_path, monkeypatch):
+    monkeypatch.setattr(onnx_encoder_module, "MIN_COSINE", 1.01)
+    with pytest.raises(ValueError, match="differ from PyTorch"):
+        OnnxEncoder(tiny_model, "tiny", str(tmp_path))
+
+def test_cosine_similarities():
+    a = np.array([[1, 0], [0, 2]], dtype=np.float32)
+    b = np.array([[2, 0], [1, 0]], dtype=np.float32)
+    assert cosine_similarities(a, b).tolist() == [1.0, 0.0]
@@ -0,0 +1,91 @@
+import threading
+import numpy as np
+from services.segmented_vector_search import SegmentedVectorSearch
+from services.vector_search import VectorSearch
+
+DIMENSION = 8
+
+def vectors(n, seed=0):
+    return np.random.default_rng(seed).standard_normal((n, DIMENSION)).astype(np.float32)
+
+def test_merge_with_concurrent_upserts_and_deletes(monkeypatch):
+    # Pause the merge after its first chunk, so the writes land between
+    # documents it has already copied and documents it has yet to copy
+    iter_live = VectorSearch.iter_live
+    copying, written = threading.Event(), threading.Event()
+
+    def paused_iter_live(self, batch_size=16):
+        for chunk in iter_live(self, batch_size):
+            yield chunk
+            copying.set()
+            written.wait(10)
+
+    monkeypatch.setattr(VectorSearch, "iter_live", paused_iter_live)
+    index = SegmentedVectorSearch(DIMENSION, segment_size=200, max_segments=2)
+    for start in range(0, 2000, 200):
+        index.add_batch(vectors(200, seed=start), [f"doc {i}" for i in range(start, start + 200)])
+    expected = {i: f"doc {i}" for i in range(2000)}
+    merge = threading.Thread(target=index.merge)
+    merge.start()
+    assert copying.wait(10)
+    for i in range(0, 2000, 3):
+        if i % 2:
+            index.delete([i])
+            expected.pop(i)
+        else:
+            index.add_batch(vectors(1, seed=i), [f"doc {i} v2"], [i])
+            expected[i] = f"doc {i} v2"
+    written.set()
+    merge.join()
+    assert len(index._sealed) < 10
+    hits = index.search_batch(vectors(1, seed=99), 2 * len(expected))[0]
+    ids = [hit["id"] for hit in hits]
+    assert len(ids) == len(set(ids))
+    assert {hit["id"]: hit["text"] for hit in hits} == expected
+    assert index.ntotal == len(expected)
+
+def test_merged_rerank_files_outlive_searches_reading_them(tmp_path):
+    index = SegmentedVectorSearch(DIMENSION, segment_size=100, max_segments=1, storage="int8",
+                                  rerank_path=str(tmp_path / "rerank.f32"))
+    for start in (0, 100):
+        index.add_batch(vectors(100, seed=start), [f"doc {i}" for i in range(start, start + 100)])
+    assert index.merge()
+    merged = index._sealed[0]
+    rerank_file = tmp_path / f"rerank.f32.{merged.name}"
+    assert merged.index.can_rerank and rerank_file.exists()
+    index.add_batch(vectors(100, seed=200), [f"doc {i}" for i in range(200, 300)])
+    with index._reading():
+        assert index.merge()
+        assert merged not in index._segments
+        # A search that picked up the old layout can still re-rank against it
+        assert rerank_file.exists()
+        assert merged.index.search_batch(vectors(1, seed=7), 5, rerank=True)[0]
+    assert not rerank_file.exists()
+    assert index.ntotal == 300
+
+def test_save_does_not_block_writers_during_disk_writes(tmp_path, monkeypatch):
+    index = SegmentedVectorSearch(DIMENSION, segment_size=100)
+    index.add_batch(vectors(150), [f"doc {i}" for i in range(150)])
+    write_snapshot = VectorSearch.write_snapshot
+    writing, added = threading.Event(), threading.Event()
+
+    def slow_write_snapshot(self, *args):
+        # The add only completes here if save() released the write lock
+        writing.set()
+        assert added.wait(10)
+        return write_snapshot(self, *args)
+
+    monkeypatch.setattr(VectorSearch, "write_snapshot", slow_write_snapshot)
+    save = threading.Thread(target=index.save, args=(str(tmp_path),))
+    save.start()
+    assert writing.wait(10)
+    index.add_batch(vectors(1, seed=1), ["during save"])
+    added.set()
+    save.join()
+    monkeypatch.undo()
+    loaded = SegmentedVectorSearch.load(str(tmp_path))
+    # The snapshot is the state before the add, which stays unsaved
+    assert loaded.ntotal == 150
+    assert index.has_unsaved_changes
+    index.save(str(tmp_path))
+    assert SegmentedVectorSearch.load(str(tmp_path)).ntotal == 151
@@ -0,0 +1,59 @@
+import numpy as np
+import pytest
+from services.sharded_vector_search import ShardedVectorSearch, merge_results
+from services.vector_search import VectorSearch
+
+DIMENSION = 8
+
+def vectors(n, seed=0):
+    return np.random.default_rng(seed).standard_normal((n, DIMENSION)).astype(np.float32)
+
+@pytest.fixture(params=["round_robin", "hash"])
+def sharded(request):
+    index = ShardedVectorSearch(DIMENSION, 3, placement=request.param)
+    yield index
+    index.close()
+
+def test_search_matches_a_single_index(sharded):
+    single = VectorSearch(DIMENSION)
+    metadata = [{"tenant": "ab"[i % 2]} for i in range(100)]
+    for index in (sharded, single):
+        assert index.add_batch(vectors(100), [f"doc {i}" for i in range(100)], metadata=metadata) == list(range(100))
+    # Every shard got a share of the documents
+    assert all(shard.ntotal for shard in sharded.shards)
+    queries = vectors(4, seed=1)
+    for filter in (None, {"tenant": "a"}):
+        expected = [[hit["id"] for hit in hits] for hits in single.search_batch(queries, 10, filter=filter)]
+        assert [[hit["id"] for hit in hits] for hits in sharded.search_batch(queries, 10, filter=filter)] == expected
+
+def test_upserts_and_deletes_reach_the_owning_shard(sharded):
+    sharded.add_batch(vectors(30), [f"doc {i}" for i in range(30)])
+    sharded.add_batch(vectors(2, seed=1), ["doc 4 v2", "doc 1000"], [4, 1000])
+    assert sharded.delete([7, 8, 12345]) == 2
+    assert sharded.ntotal == 29
+    assert sharded.documents([4, 7, 1000, 0]) == ["doc 4 v2", None, "doc 1000", "doc 0"]
+    assert sharded.contains(1000) and not sharded.contains(8)
+    # Fresh ids continue past the largest explicit id, unique across shards
+    assert sharded.add_batch(vectors(1, seed=2), ["new"]) == [1001]
+    np.testing.assert_array_equal(sharded.vectors([4])[0], vectors(2, seed=1)[0])
+
+def test_snapshot_round_trip(sharded, tmp_path):
+    sharded.add_batch(vectors(50), [f"doc {i}" for i in range(50)])
+    sharded.delete([3])
+    sharded.save(str(tmp_path))
+    loaded = ShardedVectorSearch.load(str(tmp_path))
+    try:
+        assert loaded.placement == sharded.placement and len(loaded.shards) == 3
+        query = vectors(1, seed=5)
+        assert loaded.search_batch(query, 49) == sharded.search_batch(query, 49)
+        assert loaded.add_batch(vectors(1, seed=6), ["new"]) == [50]
+    finally:
+        loaded.close()
+
+def test_merge_results_keeps_the_best_k():
+    def part(*scores):
+        return [[{"id": score, "similarity": score} for score in scores]], [{"recall_loss": None}]
+
+    hits, stats = merge_results([part(0.9, 0.5), part(0.8, 0.7, 0.1)], 3)
+    assert [hit["similarity"] for hit in hits[0]] == [0.9, 0.8, 0.7]
+    assert stats == [{"recall_loss": None}]
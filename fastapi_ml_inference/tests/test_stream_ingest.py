@@ -0,0 +1,62 @@
+import asyncio
+import json
+from services.stream_ingest import MAX_REPORTED_ERRORS, ingest_ndjson, iter_ndjson_lines
+
+async def chunked(*chunks):
+    for chunk in chunks:
+        yield chunk
+
+async def collect(iterator):
+    return [item async for item in iterator]
+
+def lines(*chunks, max_line_bytes=100):
+    return asyncio.run(collect(iter_ndjson_lines(chunked(*chunks), max_line_bytes)))
+
+def test_lines_split_across_chunks():
+    assert lines(b'{"a"', b': 1}\n\n  \n{"b": 2}\r\n{"c"', b": 3}") == [
+        (1, b'{"a": 1}'), (4, b'{"b": 2}\r'), (5, b'{"c": 3}')]
+
+def test_overlong_lines_are_skipped_without_buffering():
+    assert lines(b"x" * 60, b"x" * 60 + b"\nok\n" + b"y" * 200, max_line_bytes=100) == [(1, None), (2, b"ok"), (3, None)]
+
+def ingest(chunks, batch_size, index_batch):
+    records = asyncio.run(collect(ingest_ndjson(iter_ndjson_lines(chunked(*chunks), 1000), json.loads,
+                                                index_batch, batch_size)))
+    return [record for record in records if "error" in record], [record for record in records if "error" not in record]
+
+def test_batches_are_indexed_in_order_with_running_totals():
+    indexed = []
+
+    async def index_batch(batch):
+        indexed.append(batch)
+        return {"skipped": 1}
+
+    body = b"".join(json.dumps(i).encode() + b"\n" for i in range(7)) + b"not json\n"
+    errors, progress = ingest([body], 3, index_batch)
+    assert indexed == [[0, 1, 2], [3, 4, 5], [6]]
+    assert [record["line"] for record in errors] == [8]
+    assert [record["indexed"] for record in progress[:-1]] == [3, 6, 7]
+    assert [record["skipped"] for record in progress[:-1]] == [1, 2, 3]
+    assert progress[-1]["done"] and progress[-1]["indexed"] == 7 and progress[-1]["errors"] == 1
+
+def test_reading_waits_for_the_batch_in_flight():
+    in_flight = 0
+    most = 0
+
+    async def index_batch(batch):
+        nonlocal in_flight, most
+        in_flight += 1
+        most = max(most, in_flight)
+        await asyncio.sleep(0.01)
+        in_flight -= 1
+
+    ingest([b"1\n" * 20], 2, index_batch)
+    assert most == 1
+
+def test_error_lines_are_capped():
+    async def index_batch(batch):
+        pass
+
+    errors, progress = ingest([b"bad\n" * (MAX_REPORTED_ERRORS + 5)], 10, index_batch)
+    assert len(errors) == MAX_REPORTED_ERRORS
+    assert progress[-1]["errors"] == MAX_REPORTED_ERRORS + 5
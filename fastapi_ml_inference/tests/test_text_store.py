@@ -0,0 +1,42 @@
+import pytest
+from services.text_store import TextStore
+
+TEXTS = ["hello", "", "naïve café ☕", "x" * 1000] + [f"text {i}" for i in range(600)]
+
+def filled():
+    store = TextStore()
+    store.extend(TEXTS)
+    return store
+
+def test_lookup_by_position():
+    store = filled()
+    assert len(store) == len(TEXTS)
+    assert store[2] == "naïve café ☕" and store[1] == "" and store[-1] == TEXTS[-1]
+    assert store.get_many([3, 0]) == [TEXTS[3], "hello"]
+    assert list(store.iter_range(4, 7)) == TEXTS[4:7]
+    with pytest.raises(IndexError):
+        store[len(TEXTS)]
+
+@pytest.mark.parametrize("compress", [False, True])
+@pytest.mark.parametrize("mmap", [False, True])
+def test_save_load_then_append(tmp_path, compress, mmap):
+    if compress:
+        pytest.importorskip("zstandard")
+    # Only the first `count` texts are saved, as in a snapshot taken while adds go on
+    filled().save(str(tmp_path), count=500, compress=compress, block_size=64)
+    loaded = TextStore.load(str(tmp_path), mmap=mmap)
+    assert len(loaded) == 500
+    assert loaded.get_many(range(500)) == TEXTS[:500]
+    # Appends go to the tail, after the loaded base
+    loaded.append("appended")
+    assert loaded[500] == "appended" and loaded[499] == TEXTS[499]
+    # A saved store round-trips again, base and tail together
+    loaded.save(str(tmp_path / "again"))
+    assert TextStore.load(str(tmp_path / "again")).get_many(range(501)) == TEXTS[:500] + ["appended"]
+
+def test_empty_store_round_trip(tmp_path):
+    TextStore().save(str(tmp_path))
+    loaded = TextStore.load(str(tmp_path))
+    assert len(loaded) == 0
+    loaded.append("first")
+    assert loaded[0] == "first"
@@ -0,0 +1,78 @@
+import asyncio
+import numpy as np
+import pytest
+from fastapi.testclient import TestClient
+import main
+from services.vector_codec import (ARROW_MEDIA_TYPE, ID_DTYPE, RAW_MEDIA_TYPE, VECTOR_DTYPE, ArrowStreamWriter,
+                                   hits_to_arrays, iter_raw_batches, read_arrow)
+from services.vector_search import VectorSearch
+
+DIMENSION = 4
+
+def vectors(n, seed=0):
+    return np.random.default_rng(seed).standard_normal((n, DIMENSION)).astype(np.float32)
+
+def raw_batches(chunks, row_bytes, batch_rows):
+    async def stream():
+        for chunk in chunks:
+            yield chunk
+
+    async def collect():
+        return [batch async for batch in iter_raw_batches(stream(), row_bytes, batch_rows)]
+
+    return asyncio.run(collect())
+
+def test_raw_batches_hold_whole_rows():
+    body = bytes(range(40))
+    assert raw_batches([body[:3], body[3:25], body[25:]], 4, 3) == [body[:12], body[12:24], body[24:36], body[36:]]
+    with pytest.raises(ValueError, match="partial row"):
+        raw_batches([body[:10]], 4, 3)
+
+def test_hits_to_arrays_pads_missing_hits():
+    ids, similarities = hits_to_arrays([[{"id": 7, "similarity": 0.5}], []], 2)
+    assert ids.tolist() == [[7, -1], [-1, -1]]
+    assert similarities.tolist() == [[0.5, 0.0], [0.0, 0.0]]
+
+def test_arrow_round_trip():
+    pytest.importorskip("pyarrow")
+    writer = ArrowStreamWriter([("id", "int64"), ("text", "string"), ("vector", "vector")], DIMENSION)
+    body = writer.write({"id": [1, 2], "text": ["a", None], "vector": vectors(2)})
+    body += writer.write({"id": [3], "text": ["c"], "vector": vectors(1, seed=1)})
+    body += writer.close()
+    batches = list(read_arrow(body, DIMENSION))
+    assert [(texts, ids) for _, texts, ids in batches] == [(["a", ""], [1, 2]), (["c"], [3])]
+    np.testing.assert_array_equal(batches[0][0], vectors(2))
+    with pytest.raises(ValueError, match="dimensions"):
+        list(read_arrow(body, DIMENSION + 1))
+
+@pytest.fixture
+def client(monkeypatch):
+    index = VectorSearch(DIMENSION)
+    index.add_batch(vectors(3), ["a", "b", "c"])
+    namespace = main.Namespace(main.settings.embedding_model, None, index, None, None, None)
+    monkeypatch.setitem(main.namespaces, main.settings.embedding_model, namespace)
+    return TestClient(main.app)
+
+def test_vector_search_pads_to_k(client):
+    queries = vectors(2, seed=1)
+    response = client.post("/vectors/search?k=5&return_vectors=true", content=queries.tobytes(),
+                           headers={"content-type": RAW_MEDIA_TYPE})
+    assert response.status_code == 200
+    body = response.content
+    ids = np.frombuffer(body[:2 * 5 * 8], dtype=ID_DTYPE).reshape(2, 5)
+    similarities = np.frombuffer(body[80:120], dtype=VECTOR_DTYPE).reshape(2, 5)
+    hit_vectors = np.frombuffer(body[120:], dtype=VECTOR_DTYPE).reshape(2, 5, DIMENSION)
+    assert sorted(ids[0, :3].tolist()) == [0, 1, 2]
+    assert (ids[:, 3:] == -1).all() and (similarities[:, 3:] == 0).all()
+    assert np.isnan(hit_vectors[:, 3:]).all()
+    np.testing.assert_array_equal(hit_vectors[0, 0], vectors(3)[ids[0, 0]])
+
+def test_vector_search_arrow_drops_padding(client):
+    pa = pytest.importorskip("pyarrow")
+    import pyarrow.ipc
+    response = client.post("/vectors/search?k=5", content=vectors(2, seed=1).tobytes(),
+                           headers={"content-type": RAW_MEDIA_TYPE, "accept": ARROW_MEDIA_TYPE})
+    assert response.status_code == 200
+    table = pyarrow.ipc.open_stream(pa.py_buffer(response.content)).read_all()
+    assert table.column("query").to_pylist() == [0, 0, 0, 1, 1, 1]
+    assert sorted(table.column("text").to_pylist()[:3]) == ["a", "b", "c"]
@@ -0,0 +1,113 @@
+import threading
+import numpy as np
+import pytest
+import services.vector_search as vector_search_module
+from services.vector_search import VectorSearch
+
+DIMENSION = 8
+
+def vectors(n, seed=0):
+    return np.random.default_rng(seed).standard_normal((n, DIMENSION)).astype(np.float32)
+
+def live_docs(index):
+    """{doc_id: text} of every live document, found by searching for all of them."""
+    hits = index.search_batch(vectors(1, seed=99), max(index.ntotal, 1))[0]
+    return {hit["id"]: hit["text"] for hit in hits}
+
+@pytest.fixture
+def index():
+    index = VectorSearch(DIMENSION)
+    index.add_batch(vectors(10), [f"doc {i}" for i in range(10)], metadata=[{"tenant": "ab"[i % 2]} for i in range(10)])
+    return index
+
+def test_delete_and_upsert_then_compact(index):
+    assert index.delete([3, 4, 42]) == 2
+    index.add_batch(vectors(1, seed=1), ["doc 5 v2"], [5], [{"tenant": "b"}])
+    expected = {i: f"doc {i}" for i in range(10) if i not in (3, 4)}
+    expected[5] = "doc 5 v2"
+    assert live_docs(index) == expected
+    assert index.tombstones == 3
+    assert index.compact() == 3
+    assert index.tombstones == 0
+    assert live_docs(index) == expected
+    # Fresh ids still start above every id handed out before
+    assert index.add_batch(vectors(1, seed=2), ["new"]) == [10]
+    # The upserted vector is the one searched, not the replaced one
+    assert index.search(vectors(1, seed=1)[0], 1)[0]["id"] == 5
+    assert {hit["id"] for hit in index.search_batch(vectors(1, seed=3), 10, filter={"tenant": "b"})[0]} == {1, 5, 7, 9}
+
+def test_compaction_catches_up_with_concurrent_changes(monkeypatch):
+    # Copy a few vectors per chunk, so adds and deletes land while compaction runs
+    monkeypatch.setattr(vector_search_module, "COMPACTION_CHUNK", 16)
+    index = VectorSearch(DIMENSION)
+    index.add_batch(vectors(2000), [f"doc {i}" for i in range(2000)])
+    index.delete(list(range(0, 2000, 2)))
+    expected = {i: f"doc {i}" for i in range(1, 2000, 2)}
+    compaction = threading.Thread(target=index.compact)
+    compaction.start()
+    for i in range(1, 400, 2):
+        if i % 4 == 1:
+            index.delete([i])
+            expected.pop(i)
+        else:
+            index.add_batch(vectors(1, seed=i), [f"doc {i} v2"], [i])
+            expected[i] = f"doc {i} v2"
+    compaction.join()
+    assert live_docs(index) == expected
+    assert index.ntotal == len(expected)
+
+def test_snapshot_round_trip(index, tmp_path):
+    index.delete([2])
+    index.add_batch(vectors(1, seed=1), ["doc 7 v2"], [7], [{"tenant": "a"}])
+    index.save(str(tmp_path))
+    loaded = VectorSearch.load(str(tmp_path))
+    assert live_docs(loaded) == live_docs(index)
+    assert loaded.tombstones == index.tombstones == 2
+    assert {hit["id"] for hit in loaded.search_batch(vectors(1, seed=3), 10, filter={"tenant": "a"})[0]} == {0, 4, 6, 7, 8}
+    # Deleted ids are not handed out again, and deletes still apply after the load
+    assert loaded.add_batch(vectors(1, seed=2), ["new"]) == [10]
+    assert loaded.delete([2]) == 0
+    assert loaded.delete([7]) == 1
+
+@pytest.mark.parametrize("config", [{"index_type": "flat"}, {"index_type": "hnsw", "hnsw_m": 8},
+                                    {"index_type": "flat", "storage": "int8"},
+                                    {"index_type": "ivf_flat", "nlist": 2, "train_size": 8},
+                                    {"index_type": "ivf_flat", "nlist": 2, "train_size": 100}])
+def test_mapped_snapshot_is_copied_on_first_write(config, tmp_path):
+    index = VectorSearch(DIMENSION, **config)
+    index.add_batch(vectors(10), [f"doc {i}" for i in range(10)])
+    index.save(str(tmp_path))
+    loaded = VectorSearch.load(str(tmp_path), mmap=True)
+    assert loaded._mapped
+    assert live_docs(loaded) == live_docs(index)
+    assert loaded.add_batch(vectors(1, seed=1), ["new"]) == [10]
+    assert not loaded._mapped
+    loaded.delete([0])
+    assert loaded.compact() == 1
+    assert live_docs(loaded) == {i: f"doc {i}" for i in range(1, 10)} | {10: "new"}
+
+def test_rerank_file_rewritten_after_snapshot(tmp_path):
+    rerank_path = str(tmp_path / "rerank.f32")
+    index = VectorSearch(DIMENSION, storage="int8", rerank_path=rerank_path)
+    index.add_batch(vectors(10), [f"doc {i}" for i in range(10)])
+    index.save(str(tmp_path / "index"))
+    assert VectorSearch.load(str(tmp_path / "index"), rerank_path=rerank_path).can_rerank
+    # Compacting rewrites the rerank file; a crash before the next snapshot
+    # leaves one whose rows no longer line up with the saved slots
+    index.delete([0, 1])
+    index.compact()
+    loaded = VectorSearch.load(str(tmp_path / "index"), rerank_path=rerank_path)
+    assert not loaded.can_rerank
+    assert live_docs(loaded) == {i: f"doc {i}" for i in range(10)}
+    index.save(str(tmp_path / "index"))
+    assert VectorSearch.load(str(tmp_path / "index"), rerank_path=rerank_path).can_rerank
+
+@pytest.mark.parametrize("doc_id", [-1, 2**63])
+def test_rejected_id_leaves_index_unchanged(index, doc_id):
+    before = live_docs(index)
+    with pytest.raises((ValueError, OverflowError)):
+        index.add_batch(vectors(2, seed=1), ["new", "bad"], [None, doc_id])
+    assert index.ntotal == 10
+    assert live_docs(index) == before
+    assert index.add_batch(vectors(1, seed=2), ["new"]) == [10]
+    assert live_docs(index)[10] == "new"